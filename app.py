@@ -7,13 +7,31 @@ import os
 import sqlite3
 import jwt
 import hashlib
+import hmac
 import json
+import logging
+import logging.handlers
 import uuid
+import atexit
+import click
+import bisect
+import cProfile
+import heapq
+import itertools
+import multiprocessing
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError, wait as wait_futures
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import Flask, request, jsonify, g, send_file
+from flask import Flask, request, jsonify, g, send_file, make_response, Response, has_request_context
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 
 # Конфигурация
@@ -25,6 +43,124 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
 
+# Пул соединений SQLite
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 16))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # секунды ожидания свободного соединения
+app.config['DB_JOURNAL_MODE'] = 'WAL'
+app.config['DB_SYNCHRONOUS'] = 'NORMAL'
+app.config['DB_BUSY_TIMEOUT_MS'] = 5000
+app.config['DB_MMAP_SIZE'] = 256 * 1024 * 1024  # 256MB
+app.config['DB_CACHED_STATEMENTS'] = 256
+
+# Поток записи: единственное пишущее соединение с групповой фиксацией
+app.config['DB_WRITER_ENABLED'] = os.environ.get('DB_WRITER_ENABLED', '1') == '1'
+app.config['DB_WRITER_MAX_BATCH'] = int(os.environ.get('DB_WRITER_MAX_BATCH', 64))
+app.config['DB_WRITER_MAX_WAIT_MS'] = float(os.environ.get('DB_WRITER_MAX_WAIT_MS', 2))  # ожидание заданий в пакет
+app.config['DB_WRITER_QUEUE_SIZE'] = int(os.environ.get('DB_WRITER_QUEUE_SIZE', 10000))
+app.config['DB_WRITER_TIMEOUT'] = float(os.environ.get('DB_WRITER_TIMEOUT', 10))  # секунды ожидания результата
+
+# Хеширование паролей в отдельных процессах
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))  # 0 - в потоке запроса
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 4 * (os.cpu_count() or 2)))
+app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5))  # секунды
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))  # секунды ожидания результата
+
+# Кэш аутентифицированных пользователей
+app.config['PRINCIPAL_CACHE_TTL'] = int(os.environ.get('PRINCIPAL_CACHE_TTL', 60))  # секунды
+app.config['PRINCIPAL_CACHE_SIZE'] = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000))
+
+# Кэш проверенных JWT (запись живет не дольше exp токена)
+app.config['JWT_CACHE_SIZE'] = int(os.environ.get('JWT_CACHE_SIZE', 50000))
+app.config['TOKEN_REVOCATION_SYNC_SECONDS'] = int(os.environ.get('TOKEN_REVOCATION_SYNC_SECONDS', 30))
+app.config['TOKEN_REVOCATION_BLOOM_BITS'] = 1 << 20  # 128KB: ~1% ложных срабатываний на 100 тыс. отзывов
+
+# Таблица лидеров в памяти
+app.config['LEADERBOARD_RESYNC_SECONDS'] = int(os.environ.get('LEADERBOARD_RESYNC_SECONDS', 300))
+app.config['LEADERBOARD_MAX_LIMIT'] = 200
+app.config['LEADERBOARD_MAX_RADIUS'] = 50
+
+# Снимок каталога лабораторий и CTF задач
+app.config['CATALOG_VERSION_CHECK_SECONDS'] = float(os.environ.get('CATALOG_VERSION_CHECK_SECONDS', 5))
+
+# Поток событий (Server-Sent Events)
+app.config['SSE_MAX_CLIENTS'] = int(os.environ.get('SSE_MAX_CLIENTS', 500))
+app.config['SSE_QUEUE_SIZE'] = 100  # событий в очереди клиента до отключения
+app.config['SSE_HISTORY_SIZE'] = 1000  # событий для возобновления по Last-Event-ID
+app.config['SSE_HEARTBEAT_SECONDS'] = 15
+app.config['SSE_RETRY_MS'] = 3000
+app.config['SSE_TICKET_TTL_SECONDS'] = 30  # одноразовый билет для подключения EventSource
+
+# Счетчики платформы для /api/stats/overview
+app.config['PLATFORM_COUNTERS_TTL'] = float(os.environ.get('PLATFORM_COUNTERS_TTL', 5))  # секунды
+app.config['ACTIVE_USERS_REFRESH_SECONDS'] = int(os.environ.get('ACTIVE_USERS_REFRESH_SECONDS', 300))
+
+# Ограничение частоты отправки флагов: емкость корзины и пополнение (токенов в секунду)
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+app.config['RATE_LIMITS'] = {
+    'lab_submit': {'user': (10, 0.5), 'ip': (30, 2)},
+    'ctf_submit': {'user': (10, 0.5), 'ip': (30, 2)},
+}
+app.config['RATE_LIMIT_MAX_BUCKETS'] = 100000
+
+# Буфер неверных попыток (сбрасывается в БД пакетом)
+app.config['ATTEMPT_FLUSH_SECONDS'] = float(os.environ.get('ATTEMPT_FLUSH_SECONDS', 2))
+app.config['ATTEMPT_BUFFER_MAX_PENDING'] = int(os.environ.get('ATTEMPT_BUFFER_MAX_PENDING', 1000))
+
+# Фоновый сбор системной статистики
+app.config['SYSTEM_SAMPLE_SECONDS'] = float(os.environ.get('SYSTEM_SAMPLE_SECONDS', 5))
+app.config['SYSTEM_SAMPLE_HISTORY'] = int(os.environ.get('SYSTEM_SAMPLE_HISTORY', 720))  # 1 час при интервале 5 с
+app.config['SYSTEM_TOP_PROCESSES'] = 10
+
+# Пробы liveness/readiness: бюджеты задержек и кэш результата
+app.config['READY_CACHE_SECONDS'] = float(os.environ.get('READY_CACHE_SECONDS', 1))
+app.config['READY_DB_BUDGET_MS'] = float(os.environ.get('READY_DB_BUDGET_MS', 50))
+app.config['READY_WRITER_BUDGET_MS'] = float(os.environ.get('READY_WRITER_BUDGET_MS', 250))  # ожидание в очереди записи
+app.config['READY_WRITER_MAX_QUEUE'] = float(os.environ.get('READY_WRITER_MAX_QUEUE', 0.8))  # доля заполнения очереди
+
+# Метрики в формате Prometheus
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # Bearer токен сборщика метрик (кроме JWT администратора)
+app.config['METRICS_PUBLIC'] = os.environ.get('METRICS_PUBLIC', '0') == '1'  # доступ без аутентификации
+app.config['METRICS_SHARDS'] = 16
+
+# Трассировка SQL и журнал медленных запросов (включается явно)
+app.config['SQL_TRACE_ENABLED'] = os.environ.get('SQL_TRACE_ENABLED', '0') == '1'
+app.config['SQL_SLOW_QUERY_MS'] = float(os.environ.get('SQL_SLOW_QUERY_MS', 50))
+app.config['SQL_SLOW_LOG_SIZE'] = 200
+app.config['SQL_DEBUG_HEADER'] = os.environ.get('SQL_DEBUG_HEADER', '1') == '1'  # X-SQL-* для администраторов
+
+# Профилирование запросов (X-Profile: pstats|collapsed или ?_profile=..., только для администраторов)
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+app.config['PROFILE_SAMPLE_INTERVAL_MS'] = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 1))
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # доля случайно профилируемых запросов
+app.config['PROFILE_MAX_STACKS_PER_ROUTE'] = int(os.environ.get('PROFILE_MAX_STACKS_PER_ROUTE', 2000))
+app.config['PROFILE_MAX_DEPTH'] = 64
+
+# Журнал активности: очередь в памяти, пакетная запись в фоне, срок хранения
+app.config['ACTIVITY_LOG_ENABLED'] = os.environ.get('ACTIVITY_LOG_ENABLED', '1') == '1'
+app.config['ACTIVITY_LOG_METHODS'] = ('POST', 'PUT', 'PATCH', 'DELETE')
+app.config['ACTIVITY_LOG_QUEUE_SIZE'] = int(os.environ.get('ACTIVITY_LOG_QUEUE_SIZE', 10000))
+app.config['ACTIVITY_LOG_BATCH_SIZE'] = int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', 500))
+app.config['ACTIVITY_LOG_FLUSH_SECONDS'] = float(os.environ.get('ACTIVITY_LOG_FLUSH_SECONDS', 1))
+app.config['ACTIVITY_LOG_DROP_POLICY'] = os.environ.get('ACTIVITY_LOG_DROP_POLICY', 'newest')  # newest|oldest
+app.config['ACTIVITY_LOG_RETENTION_DAYS'] = int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', 90))
+app.config['ACTIVITY_LOG_PRUNE_BATCH'] = 5000  # строк на транзакцию удаления
+app.config['ACTIVITY_LOG_PRUNE_SECONDS'] = int(os.environ.get('ACTIVITY_LOG_PRUNE_SECONDS', 3600))
+
+# Структурированные журналы (JSON): доступ и ошибки, запись в файлы через отдельный поток
+app.config['LOG_ENABLED'] = os.environ.get('LOG_ENABLED', '1') == '1'
+app.config['LOG_DIR'] = os.environ.get('LOG_DIR', 'logs')
+app.config['LOG_MAX_BYTES'] = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))  # размер файла до ротации
+app.config['LOG_BACKUP_COUNT'] = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+app.config['LOG_QUEUE_SIZE'] = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+app.config['ACCESS_LOG_SAMPLE_RATE'] = float(os.environ.get('ACCESS_LOG_SAMPLE_RATE', 1))  # доля успешных запросов
+app.config['ACCESS_LOG_SLOW_MS'] = float(os.environ.get('ACCESS_LOG_SLOW_MS', 500))  # медленные пишутся всегда
+app.config['REQUEST_ID_HEADER'] = 'X-Request-ID'
+
+# Фоновые задачи процесса (отзыв токенов, сброс попыток, мониторинг, очистка журнала активности)
+app.config['BACKGROUND_TASKS_ENABLED'] = os.environ.get('BACKGROUND_TASKS_ENABLED', '1') == '1'
+
 # Разрешаем CORS для всех доменов в разработке
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
@@ -33,11 +169,335 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs('static/avatars', exist_ok=True)
 
 # ===== БАЗА ДАННЫХ =====
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор, учитывающий число запросов и время их выполнения в соединении"""
+
+    def execute(self, sql, parameters=()):
+        conn = self.connection
+        conn.trace_events = 0
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            conn.sql_count += 1
+            conn.sql_time += elapsed
+            if app.config['SQL_TRACE_ENABLED'] and elapsed * 1000 >= app.config['SQL_SLOW_QUERY_MS']:
+                sql_tracer.record_slow(conn, sql, parameters, elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        conn = self.connection
+        conn.trace_events = 0
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            conn.sql_count += 1
+            conn.sql_time += elapsed
+            if app.config['SQL_TRACE_ENABLED'] and elapsed * 1000 >= app.config['SQL_SLOW_QUERY_MS']:
+                sql_tracer.record_slow(conn, sql, None, elapsed)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Соединение со счетчиками SQL (сбрасываются при выдаче из пула)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.trace_events = 0
+
+    def trace_statement(self, statement):
+        """Обработчик set_trace_callback: число реально выполненных команд (с триггерами)"""
+        self.trace_events += 1
+
+    def configure_tracing(self):
+        """Включение/выключение трассировки по текущей конфигурации"""
+        self.set_trace_callback(self.trace_statement if app.config['SQL_TRACE_ENABLED'] else None)
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        # Connection.execute в C обходит cursor(), поэтому идем через курсор явно
+        return self.cursor().execute(sql, parameters)
+
+# Маршрут, от имени которого выполняется SQL вне контекста запроса (задания потока записи)
+sql_trace_context = threading.local()
+
+class SqlTracer:
+    """Журнал медленных запросов с планом выполнения и привязкой к маршруту"""
+
+    def __init__(self, log_size):
+        self._lock = threading.Lock()
+        self.entries = deque(maxlen=log_size)
+        self.by_statement = {}  # (маршрут, SQL) -> [число, суммарное время, максимум]
+        self.max_statements = 500
+        self._plans = {}
+
+    @staticmethod
+    def current_route():
+        route = getattr(sql_trace_context, 'route', None)
+        if route:
+            return route
+        if has_request_context():
+            return request.endpoint or 'unmatched'
+        return threading.current_thread().name
+
+    def explain(self, conn, sql, parameters):
+        """EXPLAIN QUERY PLAN (кэшируется по тексту запроса)"""
+        plan = self._plans.get(sql)
+        if plan is not None:
+            return plan
+        try:
+            # Обычный курсор: план не должен попадать в счетчики и журнал
+            cursor = conn.cursor(sqlite3.Cursor)
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parameters or ())
+            plan = [row[3] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            plan = [f'нет плана: {e}']
+        if len(self._plans) < self.max_statements:
+            self._plans[sql] = plan
+        return plan
+
+    def record_slow(self, conn, sql, parameters, elapsed):
+        route = self.current_route()
+        statement = ' '.join(sql.split())
+        plan = self.explain(conn, sql, parameters) if parameters is not None else []
+        # SCAN без USING - полный просмотр таблицы
+        scanned = [step.split()[1] for step in plan
+                   if step.startswith('SCAN ') and 'USING' not in step and len(step.split()) > 1]
+        duration_ms = round(elapsed * 1000, 3)
+
+        entry = {
+            'timestamp': datetime.now().isoformat(),
+            'route': route,
+            'sql': statement,
+            'duration_ms': duration_ms,
+            'plan': plan,
+            'full_scan': bool(scanned),
+            'scanned_tables': scanned,
+            'trace_events': conn.trace_events
+        }
+        with self._lock:
+            self.entries.append(entry)
+            key = (route, statement)
+            stats = self.by_statement.get(key)
+            if stats is None and len(self.by_statement) < self.max_statements:
+                stats = self.by_statement[key] = [0, 0.0, 0.0]
+            if stats is not None:
+                stats[0] += 1
+                stats[1] += duration_ms
+                stats[2] = max(stats[2], duration_ms)
+
+        # Значения параметров в журнал не попадают (флаги, хеши паролей)
+        app.logger.warning(
+            f"Медленный SQL {duration_ms} мс [{route}]{' ПОЛНЫЙ ПРОСМОТР ' + ', '.join(scanned) if scanned else ''}: "
+            f"{statement[:500]}"
+        )
+
+    def report(self, limit=50):
+        with self._lock:
+            top = sorted(self.by_statement.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+            return {
+                'enabled': app.config['SQL_TRACE_ENABLED'],
+                'threshold_ms': app.config['SQL_SLOW_QUERY_MS'],
+                'recent': list(self.entries)[-limit:],
+                'top': [
+                    {'route': route, 'sql': sql, 'count': count,
+                     'total_ms': round(total, 3), 'max_ms': round(longest, 3)}
+                    for (route, sql), (count, total, longest) in top
+                ]
+            }
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.by_statement.clear()
+            self._plans.clear()
+
+sql_tracer = SqlTracer(app.config['SQL_SLOW_LOG_SIZE'])
+
+class ConnectionPool:
+    """Ограниченный потокобезопасный пул соединений SQLite"""
+
+    def __init__(self, database, max_size=16, timeout=10.0, journal_mode='WAL',
+                 synchronous='NORMAL', busy_timeout_ms=5000, mmap_size=0, cached_statements=128):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Счетчики для мониторинга
+        self._in_use = 0
+        self._created = 0
+        self._acquired = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+    def connect(self):
+        """Создание нового соединения с настроенными PRAGMA"""
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=InstrumentedConnection
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA journal_mode={self.journal_mode}')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        return conn
+
+    def acquire(self):
+        """Получение соединения из пула (ждет, если все заняты)"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Пул соединений закрыт')
+
+            if not self._idle and self._size >= self.max_size:
+                self._waits += 1
+                started = time.monotonic()
+                deadline = started + self.timeout
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise TimeoutError('Нет свободных соединений с базой данных')
+                    self._cond.wait(remaining)
+                waited = time.monotonic() - started
+                self._wait_time += waited
+                self._max_wait_time = max(self._max_wait_time, waited)
+
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                # Резервируем место до создания соединения вне блокировки
+                self._size += 1
+                conn = None
+
+            self._in_use += 1
+            self._acquired += 1
+
+        if conn is None:
+            try:
+                conn = self.connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._created += 1
+
+        return conn
+
+    def release(self, conn):
+        """Возврат соединения в пул"""
+        broken = False
+        try:
+            # Незавершенная транзакция не должна перейти к следующему запросу
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            broken = True
+
+        with self._cond:
+            self._in_use -= 1
+            if broken or self._closed:
+                self._size -= 1
+                self._discarded += 1
+                conn.close()
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def close(self):
+        """Закрытие всех свободных соединений"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._idle.pop().close()
+                self._size -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """Статистика пула для мониторинга"""
+        with self._cond:
+            return {
+                'database': self.database,
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'created': self._created,
+                'acquired': self._acquired,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time, 6),
+                'wait_time_max': round(self._max_wait_time, 6),
+                'timeouts': self._timeouts,
+                'discarded': self._discarded
+            }
+
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Пул соединений для текущей конфигурации БД"""
+    pool = app.extensions.get('cybersib_db_pool')
+    if pool is not None and pool.database == app.config['DATABASE']:
+        return pool
+
+    with _db_pool_lock:
+        pool = app.extensions.get('cybersib_db_pool')
+        if pool is None or pool.database != app.config['DATABASE']:
+            if pool is not None:
+                pool.close()
+            pool = ConnectionPool(
+                app.config['DATABASE'],
+                max_size=app.config['DB_POOL_SIZE'],
+                timeout=app.config['DB_POOL_TIMEOUT'],
+                journal_mode=app.config['DB_JOURNAL_MODE'],
+                synchronous=app.config['DB_SYNCHRONOUS'],
+                busy_timeout_ms=app.config['DB_BUSY_TIMEOUT_MS'],
+                mmap_size=app.config['DB_MMAP_SIZE'],
+                cached_statements=app.config['DB_CACHED_STATEMENTS']
+            )
+            app.extensions['cybersib_db_pool'] = pool
+        return pool
+
+def request_sql_stats():
+    """Число и время SQL текущего запроса: соединение запроса и его задания в потоке записи"""
+    db = g.get('db')
+    written = g.get('sql_write_stats')
+    if db is None and written is None:
+        return None
+    sql_count = (db.sql_count if db is not None else 0) + (written[0] if written else 0)
+    sql_time = (db.sql_time if db is not None else 0.0) + (written[1] if written else 0.0)
+    return sql_count, sql_time
+
 def get_db():
     """Получение соединения с базой данных"""
     if 'db' not in g:
-        g.db = sqlite3.connect(app.config['DATABASE'])
-        g.db.row_factory = sqlite3.Row
+        g.db_pool = get_db_pool()
+        g.db = g.db_pool.acquire()
+        g.db.sql_count = 0
+        g.db.sql_time = 0.0
+        g.db.configure_tracing()
     return g.db
 
 def init_db():
@@ -51,6 +511,26 @@ def init_db():
         # Добавляем тестовые данные
         create_test_data(db)
 
+def upgrade_db():
+    """Применение schema.sql к существующей базе (все объекты IF NOT EXISTS)"""
+    with app.app_context():
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        existing_tables = {row['name'] for row in cursor.fetchall()}
+        
+        with app.open_resource('schema.sql', mode='r') as f:
+            cursor.executescript(f.read())
+        
+        # Новые материализованные таблицы заполняются из истории решений
+        if 'user_scores' not in existing_tables:
+            rebuild_user_scores(cursor)
+        if 'user_daily_activity' not in existing_tables:
+            rebuild_daily_activity(cursor)
+        if 'platform_counters' not in existing_tables:
+            rebuild_platform_counters(cursor)
+        db.commit()
+
 def create_test_data(db):
     """Создание тестовых данных для демонстрации"""
     try:
@@ -63,10 +543,10 @@ def create_test_data(db):
         if count == 0:
             # Тестовые пользователи
             test_users = [
-                ('test_student', 'test@cybersib.spt', generate_password_hash('test123'), 'ИБ-23', 'free', 'student'),
-                ('demo', 'demo@cybersib.spt', generate_password_hash('demo2024'), 'Демо', 'free', 'student'),
-                ('ctf_champion', 'champ@cybersib.spt', generate_password_hash('champ123'), 'ИБ-22', 'premium', 'student'),
-                ('admin', 'admin@cybersib.spt', generate_password_hash('admin2025'), 'Админ', 'premium', 'admin')
+                ('test_student', 'test@cybersib.spt', password_hasher.hash('test123'), 'ИБ-23', 'free', 'student'),
+                ('demo', 'demo@cybersib.spt', password_hasher.hash('demo2024'), 'Демо', 'free', 'student'),
+                ('ctf_champion', 'champ@cybersib.spt', password_hasher.hash('champ123'), 'ИБ-22', 'premium', 'student'),
+                ('admin', 'admin@cybersib.spt', password_hasher.hash('admin2025'), 'Админ', 'premium', 'admin')
             ]
             
             cursor.executemany('''
@@ -151,6 +631,9 @@ def create_test_data(db):
                           datetime.now().isoformat(), 
                           1, 100))
             
+            rebuild_user_scores(cursor)
+            rebuild_daily_activity(cursor)
+            rebuild_platform_counters(cursor)
             db.commit()
             print("Тестовые данные успешно добавлены")
             
@@ -158,146 +641,2909 @@ def create_test_data(db):
         print(f"Ошибка при создании тестовых данных: {e}")
         db.rollback()
 
-@app.teardown_appcontext
-def close_db(error):
-    """Закрытие соединения с БД"""
-    if hasattr(g, 'db'):
-        g.db.close()
+@app.teardown_appcontext
+def close_db(error):
+    """Возврат соединения с БД в пул"""
+    db = g.pop('db', None)
+    if db is not None:
+        g.pop('db_pool').release(db)
+
+# ---- ПОТОК ЗАПИСИ ----
+class DatabaseBusy(Exception):
+    """Запись не выполнена: очередь потока записи переполнена или задание не дождалось
+    выполнения и отменено (повтор запроса безопасен)"""
+
+class DatabaseWriteTimeout(DatabaseBusy):
+    """Задание уже выполнялось, но результат не получен вовремя (запись могла зафиксироваться)"""
+
+class WriteJob:
+    """Задание записи: функция func(cursor) и ожидающий результат Future"""
+    __slots__ = ('func', 'future', 'enqueued_at', 'route', 'sql_stats')
+
+    def __init__(self, func):
+        self.func = func
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        # Маршрут-источник для журнала медленных запросов
+        self.route = SqlTracer.current_route()
+        # SQL задания засчитывается запросу, который его поставил
+        self.sql_stats = g.setdefault('sql_write_stats', [0, 0.0]) if has_request_context() else None
+
+class DatabaseWriter:
+    """Поток, владеющий единственным пишущим соединением: задания объединяются в одну транзакцию"""
+
+    def __init__(self, pool, max_batch=64, max_wait=0.002, queue_size=10000, timeout=10.0):
+        self.database = pool.database
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._stopped = False
+        self._lock = threading.Lock()
+
+        # Счетчики для мониторинга
+        self._batches = 0
+        self._jobs = 0
+        self._failed_jobs = 0
+        self._failed_batches = 0
+        self._rejected = 0
+        self._cancelled = 0
+        self._timed_out = 0
+        self._restarts = 0
+        self._max_batch_size = 0
+        self._commit_time = 0.0
+        self._max_commit_time = 0.0
+        self._max_queue_wait = 0.0
+        self._last_queue_wait = 0.0
+
+    def start(self):
+        """Запуск потока (и перезапуск, если он завершился из-за ошибки)"""
+        with self._lock:
+            if self._stopped or (self._thread is not None and self._thread.is_alive()):
+                return
+            if self._thread is not None:
+                self._restarts += 1
+                app.logger.error('Поток записи в БД не работает, перезапуск')
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """Остановка после выполнения уже поставленных заданий"""
+        with self._lock:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, func):
+        """Постановка задания в очередь (Future с результатом func или ее исключением)"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            self.start()
+            if self._stopped:
+                raise DatabaseBusy('Поток записи в базу данных остановлен')
+        job = WriteJob(func)
+        try:
+            self._queue.put(job, timeout=self.timeout)
+        except queue.Full:
+            self._rejected += 1
+            raise DatabaseBusy('Очередь записи в базу данных переполнена')
+        return job.future
+
+    def execute(self, func):
+        """Выполнение func(cursor) в потоке записи с ожиданием результата"""
+        future = self.submit(func)
+        done, _ = wait_futures((future,), self.timeout)
+        if not done:
+            # Задание еще в очереди: после отмены оно не выполнится
+            if future.cancel():
+                self._cancelled += 1
+                raise DatabaseBusy('Запись в базу данных не дождалась очереди')
+            # Задание уже выполняется: ждем фиксации пакета еще один интервал
+            done, _ = wait_futures((future,), self.timeout)
+            if not done:
+                self._timed_out += 1
+                raise DatabaseWriteTimeout('Результат записи в базу данных не получен вовремя')
+        return future.result()
+
+    def _run(self):
+        try:
+            conn = self.pool.connect()
+        except Exception as e:
+            app.logger.error(f"Поток записи в БД не смог открыть соединение: {e}")
+            return
+        # Транзакциями управляем сами: BEGIN/SAVEPOINT/COMMIT
+        conn.isolation_level = None
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    break
+                batch = [job]
+                stopping = False
+                deadline = time.monotonic() + self.max_wait
+
+                # Добираем задания, пришедшие за время ожидания или предыдущей фиксации
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        stopping = True
+                        break
+                    batch.append(job)
+
+                self._run_batch(conn, batch)
+                if stopping:
+                    break
+        except Exception:
+            # Следующий submit перезапустит поток
+            app.logger.exception('Поток записи в БД остановлен из-за ошибки')
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _charge(job, conn, sql_count, sql_time):
+        """SQL задания в счетчики запроса-источника (до выдачи результата в Future)"""
+        if job.sql_stats is not None:
+            job.sql_stats[0] += conn.sql_count - sql_count
+            job.sql_stats[1] += conn.sql_time - sql_time
+
+    def _run_batch(self, conn, batch):
+        """Одна транзакция на пакет; ошибка задания откатывает только его точку сохранения"""
+        # Отмененные по таймауту задания пропускаются, остальные больше нельзя отменить
+        batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.monotonic()
+        outcomes = []
+        try:
+            conn.configure_tracing()
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.cursor()
+            for job in batch:
+                sql_trace_context.route = job.route
+                cursor.execute('SAVEPOINT write_job')
+                sql_count, sql_time = conn.sql_count, conn.sql_time
+                try:
+                    result = job.func(cursor)
+                except Exception as e:
+                    self._charge(job, conn, sql_count, sql_time)
+                    cursor.execute('ROLLBACK TO write_job')
+                    cursor.execute('RELEASE write_job')
+                    outcomes.append((job, None, e))
+                else:
+                    self._charge(job, conn, sql_count, sql_time)
+                    cursor.execute('RELEASE write_job')
+                    outcomes.append((job, result, None))
+            sql_trace_context.route = None
+            conn.execute('COMMIT')
+        except Exception as e:
+            sql_trace_context.route = None
+            # Транзакция не зафиксирована - ошибка у всех заданий пакета
+            try:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            outcomes = [(job, None, e) for job in batch]
+            self._failed_batches += 1
+
+        elapsed = time.monotonic() - started
+        self._batches += 1
+        self._jobs += len(batch)
+        self._max_batch_size = max(self._max_batch_size, len(batch))
+        self._commit_time += elapsed
+        self._max_commit_time = max(self._max_commit_time, elapsed)
+        self._last_queue_wait = started - batch[0].enqueued_at
+        self._max_queue_wait = max(self._max_queue_wait, self._last_queue_wait)
+
+        for job, result, error in outcomes:
+            if error is not None:
+                self._failed_jobs += 1
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    def stats(self):
+        """Статистика потока записи для мониторинга"""
+        return {
+            'database': self.database,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            'batches': self._batches,
+            'jobs': self._jobs,
+            'avg_batch_size': round(self._jobs / self._batches, 3) if self._batches else 0,
+            'max_batch_size': self._max_batch_size,
+            'failed_jobs': self._failed_jobs,
+            'failed_batches': self._failed_batches,
+            'rejected': self._rejected,
+            'cancelled': self._cancelled,
+            'timed_out': self._timed_out,
+            'restarts': self._restarts,
+            'transaction_time_total': round(self._commit_time, 6),
+            'transaction_time_max': round(self._max_commit_time, 6),
+            'queue_wait_last': round(self._last_queue_wait, 6),
+            'queue_wait_max': round(self._max_queue_wait, 6)
+        }
+
+_db_writer_lock = threading.Lock()
+
+def get_db_writer():
+    """Поток записи для текущей конфигурации БД (запускается при первом обращении)"""
+    writer = app.extensions.get('cybersib_db_writer')
+    if writer is not None and writer.database == app.config['DATABASE']:
+        return writer
+
+    with _db_writer_lock:
+        writer = app.extensions.get('cybersib_db_writer')
+        if writer is None or writer.database != app.config['DATABASE']:
+            if writer is not None:
+                writer.stop()
+            writer = DatabaseWriter(
+                get_db_pool(),
+                max_batch=app.config['DB_WRITER_MAX_BATCH'],
+                max_wait=app.config['DB_WRITER_MAX_WAIT_MS'] / 1000,
+                queue_size=app.config['DB_WRITER_QUEUE_SIZE'],
+                timeout=app.config['DB_WRITER_TIMEOUT']
+            )
+            writer.start()
+            app.extensions['cybersib_db_writer'] = writer
+        return writer
+
+def run_write(func):
+    """Запись в БД: func(cursor) выполняется в потоке записи, возвращается ее результат"""
+    if not app.config['DB_WRITER_ENABLED']:
+        db = get_db()
+        try:
+            result = func(db.cursor())
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return result
+    return get_db_writer().execute(func)
+
+def database_busy_response(error):
+    """Ответ, если запись не дождалась потока записи"""
+    if isinstance(error, DatabaseWriteTimeout):
+        # Запись могла выполниться: клиент должен проверить результат, а не повторять вслепую
+        return jsonify({'error': 'Запись выполняется дольше обычного, проверьте результат позже'}), 504
+    response = jsonify({'error': 'Сервер перегружен, повторите попытку позже'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@atexit.register
+def stop_db_writer():
+    writer = app.extensions.get('cybersib_db_writer')
+    if writer is not None:
+        writer.stop()
+
+# ===== КЭШИ =====
+class TTLCache:
+    """Потокобезопасный LRU-кэш с ограничением по размеру и времени жизни"""
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        """Значение по ключу или None, если его нет или оно устарело"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self._misses += 1
+                return None
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Сохранение значения (ttl переопределяет время жизни записи)"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key):
+        """Удаление записи"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Очистка кэша"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Статистика кэша для мониторинга"""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions
+            }
+
+class ExpiringSet:
+    """Множество ключей со сроком действия: ключ удаляется только после своего срока
+    (размер ограничен числом ключей, выданных за время жизни, а не вытеснением)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expires = {}
+        self._heap = []  # (срок, ключ) для удаления истекших
+
+    def add(self, key, expires_at):
+        """Атомарное добавление (expires_at - unix-время); False, если ключ уже есть"""
+        now = time.time()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, expired = heapq.heappop(self._heap)
+                self._expires.pop(expired, None)
+            if key in self._expires:
+                return False
+            self._expires[key] = expires_at
+            heapq.heappush(self._heap, (expires_at, key))
+            return True
+
+    def __len__(self):
+        return len(self._expires)
+
+class DataVersions:
+    """Счетчики версий снимков данных в памяти процесса (сброс кэшей после своих записей)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scopes = {}
+
+    def bump(self, *scopes):
+        """Отметка изменения данных в областях scopes"""
+        with self._lock:
+            for scope in scopes:
+                self._scopes[scope] = self._scopes.get(scope, 0) + 1
+
+    def get(self, scope):
+        return self._scopes.get(scope, 0)
+
+# Идентификатор процесса: ETag другого процесса или до перезапуска не совпадет
+INSTANCE_ID = uuid.uuid4().hex[:8]
+STARTED_AT = time.monotonic()
+
+data_versions = DataVersions()
+
+class Principal:
+    """Компактное представление аутентифицированного пользователя (без хеша пароля)"""
+    __slots__ = ('id', 'username', 'email', 'user_group', 'subscription_level',
+                 'role', 'avatar_url', 'created_at', 'last_login', 'is_active')
+
+    def __init__(self, row):
+        for field in self.__slots__:
+            setattr(self, field, row[field])
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+principal_cache = TTLCache(
+    max_size=app.config['PRINCIPAL_CACHE_SIZE'],
+    ttl=app.config['PRINCIPAL_CACHE_TTL']
+)
+
+def load_principal(user_id):
+    """Пользователь из кэша или из БД"""
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute(f"SELECT {', '.join(Principal.__slots__)} FROM users WHERE id = ?", (user_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+
+    principal = Principal(row)
+    principal_cache.set(user_id, principal)
+    return principal
+
+def invalidate_principal(user_id):
+    """Сброс кэша пользователя после изменения его данных"""
+    principal_cache.invalidate(user_id)
+
+# ===== ХЕШИРОВАНИЕ ПАРОЛЕЙ =====
+class PasswordHasherBusy(Exception):
+    """Очередь хеширования паролей переполнена"""
+
+def password_method_prefix(method):
+    """Префикс хеша для метода generate_password_hash (Werkzeug дополняет короткие имена
+    параметрами по умолчанию)"""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f"Неизвестный метод хеширования паролей '{method}'")
+
+class PasswordHasher:
+    """Ограниченный пул процессов для KDF (хеширование и проверка паролей)"""
+
+    def __init__(self, method, workers, max_pending, queue_timeout, timeout):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._method_prefix = password_method_prefix(method)
+
+        # Метрики
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._result_timeouts = 0
+        self._rehashed = 0
+        self._latencies = deque(maxlen=1000)
+        self._max_latency = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    # spawn: безопасно для процесса с уже запущенными потоками
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._executor
+
+    def _run(self, func, *args):
+        with self._lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self._waiting -= 1
+            if not acquired:
+                self._timeouts += 1
+            else:
+                self._in_flight += 1
+        if not acquired:
+            raise PasswordHasherBusy()
+
+        def release(_=None):
+            self._slots.release()
+            with self._lock:
+                self._in_flight -= 1
+
+        started = time.monotonic()
+        future = None
+        succeeded = False
+        try:
+            if self.workers > 0:
+                future = self._get_executor().submit(func, *args)
+                try:
+                    result = future.result(timeout=self.timeout)
+                except FutureTimeoutError:
+                    future.cancel()
+                    with self._lock:
+                        self._result_timeouts += 1
+                    raise PasswordHasherBusy()
+            else:
+                result = func(*args)
+            succeeded = True
+            return result
+        finally:
+            latency = time.monotonic() - started
+            # Слот занят, пока процесс пула не закончит брошенное по таймауту задание
+            if future is not None and not future.done():
+                future.add_done_callback(release)
+            else:
+                release()
+            with self._lock:
+                if succeeded:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                self._latencies.append(latency)
+                self._max_latency = max(self._max_latency, latency)
+
+    def hash(self, password):
+        """Хеш пароля с текущими параметрами"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        """Проверка пароля"""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Хеш создан с параметрами, отличными от текущих"""
+        return password_hash.split('$', 1)[0] != self._method_prefix
+
+    def record_rehash(self):
+        with self._lock:
+            self._rehashed += 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                'method': self.method,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'queue_depth': self._waiting,
+                'in_flight': self._in_flight,
+                'completed': self._completed,
+                'failed': self._failed,
+                'timeouts': self._timeouts,
+                'result_timeouts': self._result_timeouts,
+                'rehashed': self._rehashed,
+                'latency_p50': round(latencies[len(latencies) // 2], 6) if latencies else None,
+                'latency_p95': round(latencies[int(len(latencies) * 0.95)], 6) if latencies else None,
+                'latency_max': round(self._max_latency, 6)
+            }
+
+password_hasher = PasswordHasher(
+    method=app.config['PASSWORD_HASH_METHOD'],
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+    queue_timeout=app.config['PASSWORD_HASH_QUEUE_TIMEOUT'],
+    timeout=app.config['PASSWORD_HASH_TIMEOUT']
+)
+atexit.register(password_hasher.shutdown)
+
+def password_hasher_busy_response():
+    """Ответ при переполненной очереди хеширования паролей"""
+    response = jsonify({'error': 'Сервер перегружен, повторите попытку позже'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+# ===== JWT АУТЕНТИФИКАЦИЯ =====
+def encode_token(user_id, token_type, expires_in):
+    """Подписанный токен типа token_type со сроком действия expires_in (timedelta)"""
+    now = datetime.utcnow()
+    # jti делает каждый токен уникальным: по нему отзываются отдельные сессии
+    return jwt.encode({
+        'user_id': user_id,
+        'jti': uuid.uuid4().hex,
+        'iat': now,
+        'exp': now + expires_in,
+        'type': token_type
+    }, app.config['SECRET_KEY'], algorithm='HS256')
+
+def generate_access_token(user_id):
+    """Генерация access токена"""
+    return encode_token(user_id, 'access', app.config['JWT_ACCESS_TOKEN_EXPIRES'])
+
+def generate_tokens(user_id):
+    """Генерация access и refresh токенов"""
+    access_token = generate_access_token(user_id)
+    refresh_token = encode_token(user_id, 'refresh', app.config['JWT_REFRESH_TOKEN_EXPIRES'])
+    return access_token, refresh_token
+
+jwt_cache = TTLCache(
+    max_size=app.config['JWT_CACHE_SIZE'],
+    ttl=int(app.config['JWT_ACCESS_TOKEN_EXPIRES'].total_seconds())
+)
+
+class TokenRevokedError(jwt.InvalidTokenError):
+    """Токен отозван (выход пользователя)"""
+
+def token_digest(token):
+    """Дайджест токена: ключ кэша проверенных токенов (сам токен нигде не хранится)"""
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+def token_id(claims, token):
+    """Идентификатор токена для отзыва: jti (у токенов без jti - дайджест токена)"""
+    return claims.get('jti') or token_digest(token).hex()
+
+def decode_token(token):
+    """Проверка подписи, срока действия и отзыва JWT с кэшем уже проверенных токенов"""
+    key = token_digest(token)
+    claims = jwt_cache.get(key)
+    if claims is None:
+        claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+
+        # Запись истекает вместе с токеном: дальше jwt.decode вернет ExpiredSignatureError
+        remaining = claims['exp'] - time.time() if 'exp' in claims else None
+        if remaining is None or remaining > 0:
+            jwt_cache.set(key, claims, ttl=remaining)
+
+    if revoked_tokens.is_revoked(token_id(claims, token)):
+        raise TokenRevokedError('Токен отозван')
+    return claims
+
+def authenticate_token(token):
+    """Проверка access токена: возвращает (пользователь, None) или (None, ответ с ошибкой)"""
+    if not token:
+        return None, (jsonify({'error': 'Токен отсутствует'}), 401)
+    
+    try:
+        # Декодируем токен (повторные запросы с тем же токеном - из кэша)
+        data = decode_token(token)
+        
+        # Проверяем тип токена
+        if data.get('type') != 'access':
+            return None, (jsonify({'error': 'Неверный тип токена'}), 401)
+        
+        # Получаем пользователя (из кэша или БД)
+        current_user = load_principal(data['user_id'])
+        
+        if not current_user:
+            return None, (jsonify({'error': 'Пользователь не найден'}), 401)
+        
+        return current_user, None
+        
+    except jwt.ExpiredSignatureError:
+        return None, (jsonify({'error': 'Срок действия токена истек'}), 401)
+    except TokenRevokedError:
+        return None, (jsonify({'error': 'Токен отозван'}), 401)
+    except jwt.InvalidTokenError:
+        return None, (jsonify({'error': 'Неверный токен'}), 401)
+
+# Билеты потока событий: EventSource не умеет передавать заголовки, а access токен
+# в URL попадает в логи прокси и историю браузера. Билет живет секунды и принимается
+# один раз (повторное использование отслеживается в памяти процесса)
+used_stream_tickets = ExpiringSet()
+
+def generate_stream_ticket(user_id):
+    """Короткоживущий одноразовый билет для подключения к /api/stream"""
+    return encode_token(user_id, 'stream', timedelta(seconds=app.config['SSE_TICKET_TTL_SECONDS']))
+
+def authenticate_stream_ticket(ticket):
+    """Проверка и погашение билета: возвращает (пользователь, None) или (None, ответ с ошибкой)"""
+    if not ticket:
+        return None, (jsonify({'error': 'Билет отсутствует'}), 401)
+    
+    try:
+        data = jwt.decode(ticket, app.config['SECRET_KEY'], algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        return None, (jsonify({'error': 'Срок действия билета истек'}), 401)
+    except jwt.InvalidTokenError:
+        return None, (jsonify({'error': 'Неверный билет'}), 401)
+    
+    if data.get('type') != 'stream' or not data.get('jti'):
+        return None, (jsonify({'error': 'Неверный тип токена'}), 401)
+    
+    # Отметка хранится до истечения самого билета: повторить его нельзя, пока он действителен
+    if not used_stream_tickets.add(data['jti'], data['exp']):
+        return None, (jsonify({'error': 'Билет уже использован'}), 401)
+    
+    current_user = load_principal(data['user_id'])
+    if not current_user:
+        return None, (jsonify({'error': 'Пользователь не найден'}), 401)
+    
+    return current_user, None
+
+def get_bearer_token():
+    """Токен из заголовка Authorization"""
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header.split(' ')[1]
+    return None
+
+def token_required(f):
+    """Декоратор для проверки JWT токена"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        current_user, error = authenticate_token(get_bearer_token())
+        if error:
+            return error
+        
+        # Сохраняем пользователя в контексте запроса
+        g.current_user = current_user
+        
+        return f(*args, **kwargs)
+    return decorated
+
+def admin_required(f):
+    """Декоратор для проверки прав администратора"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not hasattr(g, 'current_user'):
+            return jsonify({'error': 'Требуется аутентификация'}), 401
+        
+        if g.current_user.get('role') != 'admin':
+            return jsonify({'error': 'Требуются права администратора'}), 403
+        
+        return f(*args, **kwargs)
+    return decorated
+
+# ===== ХЕЛПЕР-ФУНКЦИИ =====
+def validate_flag(submitted_flag, correct_hash):
+    """Валидация флага"""
+    # Хешируем присланный флаг и сравниваем с хешем из БД
+    submitted_hash = hashlib.md5(submitted_flag.encode()).hexdigest()
+    return submitted_hash == correct_hash
+
+# Агрегаты очков, из которых строится таблица user_scores
+USER_SCORES_SOURCE_SQL = '''
+    SELECT 
+        u.id as user_id,
+        COALESCE(l.completed_labs, 0) as completed_labs,
+        COALESCE(l.lab_points, 0) as lab_points,
+        COALESCE(c.ctf_solved, 0) as ctf_solved,
+        COALESCE(c.ctf_points, 0) as ctf_points,
+        c.last_solve_at
+    FROM users u
+    LEFT JOIN (
+        SELECT user_id, COUNT(*) as completed_labs, COALESCE(SUM(score), 0) as lab_points
+        FROM user_progress
+        WHERE status = 'completed'
+        GROUP BY user_id
+    ) l ON l.user_id = u.id
+    LEFT JOIN (
+        SELECT s.user_id, COUNT(*) as ctf_solved, COALESCE(SUM(ch.points), 0) as ctf_points,
+               MAX(s.solved_at) as last_solve_at
+        FROM ctf_solves s
+        JOIN ctf_challenges ch ON s.challenge_id = ch.id
+        GROUP BY s.user_id
+    ) c ON c.user_id = u.id
+'''
+
+def update_user_score(cursor, user_id, completed_labs=0, lab_points=0,
+                      ctf_solved=0, ctf_points=0, last_solve_at=None):
+    """Инкрементальное обновление user_scores (в транзакции вызывающего)"""
+    cursor.execute('''
+        INSERT INTO user_scores 
+        (user_id, completed_labs, lab_points, ctf_solved, ctf_points, last_solve_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            completed_labs = completed_labs + excluded.completed_labs,
+            lab_points = lab_points + excluded.lab_points,
+            ctf_solved = ctf_solved + excluded.ctf_solved,
+            ctf_points = ctf_points + excluded.ctf_points,
+            last_solve_at = COALESCE(excluded.last_solve_at, last_solve_at),
+            updated_at = excluded.updated_at
+    ''', (user_id, completed_labs, lab_points, ctf_solved, ctf_points, last_solve_at,
+          datetime.now().isoformat()))
+
+def rebuild_user_scores(cursor):
+    """Полный пересчет таблицы user_scores из истории решений"""
+    cursor.execute('DELETE FROM user_scores')
+    cursor.execute(f'''
+        INSERT INTO user_scores 
+        (user_id, completed_labs, lab_points, ctf_solved, ctf_points, last_solve_at, updated_at)
+        SELECT src.*, ? FROM ({USER_SCORES_SOURCE_SQL}) src
+    ''', (datetime.now().isoformat(),))
+    return cursor.rowcount
+
+def check_user_scores(cursor):
+    """Поиск расхождений между user_scores и историей решений"""
+    cursor.execute(f'''
+        SELECT 
+            src.user_id,
+            src.completed_labs, COALESCE(us.completed_labs, 0) as stored_completed_labs,
+            src.lab_points, COALESCE(us.lab_points, 0) as stored_lab_points,
+            src.ctf_solved, COALESCE(us.ctf_solved, 0) as stored_ctf_solved,
+            src.ctf_points, COALESCE(us.ctf_points, 0) as stored_ctf_points
+        FROM ({USER_SCORES_SOURCE_SQL}) src
+        LEFT JOIN user_scores us ON us.user_id = src.user_id
+        WHERE src.completed_labs != COALESCE(us.completed_labs, 0)
+           OR src.lab_points != COALESCE(us.lab_points, 0)
+           OR src.ctf_solved != COALESCE(us.ctf_solved, 0)
+           OR src.ctf_points != COALESCE(us.ctf_points, 0)
+    ''')
+    return [dict(row) for row in cursor.fetchall()]
+
+def update_daily_activity(cursor, user_id, timestamp, labs_completed=0, ctf_solved=0, points=0):
+    """Инкрементальное обновление дневной активности (в транзакции вызывающего)"""
+    cursor.execute('''
+        INSERT INTO user_daily_activity (user_id, day, labs_completed, ctf_solved, points)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, day) DO UPDATE SET
+            labs_completed = labs_completed + excluded.labs_completed,
+            ctf_solved = ctf_solved + excluded.ctf_solved,
+            points = points + excluded.points
+    ''', (user_id, str(timestamp)[:10], labs_completed, ctf_solved, points))
+
+def rebuild_daily_activity(cursor):
+    """Полный пересчет таблицы user_daily_activity из истории решений"""
+    cursor.execute('DELETE FROM user_daily_activity')
+    cursor.execute('''
+        INSERT INTO user_daily_activity (user_id, day, labs_completed, ctf_solved, points)
+        SELECT user_id, day, SUM(labs_completed), SUM(ctf_solved), SUM(points)
+        FROM (
+            SELECT user_id, substr(completed_at, 1, 10) as day,
+                   1 as labs_completed, 0 as ctf_solved, COALESCE(score, 0) as points
+            FROM user_progress
+            WHERE status = 'completed' AND completed_at IS NOT NULL
+            UNION ALL
+            SELECT s.user_id, substr(s.solved_at, 1, 10) as day,
+                   0 as labs_completed, 1 as ctf_solved, c.points as points
+            FROM ctf_solves s
+            JOIN ctf_challenges c ON s.challenge_id = c.id
+        )
+        GROUP BY user_id, day
+    ''')
+    return cursor.rowcount
+
+def rebuild_platform_counters(cursor):
+    """Полный пересчет счетчиков платформы"""
+    now = datetime.now().isoformat()
+    cursor.execute('DELETE FROM platform_counters')
+    cursor.execute('''
+        INSERT INTO platform_counters (name, value, updated_at)
+        SELECT 'users', COUNT(*), ? FROM users
+        UNION ALL
+        SELECT 'labs_completed', COUNT(*), ? FROM user_progress WHERE status = 'completed'
+        UNION ALL
+        SELECT 'ctf_solved', COUNT(*), ? FROM ctf_solves
+        UNION ALL
+        SELECT 'subscription:' || subscription_level, COUNT(*), ? FROM users GROUP BY subscription_level
+    ''', (now, now, now, now))
+    refresh_active_users(cursor)
+
+def count_active_users(cursor):
+    """Число активных пользователей за 7 дней (дорогой запрос)"""
+    week_ago = (datetime.now() - timedelta(days=7)).isoformat()
+    cursor.execute('''
+        SELECT COUNT(DISTINCT user_id) as active_users 
+        FROM user_progress 
+        WHERE started_at > ?
+    ''', (week_ago,))
+    return cursor.fetchone()[0]
+
+def refresh_active_users(cursor):
+    """Пересчет активных пользователей за 7 дней (дорогой счетчик)"""
+    active_users = count_active_users(cursor)
+    cursor.execute('''
+        INSERT INTO platform_counters (name, value, updated_at) VALUES ('active_users_7d', ?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    ''', (active_users, datetime.now().isoformat()))
+    return active_users
+
+def calculate_user_stats(user_id):
+    """Статистика пользователя (из материализованной таблицы user_scores)"""
+    db = get_db()
+    cursor = db.cursor()
+    
+    cursor.execute('''
+        SELECT completed_labs, lab_points, ctf_points FROM user_scores 
+        WHERE user_id = ?
+    ''', (user_id,))
+    row = cursor.fetchone()
+    
+    completed_labs = row['completed_labs'] if row else 0
+    lab_points = row['lab_points'] if row else 0
+    ctf_points = row['ctf_points'] if row else 0
+    
+    # Общие очки
+    total_points = lab_points + ctf_points
+    
+    # Ранг пользователя
+    rank = calculate_rank(total_points)
+    
+    return {
+        'completed_labs': completed_labs,
+        'lab_points': lab_points,
+        'ctf_points': ctf_points,
+        'total_points': total_points,
+        'rank': rank
+    }
+
+def calculate_rank(points):
+    """Определение ранга по очкам"""
+    if points >= 2000:
+        return 'Элита'
+    elif points >= 1500:
+        return 'Эксперт'
+    elif points >= 1000:
+        return 'Профессионал'
+    elif points >= 500:
+        return 'Продвинутый'
+    elif points >= 100:
+        return 'Средний'
+    else:
+        return 'Начинающий'
+
+ACTIVITY_GRANULARITIES = ('day', 'week', 'month')
+PERIOD_UNITS = {'d': 1, 'w': 7, 'm': 30, 'y': 365}
+MAX_PERIOD_DAYS = 3 * 366
+
+def parse_period(value):
+    """Период вида 30d / 4w / 6m / 1y (или число дней) в днях; None, если неверный"""
+    value = (value or '').strip().lower()
+    if value.isdigit():
+        days = int(value)
+    elif len(value) > 1 and value[:-1].isdigit() and value[-1] in PERIOD_UNITS:
+        days = int(value[:-1]) * PERIOD_UNITS[value[-1]]
+    else:
+        return None
+    return days if 0 < days <= MAX_PERIOD_DAYS else None
+
+def bucket_start(day, granularity):
+    """Начало интервала (день, неделя с понедельника, месяц), содержащего day"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+def next_bucket_start(start, granularity):
+    """Начало следующего интервала"""
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+# ===== ТАБЛИЦА ЛИДЕРОВ =====
+class RankedSkipList:
+    """Индексируемый skip list: вставка, удаление, ранг и выборка по позиции за O(log n)"""
+    MAX_LEVEL = 32
+
+    class _Node:
+        __slots__ = ('key', 'next', 'width')
+
+        def __init__(self, key, level):
+            self.key = key
+            self.next = [None] * level
+            self.width = [1] * level
+
+    def __init__(self):
+        self._head = self._Node(None, self.MAX_LEVEL)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key):
+        """Вставка ключа"""
+        chain = [None] * self.MAX_LEVEL
+        steps_at_level = [0] * self.MAX_LEVEL
+        node = self._head
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        height = self._random_level()
+        new_node = self._Node(key, height)
+        steps = 0
+        for level in range(height):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, self.MAX_LEVEL):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        """Удаление ключа"""
+        chain = [None] * self.MAX_LEVEL
+        node = self._head
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVEL):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def index(self, key):
+        """Позиция ключа (с нуля)"""
+        position = 0
+        node = self._head
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        return position
+
+    def slice(self, start, count):
+        """Ключи с позиции start (не более count)"""
+        if start < 0 or start >= self._size or count <= 0:
+            return []
+
+        # Спускаемся к узлу с позицией start, затем идем по нижнему уровню
+        remaining = start + 1
+        node = self._head
+        for level in reversed(range(self.MAX_LEVEL)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+class LeaderboardEntry:
+    """Участник таблицы лидеров CTF"""
+    __slots__ = ('user_id', 'username', 'avatar_url', 'user_group',
+                 'points', 'solved_count', 'last_solve_at')
+
+    def __init__(self, user_id, username, avatar_url, user_group,
+                 points=0, solved_count=0, last_solve_at=None):
+        self.user_id = user_id
+        self.username = username
+        self.avatar_url = avatar_url
+        self.user_group = user_group
+        self.points = points
+        self.solved_count = solved_count
+        self.last_solve_at = last_solve_at
+
+    def sort_key(self):
+        # Больше очков и решений выше, при равенстве выше тот, кто решил раньше
+        return (-self.points, -self.solved_count, self.last_solve_at or '~', self.user_id)
+
+    def to_dict(self, rank):
+        return {
+            'id': self.user_id,
+            'username': self.username,
+            'avatar_url': self.avatar_url,
+            'user_group': self.user_group,
+            'total_points': self.points,
+            'solved_count': self.solved_count,
+            'last_solve_at': self.last_solve_at,
+            'rank': rank,
+            'rank_title': calculate_rank(self.points)
+        }
+
+class LeaderboardIndex:
+    """Таблица лидеров CTF в памяти, обновляемая событиями решений"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ranking = RankedSkipList()
+        self._entries = {}
+        self._keys = {}
+        self.database = None
+        self.loaded_at = None
+        # Наибольший rowid ctf_solves в последнем снимке из БД (эти решения уже учтены)
+        self.solves_seq = 0
+        # События, пришедшие во время перезагрузки: повторяются поверх нового снимка
+        self._replay = None
+
+    @property
+    def loaded(self):
+        return self.loaded_at is not None
+
+    def begin_load(self):
+        """Начало перезагрузки: вызывается до чтения строк из БД"""
+        with self._lock:
+            self._replay = []
+
+    def load(self, rows, database=None, solves_seq=0):
+        """Полная загрузка из строк БД (заменяет текущее состояние)
+        
+        solves_seq - наибольший rowid ctf_solves, прочитанный тем же запросом, что и rows.
+        """
+        ranking = RankedSkipList()
+        entries = {}
+        keys = {}
+        for row in rows:
+            entry = LeaderboardEntry(row['id'], row['username'], row['avatar_url'], row['user_group'],
+                                     row['ctf_points'], row['ctf_solved'], row['last_solve_at'])
+            key = entry.sort_key()
+            ranking.insert(key)
+            entries[entry.user_id] = entry
+            keys[entry.user_id] = key
+
+        with self._lock:
+            replay, self._replay = self._replay or [], None
+            self._ranking = ranking
+            self._entries = entries
+            self._keys = keys
+            self.database = database
+            self.loaded_at = time.monotonic()
+            self.solves_seq = solves_seq
+            # Решения, зафиксированные после чтения, снимок не содержит; остальные отбрасываются
+            for method, args in replay:
+                method(*args)
+        data_versions.bump('leaderboard')
+
+    def _reindex(self, entry):
+        self._ranking.remove(self._keys[entry.user_id])
+        key = entry.sort_key()
+        self._ranking.insert(key)
+        self._keys[entry.user_id] = key
+
+    def upsert_user(self, user_id, username, avatar_url, user_group):
+        """Добавление пользователя или обновление его отображаемых данных"""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((self.upsert_user, (user_id, username, avatar_url, user_group)))
+            if not self.loaded:
+                return
+            entry = self._entries.get(user_id)
+            if entry is None:
+                entry = LeaderboardEntry(user_id, username, avatar_url, user_group)
+                key = entry.sort_key()
+                self._ranking.insert(key)
+                self._entries[user_id] = entry
+                self._keys[user_id] = key
+            else:
+                entry.username = username
+                entry.avatar_url = avatar_url
+                entry.user_group = user_group
+        data_versions.bump('leaderboard')
+
+    def record_solve(self, user_id, points, solved_at, seq):
+        """Учет нового решения CTF задачи (seq - rowid строки в ctf_solves)"""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((self.record_solve, (user_id, points, solved_at, seq)))
+            # Снимок из БД уже содержит это решение
+            if seq <= self.solves_seq:
+                return
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            entry.points += points
+            entry.solved_count += 1
+            if entry.last_solve_at is None or solved_at > entry.last_solve_at:
+                entry.last_solve_at = solved_at
+            self._reindex(entry)
+        data_versions.bump('leaderboard')
+
+    def size(self):
+        with self._lock:
+            return len(self._ranking)
+
+    def page(self, offset, limit):
+        """Участники с позиции offset"""
+        with self._lock:
+            keys = self._ranking.slice(offset, limit)
+            return [self._entries[key[-1]].to_dict(offset + i + 1) for i, key in enumerate(keys)]
+
+    def around(self, user_id, radius):
+        """Ранг пользователя и его соседи по таблице"""
+        with self._lock:
+            key = self._keys.get(user_id)
+            if key is None:
+                return None
+            position = self._ranking.index(key)
+            start = max(position - radius, 0)
+            return {
+                'rank': position + 1,
+                'total': len(self._ranking),
+                'user': self._entries[user_id].to_dict(position + 1),
+                'neighbours': self.page(start, position - start + radius + 1)
+            }
+
+leaderboard = LeaderboardIndex()
+_leaderboard_load_lock = threading.Lock()
+
+def leaderboard_is_stale():
+    """Нужна ли (пере)загрузка таблицы лидеров из БД"""
+    return (
+        not leaderboard.loaded
+        or leaderboard.database != app.config['DATABASE']
+        or time.monotonic() - leaderboard.loaded_at > app.config['LEADERBOARD_RESYNC_SECONDS']
+    )
+
+def get_leaderboard():
+    """Таблица лидеров, загруженная из БД при первом обращении и периодически сверяемая"""
+    if not leaderboard_is_stale():
+        return leaderboard
+
+    # Читатели продолжают работать со старым состоянием, пока строится новое
+    with _leaderboard_load_lock:
+        if leaderboard_is_stale():
+            leaderboard.begin_load()
+            cursor = get_db().cursor()
+            # Номер последнего решения читается тем же запросом: один снимок БД с очками
+            cursor.execute('''
+                SELECT 
+                    u.id, u.username, u.avatar_url, u.user_group,
+                    COALESCE(us.ctf_points, 0) as ctf_points,
+                    COALESCE(us.ctf_solved, 0) as ctf_solved,
+                    us.last_solve_at,
+                    (SELECT COALESCE(MAX(rowid), 0) FROM ctf_solves) as solves_seq
+                FROM users u
+                LEFT JOIN user_scores us ON us.user_id = u.id
+            ''')
+            rows = cursor.fetchall()
+            leaderboard.load(rows, app.config['DATABASE'], rows[0]['solves_seq'] if rows else 0)
+    return leaderboard
+
+# ===== КАТАЛОГ =====
+# Служебные поля, которые не отдаются клиентам
+CATALOG_HIDDEN_FIELDS = frozenset(['flag_hash', 'vm_config_path', 'solves_count'])
+
+def public_catalog_row(row):
+    """Строка каталога без секретных и служебных полей"""
+    return {key: row[key] for key in row.keys() if key not in CATALOG_HIDDEN_FIELDS}
+
+def build_filter_index(items, first_field, second_field):
+    """Индекс по всем комбинациям двух фильтров (None - фильтр не задан)"""
+    index = {}
+    for item in items:
+        first, second = item[first_field], item[second_field]
+        for key in {(None, None), (first, None), (None, second), (first, second)}:
+            index.setdefault(key, []).append(item)
+    return {key: tuple(values) for key, values in index.items()}
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога с заранее построенными фильтрами"""
+    __slots__ = ('version', 'built_at', 'labs_by_id', 'challenges_by_id',
+                 '_labs_index', '_active_labs_index', '_challenges_index')
+
+    def __init__(self, version, lab_rows, challenge_rows):
+        self.version = version
+        self.built_at = datetime.now().isoformat()
+
+        labs = tuple(public_catalog_row(row) for row in lab_rows)
+        challenges = tuple(public_catalog_row(row) for row in challenge_rows)
+
+        self.labs_by_id = {lab['id']: lab for lab in labs}
+        self.challenges_by_id = {challenge['id']: challenge for challenge in challenges}
+        self._labs_index = build_filter_index(labs, 'difficulty', 'category')
+        self._active_labs_index = build_filter_index(
+            [lab for lab in labs if lab['is_active']], 'difficulty', 'category')
+        self._challenges_index = build_filter_index(challenges, 'category', 'difficulty')
+
+    def find_labs(self, difficulty=None, category=None, active_only=True):
+        index = self._active_labs_index if active_only else self._labs_index
+        return index.get((difficulty, category), ())
+
+    def find_challenges(self, category=None, difficulty=None):
+        return self._challenges_index.get((category, difficulty), ())
+
+class CatalogCache:
+    """Текущий снимок каталога и счетчики решений CTF задач"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.database = None
+        self.checked_at = 0.0
+        self.rebuilds = 0
+        self._solve_counts = {}
+
+    def is_fresh(self):
+        return (
+            self.snapshot is not None
+            and self.database == app.config['DATABASE']
+            and time.monotonic() - self.checked_at < app.config['CATALOG_VERSION_CHECK_SECONDS']
+        )
+
+    def install(self, snapshot, solve_counts, database):
+        data_versions.bump('solves')
+        self.snapshot = snapshot
+        self._solve_counts = solve_counts
+        self.database = database
+        self.rebuilds += 1
+
+    def set_solve_counts(self, solve_counts):
+        if solve_counts != self._solve_counts:
+            data_versions.bump('solves')
+        self._solve_counts = solve_counts
+
+    def record_solve(self, challenge_id):
+        with self.lock:
+            self._solve_counts[challenge_id] = self._solve_counts.get(challenge_id, 0) + 1
+
+    def solve_count(self, challenge_id):
+        return self._solve_counts.get(challenge_id, 0)
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            'version': snapshot.version if snapshot else None,
+            'built_at': snapshot.built_at if snapshot else None,
+            'labs': len(snapshot.labs_by_id) if snapshot else 0,
+            'challenges': len(snapshot.challenges_by_id) if snapshot else 0,
+            'rebuilds': self.rebuilds
+        }
+
+catalog_cache = CatalogCache()
+
+def get_catalog(force_check=False):
+    """Снимок каталога (перестраивается только при смене версии каталога)"""
+    if not force_check and catalog_cache.is_fresh():
+        return catalog_cache.snapshot
+
+    with catalog_cache.lock:
+        if not force_check and catalog_cache.is_fresh():
+            return catalog_cache.snapshot
+
+        cursor = get_db().cursor()
+        cursor.execute('SELECT version FROM catalog_version WHERE id = 1')
+        row = cursor.fetchone()
+        version = row['version'] if row else 0
+
+        snapshot = catalog_cache.snapshot
+        if (snapshot is None or snapshot.version != version
+                or catalog_cache.database != app.config['DATABASE']):
+            cursor.execute('SELECT * FROM labs')
+            lab_rows = cursor.fetchall()
+            cursor.execute('SELECT * FROM ctf_challenges')
+            challenge_rows = cursor.fetchall()
+            catalog_cache.install(
+                CatalogSnapshot(version, lab_rows, challenge_rows),
+                {row['id']: row['solves_count'] or 0 for row in challenge_rows},
+                app.config['DATABASE']
+            )
+        else:
+            # Счетчики решений меняются чаще каталога - сверяем их при каждой проверке
+            cursor.execute('SELECT id, solves_count FROM ctf_challenges')
+            catalog_cache.set_solve_counts({row['id']: row['solves_count'] or 0 for row in cursor.fetchall()})
+
+        catalog_cache.checked_at = time.monotonic()
+        return catalog_cache.snapshot
+
+def find_catalog_lab(lab_id):
+    """Лаборатория из снимка каталога (при промахе версия проверяется сразу)"""
+    lab = get_catalog().labs_by_id.get(lab_id)
+    if lab is None:
+        lab = get_catalog(force_check=True).labs_by_id.get(lab_id)
+    return lab
+
+def find_catalog_challenge(challenge_id):
+    """CTF задача из снимка каталога (при промахе версия проверяется сразу)"""
+    challenge = get_catalog().challenges_by_id.get(challenge_id)
+    if challenge is None:
+        challenge = get_catalog(force_check=True).challenges_by_id.get(challenge_id)
+    return challenge
+
+# ===== ФОНОВЫЕ ЗАДАЧИ =====
+class PeriodicTask:
+    """Фоновый поток, выполняющий функцию с заданным интервалом"""
+
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.runs = 0
+        self.errors = 0
+        self.last_run_at = None
+        self.last_duration = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Запуск потока (повторный вызов ничего не делает)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def wake(self):
+        """Внеочередной запуск без ожидания интервала (вызывающий поток не блокируется)"""
+        self._wake.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def run_once(self):
+        started = time.monotonic()
+        try:
+            self.func()
+            self.last_error = None
+        except Exception as e:
+            self.errors += 1
+            self.last_error = str(e)
+        self.runs += 1
+        self.last_duration = time.monotonic() - started
+        self.last_run_at = datetime.now().isoformat()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'runs': self.runs,
+            'errors': self.errors,
+            'last_run_at': self.last_run_at,
+            'last_duration': round(self.last_duration, 6) if self.last_duration is not None else None,
+            'last_error': self.last_error
+        }
+
+background_tasks = {}
+
+def register_background_task(name, interval, func):
+    """Регистрация фоновой задачи (запускается через start_background_tasks)"""
+    task = PeriodicTask(name, interval, func)
+    background_tasks[name] = task
+    return task
+
+def start_background_tasks():
+    for task in background_tasks.values():
+        task.start()
+
+@atexit.register
+def stop_background_tasks():
+    for task in background_tasks.values():
+        task.stop()
+
+_services_lock = threading.Lock()
+_services_started = False
+
+def start_services():
+    """Журналы, список отзыва токенов и фоновые задачи процесса (один раз на процесс)"""
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+
+    configure_logging()
+    try:
+        revoked_tokens.load()
+    except Exception as e:
+        app.logger.error(f"Не удалось загрузить отозванные токены: {e}")
+    if app.config['BACKGROUND_TASKS_ENABLED']:
+        start_background_tasks()
+
+@app.before_request
+def ensure_services_started():
+    """Запуск служб на первом запросе: так они работают под flask run и любым WSGI-сервером"""
+    if not _services_started:
+        start_services()
+
+# ===== СЧЕТЧИКИ ПЛАТФОРМЫ =====
+class PlatformCounters:
+    """Снимок таблицы platform_counters в памяти"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.updated_at = {}
+        self.digest = None
+        self.loaded_at = None
+        self.database = None
+        self.platform_version = None
+
+    def is_fresh(self):
+        return (
+            self.loaded_at is not None
+            and self.database == app.config['DATABASE']
+            and self.platform_version == data_versions.get('platform')
+            and time.monotonic() - self.loaded_at < app.config['PLATFORM_COUNTERS_TTL']
+        )
+
+    def install(self, rows, database, platform_version):
+        values = {row['name']: row['value'] for row in rows}
+        # Отпечаток значений совпадает во всех процессах с одинаковыми счетчиками
+        self.digest = hashlib.blake2b(repr(sorted(values.items())).encode(), digest_size=8).hexdigest()
+        self.values = values
+        self.updated_at = {row['name']: row['updated_at'] for row in rows}
+        self.database = database
+        self.platform_version = platform_version
+        self.loaded_at = time.monotonic()
+
+    def age_seconds(self, name):
+        """Возраст значения счетчика в секундах"""
+        updated_at = self.updated_at.get(name)
+        if not updated_at:
+            return None
+        try:
+            updated = datetime.fromisoformat(str(updated_at))
+        except ValueError:
+            return None
+        # CURRENT_TIMESTAMP из триггеров записывается в UTC
+        now = datetime.utcnow() if 'T' not in str(updated_at) else datetime.now()
+        return max(round((now - updated).total_seconds(), 3), 0)
+
+platform_counters = PlatformCounters()
+
+def get_platform_counters():
+    """Счетчики платформы (перечитываются после записей этого процесса или по TTL)"""
+    if platform_counters.is_fresh():
+        return platform_counters
+
+    with platform_counters.lock:
+        if not platform_counters.is_fresh():
+            platform_version = data_versions.get('platform')
+            cursor = get_db().cursor()
+            cursor.execute('SELECT name, value, updated_at FROM platform_counters')
+            platform_counters.install(cursor.fetchall(), app.config['DATABASE'], platform_version)
+    return platform_counters
+
+def refresh_active_users_task():
+    """Фоновое обновление счетчика активных пользователей"""
+    with app.app_context():
+        run_write(refresh_active_users)
+
+active_users_task = register_background_task(
+    'active-users-refresh', app.config['ACTIVE_USERS_REFRESH_SECONDS'], refresh_active_users_task)
+
+# ===== ОТЗЫВ ТОКЕНОВ =====
+class TokenRevocationList:
+    """Отозванные токены в памяти (зеркало user_sessions): фильтр Блума и точный словарь jti -> exp"""
+
+    def __init__(self, bits=1 << 20, hashes=4):
+        self.lock = threading.Lock()
+        self.size = bits
+        self.hashes = hashes
+        self.bits = bytearray(bits // 8)
+        self.revoked = {}
+        self.loaded_at = None
+        self.rejected = 0
+        self.false_positives = 0
+
+    def _positions(self, jti):
+        # Двойное хеширование: k позиций из одного hash() строки
+        h = hash(jti)
+        h1 = h & 0xFFFFFFFF
+        h2 = ((h >> 32) & 0xFFFFFFFF) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def is_revoked(self, jti):
+        """Проверка без запросов к БД: для неотозванного токена обычно хватает фильтра Блума"""
+        bits = self.bits
+        h = hash(jti)
+        h1 = h & 0xFFFFFFFF
+        h2 = ((h >> 32) & 0xFFFFFFFF) | 1
+        for i in range(self.hashes):
+            position = (h1 + i * h2) % self.size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        # Фильтр мог ошибиться - решает точный словарь
+        if jti in self.revoked:
+            self.rejected += 1
+            return True
+        self.false_positives += 1
+        return False
+
+    def add(self, jti, exp):
+        with self.lock:
+            self.revoked[jti] = exp
+            for position in self._positions(jti):
+                self.bits[position >> 3] |= 1 << (position & 7)
+
+    def install(self, revoked):
+        """Замена содержимого: фильтр строится заново, истекшие записи отбрасываются"""
+        now = time.time()
+        revoked = {jti: exp for jti, exp in revoked.items() if exp > now}
+        bits = bytearray(self.size // 8)
+        for jti in revoked:
+            for position in self._positions(jti):
+                bits[position >> 3] |= 1 << (position & 7)
+        self.bits, self.revoked = bits, revoked
+
+    def load(self):
+        """Перечитывание действующих записей из БД (только из фоновой задачи, не из запросов)"""
+        cursor = get_db().cursor()
+        cursor.execute('''
+            SELECT session_token, CAST(strftime('%s', expires_at) AS INTEGER) AS exp
+            FROM user_sessions
+            WHERE expires_at > CURRENT_TIMESTAMP
+        ''')
+        revoked = {row['session_token']: row['exp'] for row in cursor.fetchall()}
+        with self.lock:
+            # Записи, добавленные этим процессом во время чтения, не теряем
+            for jti, exp in self.revoked.items():
+                revoked.setdefault(jti, exp)
+            self.install(revoked)
+            self.loaded_at = datetime.now().isoformat()
+
+    def stats(self):
+        return {
+            'size': len(self.revoked),
+            'bloom_bits': self.size,
+            'bloom_hashes': self.hashes,
+            'bloom_fill': round(sum(bin(byte).count('1') for byte in self.bits) / self.size, 6),
+            'rejected': self.rejected,
+            'false_positives': self.false_positives,
+            'loaded_at': self.loaded_at
+        }
+
+revoked_tokens = TokenRevocationList(app.config['TOKEN_REVOCATION_BLOOM_BITS'])
+
+def revoke_token(cursor, user_id, jti, exp):
+    """Запись отозванного токена (по jti) в user_sessions, хранится до exp токена"""
+    cursor.execute('''
+        INSERT INTO user_sessions (id, user_id, session_token, expires_at)
+        VALUES (?, ?, ?, ?)
+    ''', (str(uuid.uuid4()), user_id, jti,
+          datetime.utcfromtimestamp(exp).strftime('%Y-%m-%d %H:%M:%S')))
+
+def sync_revoked_tokens_task():
+    """Удаление истекших записей и подхват отзывов из других процессов"""
+    with app.app_context():
+        run_write(lambda cursor: cursor.execute(
+            'DELETE FROM user_sessions WHERE expires_at <= CURRENT_TIMESTAMP'))
+        revoked_tokens.load()
+
+revocation_sync_task = register_background_task(
+    'token-revocation-sync', app.config['TOKEN_REVOCATION_SYNC_SECONDS'], sync_revoked_tokens_task)
+
+# ===== ОГРАНИЧЕНИЕ ЧАСТОТЫ ЗАПРОСОВ =====
+class RateLimiter:
+    """Token bucket в памяти процесса: корзины по (эндпоинт, тип ключа, ключ)"""
+
+    def __init__(self, max_buckets):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # ключ -> [токены, время последнего пополнения]
+        self._lock = threading.Lock()
+        self._allowed = {}
+        self._limited = {}
+        self._evictions = 0
+
+    def hit(self, endpoint, keys):
+        """Списание токена из всех корзин запроса: 0 или время ожидания в секундах"""
+        limits = app.config['RATE_LIMITS'][endpoint]
+        now = time.monotonic()
+        with self._lock:
+            buckets = []
+            retry_after = 0
+            for kind, ident in keys:
+                capacity, rate = limits[kind]
+                key = (endpoint, kind, ident)
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = [capacity, now]
+                    self._buckets[key] = bucket
+                else:
+                    bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                    bucket[1] = now
+                    self._buckets.move_to_end(key)
+                if bucket[0] < 1:
+                    retry_after = max(retry_after, (1 - bucket[0]) / rate)
+                    self._limited[(endpoint, kind)] = self._limited.get((endpoint, kind), 0) + 1
+                buckets.append(bucket)
+
+            # Давно не использованные корзины полны - их можно забыть
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+                self._evictions += 1
+
+            if retry_after:
+                return retry_after
+            for bucket in buckets:
+                bucket[0] -= 1
+            self._allowed[endpoint] = self._allowed.get(endpoint, 0) + 1
+            return 0
+
+    def stats(self):
+        with self._lock:
+            endpoints = {}
+            for endpoint, limits in app.config['RATE_LIMITS'].items():
+                endpoints[endpoint] = {
+                    'limits': {kind: {'capacity': capacity, 'per_second': rate}
+                               for kind, (capacity, rate) in limits.items()},
+                    'allowed': self._allowed.get(endpoint, 0),
+                    'limited': {kind: self._limited.get((endpoint, kind), 0) for kind in limits}
+                }
+            return {
+                'enabled': app.config['RATE_LIMIT_ENABLED'],
+                'buckets': len(self._buckets),
+                'max_buckets': self.max_buckets,
+                'evictions': self._evictions,
+                'endpoints': endpoints
+            }
+
+rate_limiter = RateLimiter(app.config['RATE_LIMIT_MAX_BUCKETS'])
+
+def rate_limited(endpoint):
+    """Декоратор ограничения частоты по пользователю и IP (после token_required, до SQL)"""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if app.config['RATE_LIMIT_ENABLED']:
+                keys = [('ip', request.remote_addr)]
+                if hasattr(g, 'current_user'):
+                    keys.append(('user', g.current_user['id']))
+                retry_after = rate_limiter.hit(endpoint, keys)
+                if retry_after:
+                    response = jsonify({'error': 'Слишком много попыток, повторите позже'})
+                    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+                    return response, 429
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
+
+# ===== БУФЕР ПОПЫТОК =====
+class AttemptBuffer:
+    """Неверные попытки по (пользователь, лаборатория), еще не записанные в user_progress"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # user_id -> {lab_id: попытки}
+        self._size = 0
+        # Сбросы (user_id, lab_id) во время идущей записи: такие попытки она пропускает
+        self._generations = {}
+        self.last_flush_at = time.monotonic()
+        self.flushes = 0
+        self.flushed_attempts = 0
+        self.errors = 0
+        self.last_error = None
+
+    def add(self, user_id, lab_id, count=1):
+        """Учет попытки; при переполнении буфера фоновый сброс запускается досрочно"""
+        with self._lock:
+            labs = self._pending.setdefault(user_id, {})
+            if lab_id not in labs:
+                self._size += 1
+            labs[lab_id] = labs.get(lab_id, 0) + count
+            full = self._size >= app.config['ATTEMPT_BUFFER_MAX_PENDING']
+        # Запрос не ждет записи: сбрасывает только attempt_flush_task
+        if full:
+            attempt_flush_task.wake()
+
+    def pending(self, user_id, lab_id):
+        labs = self._pending.get(user_id)
+        return labs.get(lab_id, 0) if labs else 0
+
+    def pending_for_user(self, user_id):
+        with self._lock:
+            return dict(self._pending.get(user_id, {}))
+
+    def discard(self, user_id, lab_id):
+        """Отбрасывание попыток (перезапуск лаборатории обнуляет счетчик)"""
+        # Не ждем идущего сброса: он сверит поколение и не допишет попытки после обнуления
+        with self._lock:
+            key = (user_id, lab_id)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            labs = self._pending.get(user_id)
+            if labs and lab_id in labs:
+                del labs[lab_id]
+                self._size -= 1
+                if not labs:
+                    del self._pending[user_id]
+
+    def flush(self):
+        """Запись накопленных попыток одной транзакцией"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending, self._size = self._pending, {}, 0
+                self.last_flush_at = time.monotonic()
+                generations = dict(self._generations)
+            if not pending:
+                return 0
+
+            def discarded(user_id, lab_id):
+                key = (user_id, lab_id)
+                return self._generations.get(key, 0) != generations.get(key, 0)
+
+            def write_attempts(cursor):
+                flushed = 0
+                for user_id, labs in pending.items():
+                    for lab_id, count in labs.items():
+                        # Лабораторию перезапустили после выемки попыток из буфера
+                        if discarded(user_id, lab_id):
+                            continue
+                        cursor.execute('''
+                            UPDATE user_progress 
+                            SET attempts = attempts + ?
+                            WHERE user_id = ? AND lab_id = ?
+                        ''', (count, user_id, lab_id))
+                        
+                        # Если записи не было, создаем с статусом in_progress
+                        if cursor.rowcount == 0:
+                            try:
+                                cursor.execute('''
+                                    INSERT INTO user_progress 
+                                    (id, user_id, lab_id, status, started_at, attempts, score)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                                ''', (str(uuid.uuid4()), user_id, lab_id, 'in_progress',
+                                      datetime.now().isoformat(), count, 0))
+                            except sqlite3.IntegrityError:
+                                # Пользователь или лаборатория удалены - попытки отбрасываем
+                                continue
+                        flushed += count
+                return flushed
+
+            try:
+                with app.app_context():
+                    flushed = run_write(write_attempts)
+            except DatabaseWriteTimeout as e:
+                # Пакет мог зафиксироваться: возврат в буфер засчитал бы попытки дважды
+                self.errors += 1
+                self.last_error = str(e)
+                app.logger.error(f"Результат сохранения буфера попыток неизвестен: {e}")
+                return 0
+            except Exception as e:
+                # Возвращаем попытки в буфер до следующего сброса (кроме перезапущенных лабораторий)
+                with self._lock:
+                    for user_id, labs in pending.items():
+                        for lab_id, count in labs.items():
+                            if discarded(user_id, lab_id):
+                                continue
+                            current = self._pending.setdefault(user_id, {})
+                            if lab_id not in current:
+                                self._size += 1
+                            current[lab_id] = current.get(lab_id, 0) + count
+                    self._generations.clear()
+                self.errors += 1
+                self.last_error = str(e)
+                app.logger.error(f"Не удалось сохранить буфер попыток: {e}")
+                return 0
+
+            # Записанные попытки больше не сверяются с поколениями
+            with self._lock:
+                self._generations.clear()
+            self.flushes += 1
+            self.flushed_attempts += flushed
+            return flushed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending_keys': self._size,
+                'pending_attempts': sum(sum(labs.values()) for labs in self._pending.values()),
+                'max_pending': app.config['ATTEMPT_BUFFER_MAX_PENDING'],
+                'flush_interval': app.config['ATTEMPT_FLUSH_SECONDS'],
+                'flushes': self.flushes,
+                'flushed_attempts': self.flushed_attempts,
+                'errors': self.errors,
+                'last_error': self.last_error
+            }
+
+attempt_buffer = AttemptBuffer()
+
+attempt_flush_task = register_background_task(
+    'attempt-flush', app.config['ATTEMPT_FLUSH_SECONDS'], attempt_buffer.flush)
+
+@atexit.register
+def flush_attempt_buffer():
+    """Сброс буфера попыток при остановке процесса"""
+    try:
+        attempt_buffer.flush()
+    except Exception as e:
+        print(f"Не удалось сохранить попытки: {e}")
+
+# ===== МОНИТОРИНГ СИСТЕМЫ =====
+class SystemSampler:
+    """Периодические снимки CPU, памяти, диска и топа процессов в кольцевом буфере"""
+
+    def __init__(self, history_size):
+        self.samples = deque(maxlen=history_size)
+        self.system_info = None
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """Снятие одного снимка (без блокирующего ожидания)"""
+        import psutil
+        import platform
+
+        if self.system_info is None:
+            self.system_info = {
+                'platform': platform.system(),
+                'platform_release': platform.release(),
+                'platform_version': platform.version(),
+                'python_version': platform.python_version(),
+                'processor': platform.processor()
+            }
+
+        # interval=None - загрузка с момента предыдущего снимка
+        cpu_usage = psutil.cpu_percent(interval=None)
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+
+        processes = []
+        for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
+            try:
+                processes.append(proc.info)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        processes = sorted(processes, key=lambda x: x.get('cpu_percent') or 0,
+                           reverse=True)[:app.config['SYSTEM_TOP_PROCESSES']]
+
+        sample = {
+            'timestamp': datetime.now().isoformat(),
+            'collected_at': time.time(),
+            'resources': {
+                'cpu_percent': cpu_usage,
+                'memory_total': memory.total,
+                'memory_available': memory.available,
+                'memory_percent': memory.percent,
+                'disk_total': disk.total,
+                'disk_used': disk.used,
+                'disk_percent': disk.percent
+            },
+            'top_processes': processes
+        }
+        with self._lock:
+            self.samples.append(sample)
+        return sample
+
+    def latest(self):
+        with self._lock:
+            return self.samples[-1] if self.samples else None
 
-# ===== JWT АУТЕНТИФИКАЦИЯ =====
-def generate_tokens(user_id):
-    """Генерация access и refresh токенов"""
-    access_token = jwt.encode({
-        'user_id': user_id,
-        'exp': datetime.utcnow() + app.config['JWT_ACCESS_TOKEN_EXPIRES'],
-        'type': 'access'
-    }, app.config['SECRET_KEY'], algorithm='HS256')
-    
-    refresh_token = jwt.encode({
-        'user_id': user_id,
-        'exp': datetime.utcnow() + app.config['JWT_REFRESH_TOKEN_EXPIRES'],
-        'type': 'refresh'
-    }, app.config['SECRET_KEY'], algorithm='HS256')
-    
-    return access_token, refresh_token
+    def history(self, window):
+        """Ресурсы за последние window секунд (для графиков)"""
+        since = time.time() - window
+        with self._lock:
+            return [
+                {'timestamp': sample['timestamp'], **sample['resources']}
+                for sample in self.samples if sample['collected_at'] >= since
+            ]
 
-def token_required(f):
-    """Декоратор для проверки JWT токена"""
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        token = None
-        
-        # Получаем токен из заголовка Authorization
-        auth_header = request.headers.get('Authorization')
-        if auth_header and auth_header.startswith('Bearer '):
-            token = auth_header.split(' ')[1]
-        
-        if not token:
-            return jsonify({'error': 'Токен отсутствует'}), 401
-        
+system_sampler = SystemSampler(app.config['SYSTEM_SAMPLE_HISTORY'])
+
+system_sampler_task = register_background_task(
+    'system-sampler', app.config['SYSTEM_SAMPLE_SECONDS'], system_sampler.sample)
+
+# ===== ПОТОК СОБЫТИЙ =====
+class EventSubscriber:
+    """Подписчик потока событий с ограниченной очередью"""
+
+    def __init__(self, user_id, queue_size):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.evicted = False
+
+    def offer(self, item):
+        """Постановка события в очередь; False, если клиент не успевает читать"""
+        target_user = item[3]
+        if target_user is not None and target_user != self.user_id:
+            return True
         try:
-            # Декодируем токен
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            
-            # Проверяем тип токена
-            if data.get('type') != 'access':
-                return jsonify({'error': 'Неверный тип токена'}), 401
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.evicted = True
+            return False
+
+class EventBus:
+    """Внутрипроцессная публикация событий для потоков SSE"""
+
+    def __init__(self, history_size=1000, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._next_id = 1
+        self._published = 0
+        self._evicted = 0
+        self._resets = 0
+
+    def publish(self, event, data, user_id=None):
+        """Публикация события (user_id - только для этого пользователя)"""
+        with self._lock:
+            item = (self._next_id, event, json.dumps(data, ensure_ascii=False), user_id)
+            self._next_id += 1
+            self._published += 1
+            self._history.append(item)
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            if not subscriber.offer(item):
+                self.unsubscribe(subscriber, evicted=True)
+
+    def subscribe(self, user_id, last_event_id=None):
+        """Новый подписчик; возвращает (подписчик, нужен ли клиенту полный сброс состояния)"""
+        subscriber = EventSubscriber(user_id, self.queue_size)
+        reset = False
+        with self._lock:
+            if last_event_id is not None:
+                oldest = self._history[0][0] if self._history else self._next_id
+                if last_event_id >= self._next_id or last_event_id < oldest - 1:
+                    # Пропущенные события уже вытеснены из истории или id от другого процесса
+                    reset = True
+                    self._resets += 1
+                else:
+                    for item in self._history:
+                        if item[0] > last_event_id and not subscriber.offer(item):
+                            break
+            self._subscribers.add(subscriber)
+        return subscriber, reset
+
+    def unsubscribe(self, subscriber, evicted=False):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.discard(subscriber)
+                if evicted:
+                    self._evicted += 1
+
+    def client_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._subscribers),
+                'published': self._published,
+                'history': len(self._history),
+                'last_event_id': f'{INSTANCE_ID}-{self._next_id - 1}',
+                'evicted': self._evicted,
+                'resets': self._resets
+            }
+
+event_bus = EventBus(
+    history_size=app.config['SSE_HISTORY_SIZE'],
+    queue_size=app.config['SSE_QUEUE_SIZE']
+)
+
+def format_sse(item):
+    """Сериализация события в формат text/event-stream"""
+    event_id, event, payload, _ = item
+    return f'id: {INSTANCE_ID}-{event_id}\nevent: {event}\ndata: {payload}\n\n'
+
+def parse_last_event_id(value):
+    """Номер события из Last-Event-ID (-1, если id от другого процесса или некорректен)"""
+    if not value:
+        return None
+    instance, _, number = value.rpartition('-')
+    if instance != INSTANCE_ID or not number.isdigit():
+        return -1
+    return int(number)
+
+def publish_user_stats(user_id):
+    """Публикация изменившейся статистики пользователя"""
+    event_bus.publish('stats', calculate_user_stats(user_id), user_id=user_id)
+
+def publish_leaderboard_delta(user_id):
+    """Публикация нового положения пользователя в таблице лидеров"""
+    position = get_leaderboard().around(user_id, 0)
+    if position is not None:
+        event_bus.publish('leaderboard', position['user'])
+
+# ===== УСЛОВНЫЕ ЗАПРОСЫ (ETag) =====
+# Таблица лидеров и счетчики решений обновляются в памяти каждого процесса отдельно:
+# ETag ответов из них действителен только в выдавшем его процессе
+PROCESS_LOCAL_SCOPES = frozenset(['leaderboard', 'solves'])
+
+def data_version(scope):
+    """Текущая версия области данных"""
+    if scope == 'catalog':
+        # Версия снимка - значение catalog_version из БД
+        return get_catalog().version
+    if scope == 'leaderboard':
+        # Перезагрузка устаревшей таблицы лидеров меняет ее версию
+        get_leaderboard()
+    if scope == 'platform':
+        return get_platform_counters().digest
+    return data_versions.get(scope)
+
+def user_data_version(user_id):
+    """Версия данных пользователя из БД (увеличивается триггерами в любом процессе)"""
+    cursor = get_db().cursor()
+    cursor.execute('SELECT version FROM user_data_versions WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    return row['version'] if row else 0
+
+def conditional_get(*scopes, per_user=False, pending_attempts=False, time_bucket=None):
+    """Декоратор: ETag из версий данных и ответ 304 без выполнения обработчика
+    
+    scopes - области данных, от которых зависит ответ;
+    per_user - ответ зависит от данных текущего пользователя;
+    pending_attempts - ответ учитывает еще не записанные попытки из буфера процесса;
+    time_bucket - ответ содержит данные, зависящие от времени (секунды).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            current_user = getattr(g, 'current_user', None)
             
-            # Получаем пользователя из БД
-            db = get_db()
-            cursor = db.cursor()
-            cursor.execute('SELECT * FROM users WHERE id = ?', (data['user_id'],))
-            current_user = cursor.fetchone()
+            parts = [request.path, request.query_string]
+            if PROCESS_LOCAL_SCOPES.intersection(scopes):
+                parts.append(INSTANCE_ID)
+            parts.extend(data_version(scope) for scope in scopes)
+            if per_user:
+                parts.append(current_user['id'])
+                parts.append(user_data_version(current_user['id']))
+                if pending_attempts:
+                    # Неверная попытка до сброса буфера не меняет версию в БД
+                    parts.append(sorted(attempt_buffer.pending_for_user(current_user['id']).items()))
+            if time_bucket:
+                parts.append(int(time.time() // time_bucket))
+            etag = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
             
-            if not current_user:
-                return jsonify({'error': 'Пользователь не найден'}), 401
-                
-            # Сохраняем пользователя в контексте запроса
-            g.current_user = dict(current_user)
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
             
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Срок действия токена истек'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'error': 'Неверный токен'}), 401
-        
-        return f(*args, **kwargs)
-    return decorated
+            response.set_etag(etag)
+            # Ответы для аутентифицированных пользователей не кэшируются общими кэшами
+            if current_user is not None:
+                response.headers['Cache-Control'] = 'private, no-cache'
+                response.vary.add('Authorization')
+            else:
+                response.headers['Cache-Control'] = 'public, no-cache'
+            return response
+        return decorated
+    return decorator
 
-def admin_required(f):
-    """Декоратор для проверки прав администратора"""
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if not hasattr(g, 'current_user'):
-            return jsonify({'error': 'Требуется аутентификация'}), 401
-        
-        if g.current_user.get('role') != 'admin':
-            return jsonify({'error': 'Требуются права администратора'}), 403
-        
-        return f(*args, **kwargs)
-    return decorated
+# ===== МЕТРИКИ =====
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SQL_TIME_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
 
-# ===== ХЕЛПЕР-ФУНКЦИИ =====
-def validate_flag(submitted_flag, correct_hash):
-    """Валидация флага"""
-    # Хешируем присланный флаг и сравниваем с хешем из БД
-    submitted_hash = hashlib.md5(submitted_flag.encode()).hexdigest()
-    return submitted_hash == correct_hash
+class RouteMetrics:
+    """Счетчики одного эндпоинта: гистограммы фиксированного размера (последний бакет - +Inf)"""
+    __slots__ = ('count', 'statuses', 'latency', 'latency_sum', 'sql_count', 'sql_count_sum',
+                 'sql_time', 'sql_time_sum')
 
-def calculate_user_stats(user_id):
-    """Расчет статистики пользователя"""
-    db = get_db()
-    cursor = db.cursor()
-    
-    # Количество завершенных лабораторий
-    cursor.execute('''
-        SELECT COUNT(*) FROM user_progress 
-        WHERE user_id = ? AND status = 'completed'
-    ''', (user_id,))
-    completed_labs = cursor.fetchone()[0]
-    
-    # Сумма очков из лабораторий
-    cursor.execute('''
-        SELECT COALESCE(SUM(score), 0) FROM user_progress 
-        WHERE user_id = ? AND status = 'completed'
-    ''', (user_id,))
-    lab_points = cursor.fetchone()[0]
-    
-    # Сумма очков из CTF
-    cursor.execute('''
-        SELECT COALESCE(SUM(c.points), 0) FROM ctf_solves s
-        JOIN ctf_challenges c ON s.challenge_id = c.id
-        WHERE s.user_id = ?
-    ''', (user_id,))
-    ctf_points = cursor.fetchone()[0]
-    
-    # Общие очки
-    total_points = lab_points + ctf_points
-    
-    # Ранг пользователя
-    rank = calculate_rank(total_points)
-    
-    return {
-        'completed_labs': completed_labs,
-        'lab_points': lab_points,
-        'ctf_points': ctf_points,
-        'total_points': total_points,
-        'rank': rank
+    def __init__(self):
+        self.count = 0
+        self.statuses = {}
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.sql_count = [0] * (len(SQL_COUNT_BUCKETS) + 1)
+        self.sql_count_sum = 0
+        self.sql_time = [0] * (len(SQL_TIME_BUCKETS) + 1)
+        self.sql_time_sum = 0.0
+
+    def merge(self, other):
+        self.count += other.count
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        for i, count in enumerate(other.latency):
+            self.latency[i] += count
+        for i, count in enumerate(other.sql_count):
+            self.sql_count[i] += count
+        for i, count in enumerate(other.sql_time):
+            self.sql_time[i] += count
+        self.latency_sum += other.latency_sum
+        self.sql_count_sum += other.sql_count_sum
+        self.sql_time_sum += other.sql_time_sum
+
+class MetricsShard:
+    __slots__ = ('lock', 'routes', 'started', 'finished')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.started = 0
+        self.finished = 0
+
+class RequestMetrics:
+    """Метрики запросов, разбитые на шарды по потоку: блокировки почти никогда не конкурируют"""
+
+    def __init__(self, shards=16):
+        self._shards = [MetricsShard() for _ in range(shards)]
+        # Шард назначается потоку один раз по кругу (get_ident - выровненные адреса, % дает один шард)
+        self._local = threading.local()
+        self._next_shard = itertools.count()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = self._shards[next(self._next_shard) % len(self._shards)]
+        return shard
+
+    def request_started(self):
+        shard = self._shard()
+        with shard.lock:
+            shard.started += 1
+
+    def request_finished(self, endpoint, status, duration, sql_count, sql_time):
+        shard = self._shard()
+        with shard.lock:
+            shard.finished += 1
+            route = shard.routes.get(endpoint)
+            if route is None:
+                route = shard.routes[endpoint] = RouteMetrics()
+            route.count += 1
+            route.statuses[status] = route.statuses.get(status, 0) + 1
+            route.latency[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+            route.latency_sum += duration
+            route.sql_count[bisect.bisect_left(SQL_COUNT_BUCKETS, sql_count)] += 1
+            route.sql_count_sum += sql_count
+            route.sql_time[bisect.bisect_left(SQL_TIME_BUCKETS, sql_time)] += 1
+            route.sql_time_sum += sql_time
+
+    def snapshot(self):
+        """Сложение шардов: (эндпоинт -> RouteMetrics, запросов в обработке)"""
+        routes = {}
+        in_flight = 0
+        for shard in self._shards:
+            with shard.lock:
+                in_flight += shard.started - shard.finished
+                for endpoint, route in shard.routes.items():
+                    routes.setdefault(endpoint, RouteMetrics()).merge(route)
+        return routes, in_flight
+
+request_metrics = RequestMetrics(app.config['METRICS_SHARDS'])
+
+@app.before_request
+def metrics_request_started():
+    if app.config['METRICS_ENABLED']:
+        g.metrics_started = time.perf_counter()
+        request_metrics.request_started()
+
+@app.after_request
+def metrics_record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.after_request
+def sql_debug_headers(response):
+    """Отладочные заголовки SQL для администраторов"""
+    sql_stats = request_sql_stats()
+    user = g.get('current_user')
+    if (app.config['SQL_DEBUG_HEADER'] and sql_stats is not None and user is not None
+            and user.get('role') == 'admin'):
+        response.headers['X-SQL-Queries'] = str(sql_stats[0])
+        response.headers['X-SQL-Time-Ms'] = f'{sql_stats[1] * 1000:.3f}'
+    return response
+
+@app.teardown_request
+def metrics_request_finished(error):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    sql_count, sql_time = request_sql_stats() or (0, 0.0)
+    request_metrics.request_finished(
+        request.endpoint or 'unmatched',
+        g.get('metrics_status', 500),
+        time.perf_counter() - started,
+        sql_count,
+        sql_time
+    )
+
+def format_prometheus_histogram(lines, name, labels, buckets, counts, total_sum):
+    """Строки гистограммы Prometheus (бакеты накопительные)"""
+    cumulative = 0
+    for bound, count in zip(buckets, counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    cumulative += counts[-1]
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {total_sum}')
+    lines.append(f'{name}_count{{{labels}}} {cumulative}')
+
+def render_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    routes, in_flight = request_metrics.snapshot()
+    lines = [
+        '# HELP cybersib_http_requests_in_flight Запросы в обработке',
+        '# TYPE cybersib_http_requests_in_flight gauge',
+        f'cybersib_http_requests_in_flight {in_flight}',
+        '# HELP cybersib_http_requests_total Обработанные запросы по эндпоинту и коду ответа',
+        '# TYPE cybersib_http_requests_total counter'
+    ]
+    for endpoint, route in sorted(routes.items()):
+        for status, count in sorted(route.statuses.items()):
+            lines.append(f'cybersib_http_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+    histograms = (
+        ('cybersib_http_request_duration_seconds', 'Время обработки запроса',
+         LATENCY_BUCKETS, 'latency', 'latency_sum'),
+        ('cybersib_sql_statements_per_request', 'SQL-запросов на HTTP-запрос',
+         SQL_COUNT_BUCKETS, 'sql_count', 'sql_count_sum'),
+        ('cybersib_sql_time_per_request_seconds', 'Время SQL на HTTP-запрос',
+         SQL_TIME_BUCKETS, 'sql_time', 'sql_time_sum'),
+    )
+    for name, help_text, buckets, counts_attr, sum_attr in histograms:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for endpoint, route in sorted(routes.items()):
+            format_prometheus_histogram(lines, name, f'endpoint="{endpoint}"', buckets,
+                                        getattr(route, counts_attr), round(getattr(route, sum_attr), 6))
+
+    pool_stats = get_db_pool().stats()
+    lines += [
+        '# HELP cybersib_db_pool_connections Соединения пула по состоянию',
+        '# TYPE cybersib_db_pool_connections gauge',
+        f'cybersib_db_pool_connections{{state="in_use"}} {pool_stats["in_use"]}',
+        f'cybersib_db_pool_connections{{state="idle"}} {pool_stats["idle"]}',
+        '# HELP cybersib_db_pool_timeouts_total Таймауты ожидания соединения',
+        '# TYPE cybersib_db_pool_timeouts_total counter',
+        f'cybersib_db_pool_timeouts_total {pool_stats["timeouts"]}'
+    ]
+    if app.config['DB_WRITER_ENABLED']:
+        writer_stats = get_db_writer().stats()
+        lines += [
+            '# HELP cybersib_db_writer_queue_depth Задания в очереди записи',
+            '# TYPE cybersib_db_writer_queue_depth gauge',
+            f'cybersib_db_writer_queue_depth {writer_stats["queue_depth"]}',
+            '# HELP cybersib_db_writer_jobs_total Выполненные задания записи',
+            '# TYPE cybersib_db_writer_jobs_total counter',
+            f'cybersib_db_writer_jobs_total {writer_stats["jobs"]}',
+            '# HELP cybersib_db_writer_batches_total Транзакции потока записи',
+            '# TYPE cybersib_db_writer_batches_total counter',
+            f'cybersib_db_writer_batches_total {writer_stats["batches"]}'
+        ]
+    log_pipeline = app.extensions.get('cybersib_log_pipeline')
+    if log_pipeline is not None:
+        lines += [
+            '# HELP cybersib_log_records_dropped_total Записи журнала, потерянные при переполнении очереди',
+            '# TYPE cybersib_log_records_dropped_total counter',
+            f'cybersib_log_records_dropped_total {log_pipeline.queue_handler.dropped}'
+        ]
+    activity_stats = activity_logger.stats()
+    lines += [
+        '# HELP cybersib_activity_log_queue_depth События журнала активности в очереди',
+        '# TYPE cybersib_activity_log_queue_depth gauge',
+        f'cybersib_activity_log_queue_depth {activity_stats["queue_depth"]}',
+        '# HELP cybersib_activity_log_events_total События журнала активности по результату',
+        '# TYPE cybersib_activity_log_events_total counter',
+        f'cybersib_activity_log_events_total{{result="written"}} {activity_stats["written"]}',
+        f'cybersib_activity_log_events_total{{result="dropped"}} {activity_stats["dropped"]}',
+        f'cybersib_activity_log_events_total{{result="failed"}} {activity_stats["failed"]}'
+    ]
+    lines += [
+        '# HELP cybersib_sse_clients Подключенные клиенты потока событий',
+        '# TYPE cybersib_sse_clients gauge',
+        f'cybersib_sse_clients {event_bus.client_count()}'
+    ]
+    return '\n'.join(lines) + '\n'
+
+# ===== ПРОФИЛИРОВАНИЕ =====
+class StackSampler:
+    """Поток, периодически снимающий стек потока запроса (collapsed stacks для flame graph)"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        max_depth = app.config['PROFILE_MAX_DEPTH']
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < max_depth:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            stack = ';'.join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+class RouteStacks:
+    """Накопленные стеки по маршрутам с ограничением числа различных стеков"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+        self.sampled_requests = {}
+
+    def merge(self, route, stacks):
+        limit = app.config['PROFILE_MAX_STACKS_PER_ROUTE']
+        with self._lock:
+            aggregated = self.routes.setdefault(route, {})
+            for stack, count in stacks.items():
+                if stack not in aggregated and len(aggregated) >= limit:
+                    # Редкие стеки сверх лимита сводятся в одну запись
+                    stack = '[другие стеки]'
+                aggregated[stack] = aggregated.get(stack, 0) + count
+            self.sampled_requests[route] = self.sampled_requests.get(route, 0) + 1
+
+    def collapsed(self, route):
+        with self._lock:
+            stacks = dict(self.routes.get(route, {}))
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(stacks.items()))
+
+    def summary(self):
+        with self._lock:
+            return {
+                route: {
+                    'sampled_requests': self.sampled_requests.get(route, 0),
+                    'stacks': len(stacks),
+                    'samples': sum(stacks.values())
+                }
+                for route, stacks in self.routes.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self.routes.clear()
+            self.sampled_requests.clear()
+
+route_stacks = RouteStacks()
+
+PROFILE_FORMATS = ('pstats', 'collapsed')
+
+def requested_profile_format():
+    """Формат профилирования из заголовка/параметра, если запрос от администратора"""
+    flag = request.headers.get('X-Profile') or request.args.get('_profile')
+    if not flag:
+        return None
+    principal, error = authenticate_token(get_bearer_token())
+    if error or principal.get('role') != 'admin':
+        return None
+    return flag if flag in PROFILE_FORMATS else 'pstats'
+
+def save_profile(profile_format, route, profiler=None, stacks=None):
+    """Сохранение результата в PROFILE_DIR; возвращает имя файла"""
+    os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+    extension = 'prof' if profile_format == 'pstats' else 'collapsed'
+    filename = secure_filename(
+        f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{route}_{uuid.uuid4().hex[:8]}.{extension}")
+    path = os.path.join(app.config['PROFILE_DIR'], filename)
+    if profiler is not None:
+        profiler.dump_stats(path)
+    else:
+        with open(path, 'w') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f'{stack} {count}\n')
+    return filename
+
+@app.before_request
+def start_profiling():
+    profile_format = requested_profile_format()
+    if profile_format == 'pstats':
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+    elif profile_format == 'collapsed':
+        g.stack_sampler = StackSampler(threading.get_ident(),
+                                       app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000).start()
+    elif app.config['PROFILE_SAMPLE_RATE'] and random.random() < app.config['PROFILE_SAMPLE_RATE']:
+        # Фоновая выборка: стеки только накапливаются по маршруту
+        g.route_sampler = StackSampler(threading.get_ident(),
+                                       app.config['PROFILE_SAMPLE_INTERVAL_MS'] / 1000).start()
+
+@app.after_request
+def finish_profiling(response):
+    route = request.endpoint or 'unmatched'
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        response.headers['X-Profile-File'] = save_profile('pstats', route, profiler=profiler)
+    stack_sampler = g.pop('stack_sampler', None)
+    if stack_sampler is not None:
+        stacks = stack_sampler.stop()
+        response.headers['X-Profile-File'] = save_profile('collapsed', route, stacks=stacks)
+        response.headers['X-Profile-Samples'] = str(stack_sampler.samples)
+    route_sampler = g.pop('route_sampler', None)
+    if route_sampler is not None:
+        route_stacks.merge(route, route_sampler.stop())
+    return response
+
+@app.teardown_request
+def cancel_profiling(error):
+    """Остановка профилировщиков, если after_request не был вызван"""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+    for name in ('stack_sampler', 'route_sampler'):
+        sampler = g.pop(name, None)
+        if sampler is not None:
+            sampler.stop()
+
+# ===== ЖУРНАЛ АКТИВНОСТИ =====
+class ActivityLogger:
+    """Очередь событий activity_logs: запрос только кладет событие, запись - пакетами в фоновом потоке"""
+
+    def __init__(self, queue_size=10000, batch_size=500, flush_interval=1.0, drop_policy='newest'):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Счетчики для мониторинга
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_batch_size = 0
+        self.pruned = 0
+        self.last_error = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='activity-log', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5):
+        """Остановка после записи уже поставленных событий"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def log(self, user_id, action, details=None, ip_address=None, user_agent=None):
+        """Постановка события в очередь без ожидания; при переполнении событие отбрасывается"""
+        event = (str(uuid.uuid4()), user_id, action,
+                 json.dumps(details, ensure_ascii=False) if details is not None else None,
+                 ip_address, user_agent, datetime.now().isoformat(), user_id)
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            if self.drop_policy != 'oldest':
+                self.dropped += 1
+                return False
+            # Вытесняем самое старое событие, чтобы сохранить свежие
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.dropped += 1
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                return False
+        self.enqueued += 1
+        return True
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            event = self._queue.get()
+            if event is None:
+                break
+            batch = [event]
+            deadline = time.monotonic() + self.flush_interval
+
+            # Добираем события до размера пакета или истечения интервала
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    event = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if event is None:
+                    stopping = True
+                    break
+                batch.append(event)
+
+            self._write(batch)
+
+    def _write(self, batch):
+        def insert_events(cursor):
+            # Событие удаленного пользователя пропускаем, а не роняем весь пакет
+            cursor.executemany('''
+                INSERT INTO activity_logs (id, user_id, action, details, ip_address, user_agent, created_at)
+                SELECT ?, ?, ?, ?, ?, ?, ?
+                WHERE EXISTS (SELECT 1 FROM users WHERE id = ?)
+            ''', batch)
+
+        try:
+            with app.app_context():
+                run_write(insert_events)
+        except Exception as e:
+            self.failed += len(batch)
+            self.last_error = str(e)
+            return
+        self.batches += 1
+        self.written += len(batch)
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+
+    def prune(self):
+        """Удаление событий старше срока хранения короткими транзакциями"""
+        cutoff = (datetime.now() - timedelta(days=app.config['ACTIVITY_LOG_RETENTION_DAYS'])).isoformat()
+        batch_size = app.config['ACTIVITY_LOG_PRUNE_BATCH']
+
+        def delete_batch(cursor):
+            cursor.execute('''
+                DELETE FROM activity_logs WHERE rowid IN (
+                    SELECT rowid FROM activity_logs WHERE created_at < ? LIMIT ?
+                )
+            ''', (cutoff, batch_size))
+            return cursor.rowcount
+
+        total = 0
+        with app.app_context():
+            while True:
+                deleted = run_write(delete_batch)
+                total += deleted
+                if deleted < batch_size:
+                    break
+        self.pruned += total
+        return total
+
+    def stats(self):
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            'drop_policy': self.drop_policy,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'written': self.written,
+            'failed': self.failed,
+            'batches': self.batches,
+            'max_batch_size': self.max_batch_size,
+            'pruned': self.pruned,
+            'retention_days': app.config['ACTIVITY_LOG_RETENTION_DAYS'],
+            'last_error': self.last_error
+        }
+
+activity_logger = ActivityLogger(
+    queue_size=app.config['ACTIVITY_LOG_QUEUE_SIZE'],
+    batch_size=app.config['ACTIVITY_LOG_BATCH_SIZE'],
+    flush_interval=app.config['ACTIVITY_LOG_FLUSH_SECONDS'],
+    drop_policy=app.config['ACTIVITY_LOG_DROP_POLICY']
+)
+
+activity_prune_task = register_background_task(
+    'activity-log-prune', app.config['ACTIVITY_LOG_PRUNE_SECONDS'], activity_logger.prune)
+
+@atexit.register
+def stop_activity_logger():
+    activity_logger.stop()
+
+def record_activity(user_id, details=None):
+    """Пользователь для журнала активности, если запрос выполнен без токена (вход, регистрация)"""
+    g.activity_user_id = user_id
+    g.activity_details = details
+
+@app.before_request
+def activity_request_started():
+    if app.config['ACTIVITY_LOG_ENABLED'] and request.method in app.config['ACTIVITY_LOG_METHODS']:
+        g.activity_started = time.perf_counter()
+
+@app.after_request
+def activity_request_finished(response):
+    started = g.get('activity_started')
+    if started is None:
+        return response
+    current_user = g.get('current_user')
+    user_id = current_user['id'] if current_user is not None else g.get('activity_user_id')
+    if user_id is None:
+        return response
+
+    details = {
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'latency_ms': round((time.perf_counter() - started) * 1000, 3)
     }
+    if g.get('activity_details'):
+        details.update(g.activity_details)
+    activity_logger.log(user_id, request.endpoint or 'unknown', details,
+                        request.remote_addr, request.user_agent.string[:512] or None)
+    return response
 
-def calculate_rank(points):
-    """Определение ранга по очкам"""
-    if points >= 2000:
-        return 'Элита'
-    elif points >= 1500:
-        return 'Эксперт'
-    elif points >= 1000:
-        return 'Профессионал'
-    elif points >= 500:
-        return 'Продвинутый'
-    elif points >= 100:
-        return 'Средний'
+# ===== ЖУРНАЛИРОВАНИЕ =====
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, request_id, сообщение и поля extra={'fields': ...}"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', None),
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LoggerNameFilter(logging.Filter):
+    """Записи логгера name; с min_level - также записи остальных логгеров не ниже min_level"""
+
+    def __init__(self, name, exclude=False, min_level=None):
+        super().__init__()
+        self.logger_name = name
+        self.exclude = exclude
+        self.min_level = min_level
+
+    def filter(self, record):
+        if self.exclude and self.min_level is not None and record.levelno >= self.min_level:
+            return True
+        return (record.name == self.logger_name) != self.exclude
+
+class RequestQueueHandler(logging.handlers.QueueHandler):
+    """Кладет запись в ограниченную очередь: форматирование и запись в файл - в потоке QueueListener"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Выполняется в потоке запроса: фиксируем request_id и текст исключения, пока они доступны
+        record = logging.makeLogRecord(record.__dict__)
+        record.request_id = g.get('request_id') if has_request_context() else None
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Диск не успевает: теряем запись, но не задерживаем запрос
+            self.dropped += 1
+
+class LogPipeline:
+    """QueueHandler в потоках запросов -> QueueListener -> файлы с ротацией по размеру"""
+
+    def __init__(self, log_dir, max_bytes, backup_count, queue_size):
+        os.makedirs(log_dir, exist_ok=True)
+        formatter = JsonFormatter()
+
+        self.access_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, 'access.log'), maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.access_handler.addFilter(LoggerNameFilter(access_logger.name))
+        self.error_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, 'error.log'), maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.error_handler.setLevel(logging.WARNING)
+        # В журнал ошибок: предупреждения приложения и ответы 5xx из журнала доступа
+        self.error_handler.addFilter(LoggerNameFilter(access_logger.name, exclude=True, min_level=logging.ERROR))
+        for handler in (self.access_handler, self.error_handler):
+            handler.setFormatter(formatter)
+
+        self.queue_handler = RequestQueueHandler(queue.Queue(maxsize=queue_size))
+        self.listener = logging.handlers.QueueListener(
+            self.queue_handler.queue, self.access_handler, self.error_handler, respect_handler_level=True)
+        self.sampled_out = 0
+
+    def start(self):
+        for logger in (access_logger, app.logger):
+            logger.addHandler(self.queue_handler)
+        access_logger.setLevel(logging.INFO)
+        if app.logger.level == logging.NOTSET or app.logger.level > logging.WARNING:
+            app.logger.setLevel(logging.WARNING)
+        self.listener.start()
+
+    def stop(self):
+        for logger in (access_logger, app.logger):
+            logger.removeHandler(self.queue_handler)
+        # Дописывает оставшиеся записи очереди
+        self.listener.stop()
+        self.access_handler.close()
+        self.error_handler.close()
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_handler.queue.qsize(),
+            'dropped': self.queue_handler.dropped,
+            'sampled_out': self.sampled_out,
+            'sample_rate': app.config['ACCESS_LOG_SAMPLE_RATE'],
+            'slow_ms': app.config['ACCESS_LOG_SLOW_MS']
+        }
+
+# Не передаем записи доступа корневому логгеру (консоли)
+access_logger = logging.getLogger('cybersib.access')
+access_logger.propagate = False
+
+def configure_logging():
+    """Запуск конвейера журналов (повторный вызов ничего не делает)"""
+    pipeline = app.extensions.get('cybersib_log_pipeline')
+    if pipeline is None and app.config['LOG_ENABLED']:
+        pipeline = LogPipeline(app.config['LOG_DIR'], app.config['LOG_MAX_BYTES'],
+                               app.config['LOG_BACKUP_COUNT'], app.config['LOG_QUEUE_SIZE'])
+        pipeline.start()
+        app.extensions['cybersib_log_pipeline'] = pipeline
+        atexit.register(pipeline.stop)
+    return pipeline
+
+@app.before_request
+def assign_request_id():
+    """Идентификатор запроса: из заголовка клиента или прокси, иначе новый"""
+    request_id = request.headers.get(app.config['REQUEST_ID_HEADER'], '')
+    g.request_id = request_id if REQUEST_ID_PATTERN.match(request_id) else uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def log_access(response):
+    request_id = g.get('request_id')
+    if request_id is None:
+        return response
+    response.headers[app.config['REQUEST_ID_HEADER']] = request_id
+
+    pipeline = app.extensions.get('cybersib_log_pipeline')
+    if pipeline is None:
+        return response
+
+    duration_ms = (time.perf_counter() - g.request_started) * 1000
+    status = response.status_code
+    slow = duration_ms >= app.config['ACCESS_LOG_SLOW_MS']
+    if status >= 500:
+        level = logging.ERROR
+    elif status >= 400 or slow:
+        level = logging.WARNING
     else:
-        return 'Начинающий'
+        level = logging.INFO
+        # Успешные быстрые запросы пишутся выборочно
+        if random.random() >= app.config['ACCESS_LOG_SAMPLE_RATE']:
+            pipeline.sampled_out += 1
+            return response
+
+    current_user = g.get('current_user')
+    sql_stats = request_sql_stats()
+    fields = {
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': status,
+        'duration_ms': round(duration_ms, 3),
+        'bytes': response.content_length,
+        'ip': request.remote_addr,
+        'user_agent': request.user_agent.string[:512] or None,
+        'user_id': current_user['id'] if current_user is not None else g.get('activity_user_id'),
+        'sql_queries': sql_stats[0] if sql_stats is not None else None,
+        'slow': slow
+    }
+    if status >= 400 and response.is_json:
+        payload = response.get_json(silent=True)
+        if isinstance(payload, dict) and 'error' in payload:
+            fields['error'] = str(payload['error'])[:500]
+    access_logger.log(level, f'{request.method} {request.path} {status}', extra={'fields': fields})
+    return response
 
 # ===== API ЭНДПОИНТЫ =====
 
@@ -336,17 +3582,25 @@ def register():
         
         # Создание пользователя
         user_id = str(uuid.uuid4())
-        password_hash = generate_password_hash(password)
+        password_hash = password_hasher.hash(password)
         
         # Генерация аватара
         avatar_url = f'https://robohash.org/{username}.png?set=set4'
         
-        cursor.execute('''
-            INSERT INTO users (id, username, email, password_hash, user_group, subscription_level, role, avatar_url)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, username, email, password_hash, user_group, 'free', 'student', avatar_url))
+        def insert_user(cursor):
+            cursor.execute('''
+                INSERT INTO users (id, username, email, password_hash, user_group, subscription_level, role, avatar_url)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, username, email, password_hash, user_group, 'free', 'student', avatar_url))
         
-        db.commit()
+        try:
+            run_write(insert_user)
+        except sqlite3.IntegrityError:
+            # Пользователь успел зарегистрироваться после проверки выше
+            return jsonify({'error': 'Пользователь с таким именем или email уже существует'}), 409
+        leaderboard.upsert_user(user_id, username, avatar_url, user_group)
+        data_versions.bump('platform')
+        record_activity(user_id, {'event': 'register'})
         
         # Генерация токенов
         access_token, refresh_token = generate_tokens(user_id)
@@ -366,6 +3620,10 @@ def register():
             'refresh_token': refresh_token
         }), 201
         
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
+    except DatabaseBusy as e:
+        return database_busy_response(e)
     except Exception as e:
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
@@ -392,11 +3650,19 @@ def login():
             return jsonify({'error': 'Неверное имя пользователя или пароль'}), 401
         
         # Проверка пароля
-        if not check_password_hash(user['password_hash'], password):
+        if not password_hasher.verify(user['password_hash'], password):
             return jsonify({'error': 'Неверное имя пользователя или пароль'}), 401
         
+        # Перехеширование при смене параметров KDF
+        if password_hasher.needs_rehash(user['password_hash']):
+            new_hash = password_hasher.hash(password)
+            run_write(lambda cursor: cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', 
+                                                    (new_hash, user['id'])))
+            password_hasher.record_rehash()
+        
         # Генерация токенов
         access_token, refresh_token = generate_tokens(user['id'])
+        record_activity(user['id'], {'event': 'login', 'subscription': user['subscription_level']})
         
         # Получение статистики
         stats = calculate_user_stats(user['id'])
@@ -417,6 +3683,10 @@ def login():
             'refresh_token': refresh_token
         })
         
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
+    except DatabaseBusy as e:
+        return database_busy_response(e)
     except Exception as e:
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
@@ -433,26 +3703,19 @@ def refresh_token():
         
         try:
             # Декодируем refresh токен
-            payload = jwt.decode(refresh_token, app.config['SECRET_KEY'], algorithms=['HS256'])
+            payload = decode_token(refresh_token)
             
             if payload.get('type') != 'refresh':
                 return jsonify({'error': 'Неверный тип токена'}), 401
             
             user_id = payload['user_id']
             
-            # Проверяем существование пользователя
-            db = get_db()
-            cursor = db.cursor()
-            cursor.execute('SELECT id FROM users WHERE id = ?', (user_id,))
-            if not cursor.fetchone():
+            # Проверяем существование пользователя (из кэша или БД)
+            if not load_principal(user_id):
                 return jsonify({'error': 'Пользователь не найден'}), 401
             
             # Генерируем новый access токен
-            new_access_token = jwt.encode({
-                'user_id': user_id,
-                'exp': datetime.utcnow() + app.config['JWT_ACCESS_TOKEN_EXPIRES'],
-                'type': 'access'
-            }, app.config['SECRET_KEY'], algorithm='HS256')
+            new_access_token = generate_access_token(user_id)
             
             return jsonify({
                 'access_token': new_access_token
@@ -460,6 +3723,8 @@ def refresh_token():
             
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Срок действия refresh токена истек'}), 401
+        except TokenRevokedError:
+            return jsonify({'error': 'Refresh токен отозван'}), 401
         except jwt.InvalidTokenError:
             return jsonify({'error': 'Неверный refresh токен'}), 401
             
@@ -469,10 +3734,43 @@ def refresh_token():
 @app.route('/api/auth/logout', methods=['POST'])
 @token_required
 def logout():
-    """Выход пользователя"""
-    # В JWT нет состояния, так что просто возвращаем успех
-    # В продакшене можно добавить blacklist токенов
-    return jsonify({'message': 'Выход выполнен успешно'})
+    """Выход пользователя: access токен (и refresh токен из тела запроса) отзываются"""
+    try:
+        user_id = g.current_user['id']
+        tokens = [get_bearer_token()]
+        
+        data = request.get_json(silent=True) or {}
+        refresh_token = data.get('refresh_token')
+        if refresh_token:
+            try:
+                payload = decode_token(refresh_token)
+            except jwt.InvalidTokenError:
+                payload = None
+            # Отзываем только собственный действующий refresh токен
+            if payload and payload.get('type') == 'refresh' and payload.get('user_id') == user_id:
+                tokens.append(refresh_token)
+        
+        revoked = []
+        for token in tokens:
+            claims = decode_token(token)
+            revoked.append((token_id(claims, token), claims['exp']))
+        
+        def insert_revocations(cursor):
+            for jti, exp in revoked:
+                revoke_token(cursor, user_id, jti, exp)
+        
+        run_write(insert_revocations)
+        
+        # Отзыв действует в этом процессе сразу, в остальных - после синхронизации
+        for jti, exp in revoked:
+            revoked_tokens.add(jti, exp)
+        
+        return jsonify({'message': 'Выход выполнен успешно'})
+        
+    except DatabaseBusy as e:
+        return database_busy_response(e)
+    except Exception as e:
+        return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
 # ---- ПОЛЬЗОВАТЕЛИ ----
 @app.route('/api/users/me', methods=['GET'])
@@ -544,13 +3842,18 @@ def update_current_user():
         if update_fields:
             update_values.append(user_id)
             query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?"
-            cursor.execute(query, update_values)
-            db.commit()
+            try:
+                run_write(lambda write_cursor: write_cursor.execute(query, update_values))
+            except sqlite3.IntegrityError:
+                return jsonify({'error': 'Имя пользователя или email уже заняты'}), 409
+            invalidate_principal(user_id)
+            data_versions.bump('platform')
         
         # Получаем обновленные данные
         cursor.execute('SELECT * FROM users WHERE id = ?', (user_id,))
         user = dict(cursor.fetchone())
         stats = calculate_user_stats(user_id)
+        leaderboard.upsert_user(user_id, user['username'], user['avatar_url'], user['user_group'])
         
         return jsonify({
             'message': 'Данные обновлены',
@@ -566,6 +3869,8 @@ def update_current_user():
             }
         })
         
+    except DatabaseBusy as e:
+        return database_busy_response(e)
     except Exception as e:
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
@@ -597,17 +3902,21 @@ def change_password():
             return jsonify({'error': 'Пользователь не найден'}), 404
         
         # Проверяем текущий пароль
-        if not check_password_hash(user['password_hash'], current_password):
+        if not password_hasher.verify(user['password_hash'], current_password):
             return jsonify({'error': 'Неверный текущий пароль'}), 401
         
         # Обновляем пароль
-        new_password_hash = generate_password_hash(new_password)
-        cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', 
-                     (new_password_hash, user_id))
-        db.commit()
+        new_password_hash = password_hasher.hash(new_password)
+        run_write(lambda write_cursor: write_cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', 
+                                                            (new_password_hash, user_id)))
+        invalidate_principal(user_id)
         
         return jsonify({'message': 'Пароль успешно изменен'})
         
+    except PasswordHasherBusy:
+        return password_hasher_busy_response()
+    except DatabaseBusy as e:
+        return database_busy_response(e)
     except Exception as e:
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
@@ -635,24 +3944,28 @@ def upload_avatar():
             file.save(filepath)
             
             # Обновляем ссылку в БД
-            db = get_db()
-            cursor = db.cursor()
+            user_id = g.current_user['id']
             avatar_url = f"/static/avatars/{unique_filename}"
-            cursor.execute('UPDATE users SET avatar_url = ? WHERE id = ?', 
-                         (avatar_url, g.current_user['id']))
-            db.commit()
+            run_write(lambda cursor: cursor.execute('UPDATE users SET avatar_url = ? WHERE id = ?', 
+                                                    (avatar_url, user_id)))
+            invalidate_principal(g.current_user['id'])
+            leaderboard.upsert_user(g.current_user['id'], g.current_user['username'],
+                                    avatar_url, g.current_user['user_group'])
             
             return jsonify({
                 'message': 'Аватар успешно загружен',
                 'avatar_url': avatar_url
             })
         
+    except DatabaseBusy as e:
+        return database_busy_response(e)
     except Exception as e:
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
 # ---- ЛАБОРАТОРИИ ----
 @app.route('/api/labs', methods=['GET'])
 @token_required
+@conditional_get('catalog', per_user=True, pending_attempts=True)
 def get_labs():
     """Получение списка лабораторий"""
     try:
@@ -660,38 +3973,34 @@ def get_labs():
         cursor = db.cursor()
         
         # Параметры фильтрации
-        difficulty = request.args.get('difficulty')
-        category = request.args.get('category')
+        difficulty = request.args.get('difficulty') or None
+        category = request.args.get('category') or None
         status = request.args.get('status', 'active')
         
-        query = "SELECT * FROM labs WHERE 1=1"
-        params = []
-        
-        if difficulty:
-            query += " AND difficulty = ?"
-            params.append(difficulty)
-        
-        if category:
-            query += " AND category = ?"
-            params.append(category)
+        catalog = get_catalog()
+        labs = [dict(lab) for lab in catalog.find_labs(difficulty, category, status == 'active')]
         
-        if status == 'active':
-            query += " AND is_active = 1"
+        # Получаем прогресс пользователя по всем лабораториям одним запросом
+        user_id = g.current_user['id']
+        cursor.execute('''
+            SELECT lab_id, status, score, attempts FROM user_progress 
+            WHERE user_id = ?
+        ''', (user_id,))
+        progress_by_lab = {
+            row['lab_id']: {'status': row['status'], 'score': row['score'], 'attempts': row['attempts']}
+            for row in cursor.fetchall()
+        }
         
-        cursor.execute(query, params)
-        labs = [dict(row) for row in cursor.fetchall()]
+        # Учитываем неверные попытки, еще не записанные в БД
+        for lab_id, attempts in attempt_buffer.pending_for_user(user_id).items():
+            progress = progress_by_lab.setdefault(lab_id, {'status': 'in_progress', 'score': 0, 'attempts': 0})
+            progress['attempts'] += attempts
         
-        # Получаем прогресс пользователя для каждой лаборатории
-        user_id = g.current_user['id']
         for lab in labs:
-            cursor.execute('''
-                SELECT status, score, attempts FROM user_progress 
-                WHERE user_id = ? AND lab_id = ?
-            ''', (user_id, lab['id']))
-            progress = cursor.fetchone()
+            progress = progress_by_lab.get(lab['id'])
             
             if progress:
-                lab['user_progress'] = dict(progress)
+                lab['user_progress'] = progress
             else:
                 lab['user_progress'] = {
                     'status': 'not_started',
@@ -706,20 +4015,20 @@ def get_labs():
 
 @app.route('/api/labs/<lab_id>', methods=['GET'])
 @token_required
+@conditional_get('catalog', per_user=True, pending_attempts=True)
 def get_lab(lab_id):
     """Получение информации о конкретной лаборатории"""
     try:
-        db = get_db()
-        cursor = db.cursor()
-        
-        cursor.execute('SELECT * FROM labs WHERE id = ?', (lab_id,))
-        lab = cursor.fetchone()
+        lab = find_catalog_lab(lab_id)
         
         if not lab:
             return jsonify({'error': 'Лаборатория не найдена'}), 404
         
         lab_data = dict(lab)
         
+        db = get_db()
+        cursor = db.cursor()
+        
         # Получаем прогресс пользователя
         user_id = g.current_user['id']
         cursor.execute('''
@@ -727,14 +4036,16 @@ def get_lab(lab_id):
             WHERE user_id = ? AND lab_id = ?
         ''', (user_id, lab_id))
         progress = cursor.fetchone()
+        pending_attempts = attempt_buffer.pending(user_id, lab_id)
         
         if progress:
             lab_data['user_progress'] = dict(progress)
+            lab_data['user_progress']['attempts'] += pending_attempts
         else:
             lab_data['user_progress'] = {
-                'status': 'not_started',
+                'status': 'in_progress' if pending_attempts else 'not_started',
                 'score': 0,
-                'attempts': 0
+                'attempts': pending_attempts
             }
         
         return jsonify(lab_data)
@@ -761,24 +4072,55 @@ def start_lab(lab_id):
         
         # Проверяем, не начата ли уже лаборатория
         cursor.execute('''
-            SELECT id FROM user_progress 
-            WHERE user_id = ? AND lab_id = ? AND status = 'in_progress'
+            SELECT status FROM user_progress 
+            WHERE user_id = ? AND lab_id = ?
         ''', (user_id, lab_id))
+        previous = cursor.fetchone()
         
-        if cursor.fetchone():
+        if previous and previous['status'] == 'in_progress':
             return jsonify({'error': 'Лаборатория уже выполняется'}), 400
         
-        # Создаем запись о начале
+        # Создаем запись о начале (неверные попытки из буфера больше не нужны)
+        attempt_buffer.discard(user_id, lab_id)
         progress_id = str(uuid.uuid4())
-        started_at = datetime.now().isoformat()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO user_progress 
-            (id, user_id, lab_id, status, started_at, attempts, score)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (progress_id, user_id, lab_id, 'in_progress', started_at, 0, 0))
+        started_at = datetime.now().isoformat()
         
-        db.commit()
+        def start_progress(cursor):
+            # Повторная проверка внутри транзакции записи
+            cursor.execute('''
+                SELECT status, score, completed_at FROM user_progress 
+                WHERE user_id = ? AND lab_id = ?
+            ''', (user_id, lab_id))
+            previous = cursor.fetchone()
+            
+            if previous and previous['status'] == 'in_progress':
+                return False
+            
+            # Существующая запись перезаписывается через UPDATE, чтобы сработали триггеры счетчиков
+            if previous:
+                cursor.execute('''
+                    UPDATE user_progress 
+                    SET id = ?, status = ?, started_at = ?, completed_at = NULL, attempts = ?, score = ?
+                    WHERE user_id = ? AND lab_id = ?
+                ''', (progress_id, 'in_progress', started_at, 0, 0, user_id, lab_id))
+            else:
+                cursor.execute('''
+                    INSERT INTO user_progress 
+                    (id, user_id, lab_id, status, started_at, attempts, score)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (progress_id, user_id, lab_id, 'in_progress', started_at, 0, 0))
+            
+            # Повторный старт сбрасывает ранее завершенную лабораторию
+            if previous and previous['status'] == 'completed':
+                update_user_score(cursor, user_id, completed_labs=-1, lab_points=-(previous['score'] or 0))
+                if previous['completed_at']:
+                    update_daily_activity(cursor, user_id, previous['completed_at'],
+                                          labs_completed=-1, points=-(previous['score'] or 0))
+            return True
+        
+        if not run_write(start_progress):
+            return jsonify({'error': 'Лаборатория уже выполняется'}), 400
+        data_versions.bump('platform')
         
         return jsonify({
             'message': 'Лаборатория начата',
@@ -786,11 +4128,14 @@ def start_lab(lab_id):
             'started_at': started_at
         })
         
+    except DatabaseBusy as e:
+        return database_busy_response(e)
     except Exception as e:
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
 @app.route('/api/labs/<lab_id>/submit', methods=['POST'])
 @token_required
+@rate_limited('lab_submit')
 def submit_lab(lab_id):
     """Отправка флага лаборатории"""
     try:
@@ -817,25 +4162,47 @@ def submit_lab(lab_id):
             # Флаг правильный
             completed_at = datetime.now().isoformat()
             
-            # Обновляем прогресс
-            cursor.execute('''
-                UPDATE user_progress 
-                SET status = 'completed', completed_at = ?, 
-                    attempts = attempts + 1, score = ?
-                WHERE user_id = ? AND lab_id = ?
-            ''', (completed_at, lab['points'], user_id, lab_id))
+            # Чтение прежнего прогресса и запись - в одной транзакции потока записи
+            def complete_lab(cursor):
+                cursor.execute('''
+                    SELECT status, score, completed_at FROM user_progress 
+                    WHERE user_id = ? AND lab_id = ?
+                ''', (user_id, lab_id))
+                previous = cursor.fetchone()
+                was_completed = previous is not None and previous['status'] == 'completed'
             
-            # Если записи не было, создаем
-            if cursor.rowcount == 0:
-                progress_id = str(uuid.uuid4())
+                # Обновляем прогресс
                 cursor.execute('''
-                    INSERT INTO user_progress 
-                    (id, user_id, lab_id, status, started_at, completed_at, attempts, score)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (progress_id, user_id, lab_id, 'completed', 
-                      completed_at, completed_at, 1, lab['points']))
+                    UPDATE user_progress 
+                    SET status = 'completed', completed_at = ?, 
+                        attempts = attempts + 1, score = ?
+                    WHERE user_id = ? AND lab_id = ?
+                ''', (completed_at, lab['points'], user_id, lab_id))
             
-            db.commit()
+                # Если записи не было, создаем
+                if cursor.rowcount == 0:
+                    progress_id = str(uuid.uuid4())
+                    cursor.execute('''
+                        INSERT INTO user_progress 
+                        (id, user_id, lab_id, status, started_at, completed_at, attempts, score)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', (progress_id, user_id, lab_id, 'completed', 
+                          completed_at, completed_at, 1, lab['points']))
+            
+                # Обновляем очки и дневную активность в той же транзакции
+                if was_completed:
+                    update_user_score(cursor, user_id, lab_points=lab['points'] - (previous['score'] or 0))
+                    # Повторное прохождение переносит завершение на сегодняшний день
+                    if previous['completed_at']:
+                        update_daily_activity(cursor, user_id, previous['completed_at'],
+                                              labs_completed=-1, points=-(previous['score'] or 0))
+                else:
+                    update_user_score(cursor, user_id, completed_labs=1, lab_points=lab['points'])
+                update_daily_activity(cursor, user_id, completed_at, labs_completed=1, points=lab['points'])
+            
+            run_write(complete_lab)
+            data_versions.bump('platform')
+            publish_user_stats(user_id)
             
             return jsonify({
                 'message': 'Поздравляем! Лаборатория успешно завершена',
@@ -843,30 +4210,16 @@ def submit_lab(lab_id):
                 'points': lab['points']
             })
         else:
-            # Флаг неверный
-            cursor.execute('''
-                UPDATE user_progress 
-                SET attempts = attempts + 1
-                WHERE user_id = ? AND lab_id = ?
-            ''', (user_id, lab_id))
-            
-            # Если записи не было, создаем с статусом in_progress
-            if cursor.rowcount == 0:
-                progress_id = str(uuid.uuid4())
-                started_at = datetime.now().isoformat()
-                cursor.execute('''
-                    INSERT INTO user_progress 
-                    (id, user_id, lab_id, status, started_at, attempts, score)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (progress_id, user_id, lab_id, 'in_progress', started_at, 1, 0))
-            
-            db.commit()
+            # Флаг неверный: попытка копится в буфере и записывается пакетом
+            attempt_buffer.add(user_id, lab_id)
             
             return jsonify({
                 'message': 'Неверный флаг',
                 'correct': False
             })
         
+    except DatabaseBusy as e:
+        return database_busy_response(e)
     except Exception as e:
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
@@ -888,6 +4241,7 @@ def get_lab_progress(lab_id):
         ''', (user_id, lab_id))
         
         progress = cursor.fetchone()
+        pending_attempts = attempt_buffer.pending(user_id, lab_id)
         
         if not progress:
             # Если прогресса нет, возвращаем базовую информацию
@@ -901,12 +4255,14 @@ def get_lab_progress(lab_id):
                 'lab_id': lab_id,
                 'title': lab['title'],
                 'max_points': lab['points'],
-                'status': 'not_started',
+                'status': 'in_progress' if pending_attempts else 'not_started',
                 'score': 0,
-                'attempts': 0
+                'attempts': pending_attempts
             })
         
-        return jsonify(dict(progress))
+        progress = dict(progress)
+        progress['attempts'] += pending_attempts
+        return jsonify(progress)
         
     except Exception as e:
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
@@ -914,6 +4270,7 @@ def get_lab_progress(lab_id):
 # ---- CTF СИСТЕМА ----
 @app.route('/api/ctf/challenges', methods=['GET'])
 @token_required
+@conditional_get('catalog', 'solves', per_user=True)
 def get_ctf_challenges():
     """Получение списка CTF задач"""
     try:
@@ -921,35 +4278,30 @@ def get_ctf_challenges():
         cursor = db.cursor()
         
         # Параметры фильтрации
-        category = request.args.get('category')
-        difficulty = request.args.get('difficulty')
-        
-        query = "SELECT * FROM ctf_challenges WHERE 1=1"
-        params = []
-        
-        if category:
-            query += " AND category = ?"
-            params.append(category)
-        
-        if difficulty:
-            query += " AND difficulty = ?"
-            params.append(difficulty)
+        category = request.args.get('category') or None
+        difficulty = request.args.get('difficulty') or None
         
-        cursor.execute(query, params)
-        challenges = [dict(row) for row in cursor.fetchall()]
+        catalog = get_catalog()
+        challenges = []
+        for challenge in catalog.find_challenges(category, difficulty):
+            challenge = dict(challenge)
+            challenge['solves_count'] = catalog_cache.solve_count(challenge['id'])
+            challenges.append(challenge)
         
-        # Получаем информацию о решенных задачах
+        # Получаем информацию о решенных задачах одним запросом
         user_id = g.current_user['id']
+        cursor.execute('''
+            SELECT challenge_id, solved_at FROM ctf_solves 
+            WHERE user_id = ?
+        ''', (user_id,))
+        solved_at_by_challenge = {row['challenge_id']: row['solved_at'] for row in cursor.fetchall()}
+        
         for challenge in challenges:
-            cursor.execute('''
-                SELECT solved_at FROM ctf_solves 
-                WHERE user_id = ? AND challenge_id = ?
-            ''', (user_id, challenge['id']))
-            solve = cursor.fetchone()
+            solved_at = solved_at_by_challenge.get(challenge['id'])
             
-            challenge['solved'] = solve is not None
-            if solve:
-                challenge['solved_at'] = solve['solved_at']
+            challenge['solved'] = challenge['id'] in solved_at_by_challenge
+            if challenge['solved']:
+                challenge['solved_at'] = solved_at
         
         return jsonify(challenges)
         
@@ -958,20 +4310,20 @@ def get_ctf_challenges():
 
 @app.route('/api/ctf/challenges/<challenge_id>', methods=['GET'])
 @token_required
+@conditional_get('catalog', 'solves', per_user=True)
 def get_ctf_challenge(challenge_id):
     """Получение информации о CTF задаче"""
     try:
-        db = get_db()
-        cursor = db.cursor()
-        
-        cursor.execute('SELECT * FROM ctf_challenges WHERE id = ?', (challenge_id,))
-        challenge = cursor.fetchone()
+        challenge = find_catalog_challenge(challenge_id)
         
         if not challenge:
             return jsonify({'error': 'Задача не найдена'}), 404
         
         challenge_data = dict(challenge)
         
+        db = get_db()
+        cursor = db.cursor()
+        
         # Проверяем, решена ли задача
         user_id = g.current_user['id']
         cursor.execute('''
@@ -985,12 +4337,7 @@ def get_ctf_challenge(challenge_id):
             challenge_data['solved_at'] = solve['solved_at']
         
         # Количество решений
-        cursor.execute('''
-            SELECT COUNT(*) as solve_count FROM ctf_solves 
-            WHERE challenge_id = ?
-        ''', (challenge_id,))
-        solve_count = cursor.fetchone()['solve_count']
-        challenge_data['solve_count'] = solve_count
+        challenge_data['solve_count'] = catalog_cache.solve_count(challenge_id)
         
         return jsonify(challenge_data)
         
@@ -999,6 +4346,7 @@ def get_ctf_challenge(challenge_id):
 
 @app.route('/api/ctf/challenges/<challenge_id>/submit', methods=['POST'])
 @token_required
+@rate_limited('ctf_submit')
 def submit_ctf_flag(challenge_id):
     """Отправка флага CTF задачи"""
     try:
@@ -1035,12 +4383,39 @@ def submit_ctf_flag(challenge_id):
             solve_id = str(uuid.uuid4())
             solved_at = datetime.now().isoformat()
             
-            cursor.execute('''
-                INSERT INTO ctf_solves (id, user_id, challenge_id, solved_at, flag_submitted)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (solve_id, user_id, challenge_id, solved_at, submitted_flag))
+            def insert_solve(cursor):
+                cursor.execute('''
+                    INSERT INTO ctf_solves (id, user_id, challenge_id, solved_at, flag_submitted)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (solve_id, user_id, challenge_id, solved_at, submitted_flag))
+                solve_seq = cursor.lastrowid
+                
+                # Обновляем очки и дневную активность в той же транзакции
+                update_user_score(cursor, user_id, ctf_solved=1, ctf_points=challenge['points'],
+                                  last_solve_at=solved_at)
+                update_daily_activity(cursor, user_id, solved_at, ctf_solved=1, points=challenge['points'])
+                return solve_seq
             
-            db.commit()
+            try:
+                solve_seq = run_write(insert_solve)
+            except sqlite3.IntegrityError:
+                # Параллельная отправка того же флага уже записала решение
+                return jsonify({'error': 'Задача уже решена'}), 400
+            leaderboard.record_solve(user_id, challenge['points'], solved_at, solve_seq)
+            catalog_cache.record_solve(challenge_id)
+            data_versions.bump('platform', 'solves')
+            
+            # Уведомляем подписчиков потока событий
+            event_bus.publish('solve', {
+                'user_id': user_id,
+                'username': g.current_user['username'],
+                'challenge_id': challenge_id,
+                'title': challenge['title'],
+                'points': challenge['points'],
+                'solved_at': solved_at
+            })
+            publish_leaderboard_delta(user_id)
+            publish_user_stats(user_id)
             
             return jsonify({
                 'message': 'Поздравляем! Задача решена',
@@ -1054,47 +4429,64 @@ def submit_ctf_flag(challenge_id):
                 'correct': False
             })
         
+    except DatabaseBusy as e:
+        return database_busy_response(e)
     except Exception as e:
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
 @app.route('/api/ctf/leaderboard', methods=['GET'])
+@conditional_get('leaderboard')
 def get_ctf_leaderboard():
     """Получение таблицы лидеров CTF"""
     try:
-        db = get_db()
-        cursor = db.cursor()
+        # Параметры пагинации
+        limit = request.args.get('limit', 50, type=int)
+        limit = min(max(limit, 1), app.config['LEADERBOARD_MAX_LIMIT'])
+        offset = max(request.args.get('offset', 0, type=int), 0)
         
-        # Получаем топ пользователей по очкам CTF
-        cursor.execute('''
-            SELECT 
-                u.id,
-                u.username,
-                u.avatar_url,
-                u.user_group,
-                COALESCE(SUM(c.points), 0) as total_points,
-                COUNT(DISTINCT s.challenge_id) as solved_count
-            FROM users u
-            LEFT JOIN ctf_solves s ON u.id = s.user_id
-            LEFT JOIN ctf_challenges c ON s.challenge_id = c.id
-            GROUP BY u.id, u.username, u.avatar_url, u.user_group
-            ORDER BY total_points DESC, solved_count DESC
-            LIMIT 50
-        ''')
+        board = get_leaderboard()
+        response = jsonify(board.page(offset, limit))
+        response.headers['X-Total-Count'] = str(board.size())
+        return response
         
-        leaderboard = []
-        for i, row in enumerate(cursor.fetchall()):
-            user_data = dict(row)
-            user_data['rank'] = i + 1
-            user_data['rank_title'] = calculate_rank(user_data['total_points'])
-            leaderboard.append(user_data)
+    except Exception as e:
+        return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
+
+def leaderboard_position_response(user_id):
+    """Ранг пользователя с соседями по таблице лидеров"""
+    radius = request.args.get('radius', 5, type=int)
+    radius = min(max(radius, 0), app.config['LEADERBOARD_MAX_RADIUS'])
+    
+    position = get_leaderboard().around(user_id, radius)
+    if position is None:
+        return jsonify({'error': 'Пользователь не найден'}), 404
+    
+    return jsonify(position)
+
+@app.route('/api/ctf/leaderboard/me', methods=['GET'])
+@token_required
+@conditional_get('leaderboard', per_user=True)
+def get_my_leaderboard_position():
+    """Место текущего пользователя в таблице лидеров CTF"""
+    try:
+        return leaderboard_position_response(g.current_user['id'])
         
-        return jsonify(leaderboard)
+    except Exception as e:
+        return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
+
+@app.route('/api/ctf/leaderboard/users/<user_id>', methods=['GET'])
+@conditional_get('leaderboard')
+def get_user_leaderboard_position(user_id):
+    """Место пользователя в таблице лидеров CTF"""
+    try:
+        return leaderboard_position_response(user_id)
         
     except Exception as e:
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
 @app.route('/api/ctf/stats', methods=['GET'])
 @token_required
+@conditional_get('catalog', per_user=True)
 def get_ctf_stats():
     """Получение статистики CTF для текущего пользователя"""
     try:
@@ -1151,61 +4543,44 @@ def get_ctf_stats():
 # ---- СТАТИСТИКА И АНАЛИТИКА ----
 @app.route('/api/stats/overview', methods=['GET'])
 @token_required
+@conditional_get('platform', 'catalog')
 def get_stats_overview():
     """Получение общей статистики платформы"""
     try:
-        db = get_db()
-        cursor = db.cursor()
-        
-        # Общее количество пользователей
-        cursor.execute('SELECT COUNT(*) as total_users FROM users')
-        total_users = cursor.fetchone()['total_users']
-        
-        # Активные пользователи (за последние 7 дней)
-        week_ago = (datetime.now() - timedelta(days=7)).isoformat()
-        cursor.execute('''
-            SELECT COUNT(DISTINCT user_id) as active_users 
-            FROM user_progress 
-            WHERE started_at > ?
-        ''', (week_ago,))
-        active_users = cursor.fetchone()['active_users']
-        
-        # Общее количество лабораторий
-        cursor.execute('SELECT COUNT(*) as total_labs FROM labs WHERE is_active = 1')
-        total_labs = cursor.fetchone()['total_labs']
-        
-        # Завершенные лаборатории
-        cursor.execute('SELECT COUNT(*) as completed_labs FROM user_progress WHERE status = "completed"')
-        completed_labs = cursor.fetchone()['completed_labs']
-        
-        # CTF статистика
-        cursor.execute('SELECT COUNT(*) as total_ctf FROM ctf_challenges')
-        total_ctf = cursor.fetchone()['total_ctf']
-        
-        cursor.execute('SELECT COUNT(*) as solved_ctf FROM ctf_solves')
-        solved_ctf = cursor.fetchone()['solved_ctf']
+        # Дорогой счетчик активных пользователей обновляет фоновая задача (start_services)
+        counters = get_platform_counters()
+        values = counters.values
+        active_users = values.get('active_users_7d')
+        if active_users is None:
+            # Задача еще не записала значение (или фоновые задачи отключены)
+            active_users = count_active_users(get_db().cursor())
+        catalog = get_catalog()
         
         # Распределение по подпискам
-        cursor.execute('''
-            SELECT subscription_level, COUNT(*) as count 
-            FROM users 
-            GROUP BY subscription_level
-        ''')
-        subscriptions = [dict(row) for row in cursor.fetchall()]
+        subscriptions = [
+            {'subscription_level': name.split(':', 1)[1], 'count': count}
+            for name, count in sorted(values.items())
+            if name.startswith('subscription:') and count > 0
+        ]
         
         return jsonify({
             'users': {
-                'total': total_users,
+                'total': values.get('users', 0),
                 'active': active_users,
                 'subscriptions': subscriptions
             },
             'labs': {
-                'total': total_labs,
-                'completed': completed_labs
+                'total': len(catalog.find_labs(active_only=True)),
+                'completed': values.get('labs_completed', 0)
             },
             'ctf': {
-                'total': total_ctf,
-                'solved': solved_ctf
+                'total': len(catalog.challenges_by_id),
+                'solved': values.get('ctf_solved', 0)
+            },
+            'staleness': {
+                'counters_age_seconds': round(time.monotonic() - counters.loaded_at, 3),
+                'active_users_age_seconds': counters.age_seconds('active_users_7d'),
+                'active_users_refresh_seconds': app.config['ACTIVE_USERS_REFRESH_SECONDS']
             },
             'timestamp': datetime.now().isoformat()
         })
@@ -1215,6 +4590,7 @@ def get_stats_overview():
 
 @app.route('/api/stats/user-progress', methods=['GET'])
 @token_required
+@conditional_get('catalog', per_user=True, time_bucket=300)
 def get_user_progress():
     """Получение прогресса текущего пользователя"""
     try:
@@ -1265,38 +4641,58 @@ def get_user_progress():
         
         recent_activity = [dict(row) for row in cursor.fetchall()]
         
-        # Еженедельный прогресс (последние 4 недели)
-        weekly_data = []
-        for i in range(4):
-            week_start = (datetime.now() - timedelta(weeks=i+1)).replace(hour=0, minute=0, second=0, microsecond=0)
-            week_end = (datetime.now() - timedelta(weeks=i)).replace(hour=23, minute=59, second=59, microsecond=999999)
-            
-            cursor.execute('''
-                SELECT 
-                    COUNT(DISTINCT up.lab_id) as labs_completed,
-                    COUNT(DISTINCT s.challenge_id) as ctf_solved,
-                    COALESCE(SUM(up.score), 0) + COALESCE(SUM(c.points), 0) as points_earned
-                FROM users u
-                LEFT JOIN user_progress up ON u.id = up.user_id 
-                    AND up.completed_at BETWEEN ? AND ?
-                    AND up.status = 'completed'
-                LEFT JOIN ctf_solves s ON u.id = s.user_id 
-                    AND s.solved_at BETWEEN ? AND ?
-                LEFT JOIN ctf_challenges c ON s.challenge_id = c.id
-                WHERE u.id = ?
-            ''', (week_start.isoformat(), week_end.isoformat(), 
-                  week_start.isoformat(), week_end.isoformat(), 
-                  user_id))
-            
-            week_stats = dict(cursor.fetchone())
-            week_stats['week_start'] = week_start.isoformat()
-            week_stats['week_end'] = week_end.isoformat()
-            weekly_data.append(week_stats)
+        # Динамика активности за период (один диапазонный запрос по дневным итогам)
+        granularity = request.args.get('granularity', 'week')
+        if granularity not in ACTIVITY_GRANULARITIES:
+            return jsonify({'error': 'granularity должен быть day, week или month'}), 400
+        
+        period_days = parse_period(request.args.get('period', '4w'))
+        if period_days is None:
+            return jsonify({'error': 'Неверный период (примеры: 30d, 4w, 6m, 1y)'}), 400
+        
+        today = datetime.now().date()
+        first_day = bucket_start(today - timedelta(days=period_days - 1), granularity)
+        
+        cursor.execute('''
+            SELECT day, labs_completed, ctf_solved, points 
+            FROM user_daily_activity
+            WHERE user_id = ? AND day BETWEEN ? AND ?
+        ''', (user_id, first_day.isoformat(), today.isoformat()))
+        
+        buckets = {}
+        for row in cursor.fetchall():
+            start = bucket_start(datetime.strptime(row['day'], '%Y-%m-%d').date(), granularity)
+            bucket = buckets.setdefault(start, [0, 0, 0])
+            bucket[0] += row['labs_completed']
+            bucket[1] += row['ctf_solved']
+            bucket[2] += row['points']
+        
+        # Периоды без активности тоже попадают в ряд (сначала самые свежие)
+        activity_series = []
+        start = bucket_start(today, granularity)
+        while start >= first_day:
+            labs_completed, ctf_solved, points_earned = buckets.get(start, (0, 0, 0))
+            previous_start = bucket_start(start - timedelta(days=1), granularity)
+            end = next_bucket_start(start, granularity) - timedelta(days=1)
+            activity_series.append({
+                'period_start': start.isoformat(),
+                'period_end': end.isoformat(),
+                'labs_completed': labs_completed,
+                'ctf_solved': ctf_solved,
+                'points_earned': points_earned
+            })
+            start = previous_start
         
         return jsonify({
             'lab_progress': lab_progress,
             'recent_activity': recent_activity,
-            'weekly_progress': weekly_data,
+            'activity': {
+                'granularity': granularity,
+                'period_days': period_days,
+                'series': activity_series
+            },
+            # Прежний формат для клиентов, читающих недельный прогресс
+            'weekly_progress': activity_series if granularity == 'week' else [],
             'calculated_at': datetime.now().isoformat()
         })
         
@@ -1304,6 +4700,126 @@ def get_user_progress():
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
 # ---- СИСТЕМНЫЕ КОМАНДЫ ----
+REQUIRED_TABLES = ('users', 'labs', 'user_progress', 'ctf_challenges', 'ctf_solves',
+                   'user_scores', 'user_daily_activity', 'platform_counters', 'catalog_version',
+                   'user_sessions')
+
+_schema_status = {'database': None, 'tables': None}
+_ready_cache = {'database': None, 'checked_at': 0.0, 'result': None}
+
+def check_schema(cursor):
+    """Наличие таблиц по sqlite_master (успешная проверка кэшируется для текущей БД)"""
+    if _schema_status['database'] == app.config['DATABASE']:
+        return _schema_status['tables']
+    
+    cursor.execute(f'''
+        SELECT name FROM sqlite_master 
+        WHERE type = 'table' AND name IN ({', '.join('?' * len(REQUIRED_TABLES))})
+    ''', REQUIRED_TABLES)
+    present = {row['name'] for row in cursor.fetchall()}
+    tables = {table: table in present for table in REQUIRED_TABLES}
+    
+    # Неполную схему перепроверяем при следующей пробе (например, во время upgrade_db)
+    if all(tables.values()):
+        _schema_status['database'] = app.config['DATABASE']
+        _schema_status['tables'] = tables
+    return tables
+
+def readiness_checks():
+    """Проверки готовности: схема, доступность БД, пул соединений, очередь записи"""
+    checks = {}
+    
+    # Пул: при исчерпании не ждем соединение, а сразу сообщаем о неготовности
+    pool_stats = get_db_pool().stats()
+    pool_exhausted = pool_stats['idle'] == 0 and pool_stats['size'] >= pool_stats['max_size']
+    checks['pool'] = {
+        'ok': not pool_exhausted,
+        'in_use': pool_stats['in_use'],
+        'max_size': pool_stats['max_size'],
+        'timeouts': pool_stats['timeouts']
+    }
+    
+    if pool_exhausted:
+        checks['database'] = {'ok': False, 'error': 'Нет свободных соединений'}
+        checks['schema'] = {'ok': False}
+    else:
+        started = time.monotonic()
+        try:
+            cursor = get_db().cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            tables = check_schema(cursor)
+            elapsed_ms = (time.monotonic() - started) * 1000
+            checks['database'] = {
+                'ok': True,
+                'latency_ms': round(elapsed_ms, 3),
+                'budget_ms': app.config['READY_DB_BUDGET_MS'],
+                'over_budget': elapsed_ms > app.config['READY_DB_BUDGET_MS']
+            }
+            checks['schema'] = {
+                'ok': all(tables.values()),
+                'missing': [table for table, ok in tables.items() if not ok]
+            }
+        except Exception as e:
+            checks['database'] = {'ok': False, 'error': str(e)}
+            checks['schema'] = {'ok': False}
+    
+    if app.config['DB_WRITER_ENABLED']:
+        writer_stats = get_db_writer().stats()
+        queue_fill = writer_stats['queue_depth'] / max(writer_stats['queue_size'], 1)
+        # Ожидание последнего пакета: пиковое значение за все время не отражает текущую нагрузку
+        queue_wait_ms = writer_stats['queue_wait_last'] * 1000
+        checks['writer'] = {
+            'ok': writer_stats['running'] and queue_fill < app.config['READY_WRITER_MAX_QUEUE'],
+            'queue_depth': writer_stats['queue_depth'],
+            'queue_size': writer_stats['queue_size'],
+            'queue_wait_ms': round(queue_wait_ms, 3),
+            'budget_ms': app.config['READY_WRITER_BUDGET_MS'],
+            'over_budget': queue_wait_ms > app.config['READY_WRITER_BUDGET_MS']
+        }
+    
+    return checks
+
+@app.route('/api/system/live', methods=['GET'])
+def liveness_probe():
+    """Liveness: процесс отвечает (без обращения к БД)"""
+    return jsonify({
+        'status': 'alive',
+        'instance': INSTANCE_ID,
+        'uptime_seconds': round(time.monotonic() - STARTED_AT, 3)
+    })
+
+@app.route('/api/system/ready', methods=['GET'])
+def readiness_probe():
+    """Readiness: готовность принимать трафик (результат кэшируется на READY_CACHE_SECONDS)"""
+    try:
+        now = time.monotonic()
+        cached = _ready_cache['result']
+        if (cached is None or _ready_cache['database'] != app.config['DATABASE']
+                or now - _ready_cache['checked_at'] >= app.config['READY_CACHE_SECONDS']):
+            started = time.monotonic()
+            checks = readiness_checks()
+            ready = all(check['ok'] for check in checks.values())
+            over_budget = any(check.get('over_budget') for check in checks.values())
+            cached = {
+                'status': ('degraded' if over_budget else 'ready') if ready else 'not_ready',
+                'ready': ready,
+                'checks': checks,
+                'check_duration_ms': round((time.monotonic() - started) * 1000, 3),
+                'checked_at': datetime.now().isoformat(),
+                'instance': INSTANCE_ID
+            }
+            _ready_cache.update(database=app.config['DATABASE'], checked_at=now, result=cached)
+        
+        return jsonify(cached), 200 if cached['ready'] else 503
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'not_ready',
+            'ready': False,
+            'error': str(e)
+        }), 503
+
 @app.route('/api/system/health', methods=['GET'])
 def health_check():
     """Проверка здоровья системы"""
@@ -1315,16 +4831,8 @@ def health_check():
         cursor.execute('SELECT 1')
         db_ok = cursor.fetchone() is not None
         
-        # Проверяем наличие основных таблиц
-        tables = ['users', 'labs', 'user_progress', 'ctf_challenges', 'ctf_solves']
-        tables_status = {}
-        
-        for table in tables:
-            try:
-                cursor.execute(f'SELECT COUNT(*) FROM {table}')
-                tables_status[table] = True
-            except:
-                tables_status[table] = False
+        # Проверяем наличие основных таблиц (по sqlite_master, без COUNT(*))
+        tables_status = check_schema(cursor)
         
         return jsonify({
             'status': 'healthy' if db_ok and all(tables_status.values()) else 'degraded',
@@ -1341,57 +4849,256 @@ def health_check():
             'timestamp': datetime.now().isoformat()
         }), 500
 
-@app.route('/api/system/stats', methods=['GET'])
+@app.route('/api/system/metrics', methods=['GET'])
+def metrics():
+    """Метрики для Prometheus (администратор или METRICS_TOKEN; без токена - только при METRICS_PUBLIC)"""
+    if not app.config['METRICS_PUBLIC']:
+        token = get_bearer_token()
+        scrape_token = app.config['METRICS_TOKEN']
+        if not (scrape_token and token and hmac.compare_digest(token, scrape_token)):
+            current_user, error = authenticate_token(token)
+            if error:
+                return error
+            if current_user['role'] != 'admin':
+                return jsonify({'error': 'Требуются права администратора'}), 403
+    
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/system/slow-queries', methods=['GET'])
+@token_required
 @admin_required
-def system_stats():
-    """Системная статистика (только для администраторов)"""
+def slow_queries():
+    """Журнал медленных SQL-запросов (только для администраторов)"""
     try:
-        import psutil
-        import platform
+        if request.args.get('clear') == '1':
+            sql_tracer.clear()
         
-        # Системная информация
-        system_info = {
-            'platform': platform.system(),
-            'platform_release': platform.release(),
-            'platform_version': platform.version(),
-            'python_version': platform.python_version(),
-            'processor': platform.processor()
-        }
+        report = sql_tracer.report(limit=min(request.args.get('limit', 50, type=int), 200))
+        report['timestamp'] = datetime.now().isoformat()
+        return jsonify(report)
         
-        # Использование ресурсов
-        cpu_usage = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/system/profiles', methods=['GET'])
+@token_required
+@admin_required
+def list_profiles():
+    """Сохраненные профили запросов и накопленные стеки (только для администраторов)"""
+    try:
+        directory = app.config['PROFILE_DIR']
+        files = []
+        if os.path.isdir(directory):
+            for name in sorted(os.listdir(directory), reverse=True):
+                stat = os.stat(os.path.join(directory, name))
+                files.append({
+                    'name': name,
+                    'size': stat.st_size,
+                    'created_at': datetime.fromtimestamp(stat.st_mtime).isoformat()
+                })
+        
+        return jsonify({
+            'directory': directory,
+            'files': files,
+            'sample_rate': app.config['PROFILE_SAMPLE_RATE'],
+            'routes': route_stacks.summary(),
+            'timestamp': datetime.now().isoformat()
+        })
         
-        resource_usage = {
-            'cpu_percent': cpu_usage,
-            'memory_total': memory.total,
-            'memory_available': memory.available,
-            'memory_percent': memory.percent,
-            'disk_total': disk.total,
-            'disk_used': disk.used,
-            'disk_percent': disk.percent
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/system/profiles/<filename>', methods=['GET'])
+@token_required
+@admin_required
+def download_profile(filename):
+    """Скачивание файла профиля (только для администраторов)"""
+    path = os.path.join(app.config['PROFILE_DIR'], secure_filename(filename))
+    if not os.path.isfile(path):
+        return jsonify({'error': 'Профиль не найден'}), 404
+    return send_file(os.path.abspath(path), as_attachment=True)
+
+@app.route('/api/system/flamegraph', methods=['GET'])
+@token_required
+@admin_required
+def route_flamegraph():
+    """Накопленные стеки маршрута в формате collapsed (?route=<эндпоинт>)"""
+    route = request.args.get('route')
+    if not route:
+        return jsonify({'error': 'Требуется параметр route'}), 400
+    if request.args.get('clear') == '1':
+        route_stacks.clear()
+        return jsonify({'message': 'Стеки очищены'})
+    return Response(route_stacks.collapsed(route), mimetype='text/plain; charset=utf-8')
+
+@app.route('/api/system/stats', methods=['GET'])
+@token_required
+@admin_required
+def system_stats():
+    """Системная статистика (только для администраторов)"""
+    try:
+        sample = system_sampler.latest()
+        
+        # Без фонового сборщика снимок снимается при запросе
+        if sample is None or (not system_sampler_task.running and
+                              time.time() - sample['collected_at'] > app.config['SYSTEM_SAMPLE_SECONDS']):
+            sample = system_sampler.sample()
+        
+        result = {
+            'system': system_sampler.system_info,
+            'resources': sample['resources'],
+            'top_processes': sample['top_processes'],
+            'sampled_at': sample['timestamp'],
+            'timestamp': datetime.now().isoformat()
         }
         
-        # Статистика процессов
-        processes = []
-        for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
-            try:
-                processes.append(proc.info)
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                pass
+        # История для графиков: ?window=<секунды>
+        window = request.args.get('window', type=int)
+        if window:
+            result['history'] = system_sampler.history(window)
         
-        processes = sorted(processes, key=lambda x: x.get('cpu_percent', 0), reverse=True)[:10]
+        return jsonify(result)
         
+    except ImportError:
+        return jsonify({'error': 'psutil не установлен'}), 500
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/system/db-pool', methods=['GET'])
+@token_required
+@admin_required
+def db_pool_stats():
+    """Статистика пула соединений с БД (только для администраторов)"""
+    try:
+        stats = get_db_pool().stats()
+        stats['writer'] = get_db_writer().stats() if app.config['DB_WRITER_ENABLED'] else None
+        stats['activity_log'] = activity_logger.stats()
+        stats['timestamp'] = datetime.now().isoformat()
+        return jsonify(stats)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/system/auth-stats', methods=['GET'])
+@token_required
+@admin_required
+def auth_stats():
+    """Статистика подсистемы аутентификации (только для администраторов)"""
+    try:
         return jsonify({
-            'system': system_info,
-            'resources': resource_usage,
-            'top_processes': processes,
+            'password_hasher': password_hasher.stats(),
+            'jwt_cache': jwt_cache.stats(),
+            'revoked_tokens': revoked_tokens.stats(),
             'timestamp': datetime.now().isoformat()
         })
-        
-    except ImportError:
-        return jsonify({'error': 'psutil не установлен'}), 500
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/system/rate-limits', methods=['GET'])
+@token_required
+@admin_required
+def rate_limit_stats():
+    """Состояние ограничителя частоты запросов (только для администраторов)"""
+    try:
+        return jsonify({
+            'rate_limiter': rate_limiter.stats(),
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/system/caches', methods=['GET'])
+@token_required
+@admin_required
+def cache_stats():
+    """Статистика внутренних кэшей (только для администраторов)"""
+    try:
+        return jsonify({
+            'principals': principal_cache.stats(),
+            'catalog': catalog_cache.stats(),
+            'platform_counters': {
+                'digest': platform_counters.digest,
+                'values': platform_counters.values
+            },
+            'attempt_buffer': attempt_buffer.stats(),
+            'background_tasks': {name: task.stats() for name, task in background_tasks.items()},
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# ---- ПОТОК СОБЫТИЙ ----
+@app.route('/api/stream/ticket', methods=['POST'])
+@token_required
+def create_stream_ticket():
+    """Одноразовый билет для подключения к потоку событий из браузера"""
+    try:
+        return jsonify({
+            'ticket': generate_stream_ticket(g.current_user['id']),
+            'expires_in': app.config['SSE_TICKET_TTL_SECONDS']
+        })
+
+    except Exception as e:
+        return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
+
+@app.route('/api/stream', methods=['GET'])
+def event_stream():
+    """Поток событий: решения, изменения таблицы лидеров и личной статистики"""
+    # Клиенты с заголовками используют access токен, EventSource - одноразовый билет
+    bearer = get_bearer_token()
+    if bearer:
+        current_user, error = authenticate_token(bearer)
+    else:
+        current_user, error = authenticate_stream_ticket(request.args.get('ticket'))
+    if error:
+        return error
+    
+    if event_bus.client_count() >= app.config['SSE_MAX_CLIENTS']:
+        response = jsonify({'error': 'Слишком много подключений к потоку событий'})
+        response.headers['Retry-After'] = str(app.config['SSE_RETRY_MS'] // 1000)
+        return response, 503
+    
+    last_event_id = parse_last_event_id(
+        request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    subscriber, reset = event_bus.subscribe(current_user['id'], last_event_id)
+    heartbeat = app.config['SSE_HEARTBEAT_SECONDS']
+    retry_ms = app.config['SSE_RETRY_MS']
+    
+    # Генератор выполняется вне контекста запроса: соединение с БД уже возвращено в пул
+    def generate():
+        try:
+            yield f'retry: {retry_ms}\n\n'
+            if reset:
+                yield 'event: reset\ndata: {}\n\n'
+            
+            while not subscriber.evicted:
+                try:
+                    item = subscriber.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': heartbeat\n\n'
+                    continue
+                yield format_sse(item)
+        finally:
+            event_bus.unsubscribe(subscriber)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/system/stream', methods=['GET'])
+@token_required
+@admin_required
+def stream_stats():
+    """Статистика потока событий (только для администраторов)"""
+    try:
+        stats = event_bus.stats()
+        stats['timestamp'] = datetime.now().isoformat()
+        return jsonify(stats)
+
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1410,18 +5117,13 @@ def submit_feedback():
         message = data['message']
         feedback_type = data.get('type', 'general')
         
-        db = get_db()
-        cursor = db.cursor()
-        
         feedback_id = str(uuid.uuid4())
         created_at = datetime.now().isoformat()
         
-        cursor.execute('''
+        run_write(lambda cursor: cursor.execute('''
             INSERT INTO feedback (id, user_id, type, message, created_at, status)
             VALUES (?, ?, ?, ?, ?, ?)
-        ''', (feedback_id, user_id, feedback_type, message, created_at, 'new'))
-        
-        db.commit()
+        ''', (feedback_id, user_id, feedback_type, message, created_at, 'new')))
         
         # Здесь можно добавить отправку email уведомления
         
@@ -1431,9 +5133,74 @@ def submit_feedback():
             'created_at': created_at
         })
         
+    except DatabaseBusy as e:
+        return database_busy_response(e)
     except Exception as e:
         return jsonify({'error': f'Ошибка сервера: {str(e)}'}), 500
 
+# ===== КОМАНДЫ ОБСЛУЖИВАНИЯ =====
+@app.cli.command('rebuild-scores')
+def rebuild_scores_command():
+    """Пересчет таблицы user_scores из истории решений"""
+    upgrade_db()
+    with app.app_context():
+        db = get_db()
+        count = rebuild_user_scores(db.cursor())
+        db.commit()
+    print(f"Пересчитаны очки пользователей: {count}")
+
+@app.cli.command('check-scores')
+def check_scores_command():
+    """Проверка согласованности таблицы user_scores"""
+    with app.app_context():
+        mismatches = check_user_scores(get_db().cursor())
+    
+    for row in mismatches:
+        print(json.dumps(row, ensure_ascii=False))
+    print(f"Расхождений: {len(mismatches)}")
+    if mismatches:
+        raise SystemExit(1)
+
+@app.cli.command('generate-dataset')
+@click.option('--database', help='Файл новой базы (по умолчанию DATABASE)')
+@click.option('--users', default=100000, show_default=True)
+@click.option('--labs', default=200, show_default=True)
+@click.option('--challenges', default=2000, show_default=True)
+@click.option('--solves-per-user', default=30.0, show_default=True, help='Среднее число CTF решений')
+@click.option('--labs-per-user', default=8.0, show_default=True, help='Среднее число начатых лабораторий')
+@click.option('--days', default=365, show_default=True, help='Период истории')
+@click.option('--end-date', type=click.DateTime(formats=['%Y-%m-%d']), help='Последний день истории')
+@click.option('--seed', default=42, show_default=True)
+@click.option('--batch-size', default=50000, show_default=True, help='Строк на executemany')
+@click.option('--password', help='Пароль всех пользователей (по умолчанию dataset.DATASET_PASSWORD)')
+def generate_dataset_command(database, users, labs, challenges, solves_per_user, labs_per_user, days,
+                             end_date, seed, batch_size, password):
+    """Генерация большого детерминированного набора данных в новую базу"""
+    # Генератор импортирует приложение, поэтому загружается только для этой команды
+    from dataset import DATASET_PASSWORD, DatasetGenerator
+    
+    generator = DatasetGenerator(
+        database or app.config['DATABASE'], users=users, labs=labs, challenges=challenges,
+        solves_per_user=solves_per_user, labs_per_user=labs_per_user, days=days, seed=seed,
+        batch_size=batch_size, password=password or DATASET_PASSWORD,
+        end_date=end_date.date() if end_date else None
+    )
+    try:
+        stats = generator.run()
+    except FileExistsError as e:
+        raise click.ClickException(str(e))
+    print(json.dumps(stats, ensure_ascii=False))
+
+@app.cli.command('rebuild-activity')
+def rebuild_activity_command():
+    """Пересчет таблицы user_daily_activity из истории решений"""
+    upgrade_db()
+    with app.app_context():
+        db = get_db()
+        count = rebuild_daily_activity(db.cursor())
+        db.commit()
+    print(f"Пересчитаны дни активности: {count}")
+
 # ===== ЗАПУСК СЕРВЕРА =====
 if __name__ == '__main__':
     # Проверяем и инициализируем БД если нужно
@@ -1441,6 +5208,16 @@ if __name__ == '__main__':
         print("База данных не найдена. Инициализация...")
         init_db()
         print("База данных создана с тестовыми данными.")
+    else:
+        upgrade_db()
+    
+    # Родительский процесс перезагрузчика запросы не обслуживает: службы и файлы журналов
+    # открывает только дочерний (WERKZEUG_RUN_MAIN)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # Загружаем таблицу лидеров до приема запросов
+        with app.app_context():
+            get_leaderboard()
+            start_services()
     
     print("Запуск сервера CyberSib API...")
     print(f"API доступен по адресу: http://localhost:5000")
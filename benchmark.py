@@ -0,0 +1,414 @@
+"""
+Нагрузочный тест и замер задержек горячих путей CyberSib API
+
+Запускает приложение на случайном порту против отдельной сгенерированной базы,
+прогоняет взвешенные сценарии трафика и сохраняет пропускную способность,
+p50/p95/p99 по эндпоинтам и число SQL-запросов на запрос в JSON.
+
+Примеры:
+    python benchmark.py --output bench.json
+    python benchmark.py --scenarios catalog_browsing,leaderboard_polling --duration 20
+    python benchmark.py --output bench.json --baseline bench_baseline.json
+    flask generate-dataset --database big.db --users 1000000
+    python benchmark.py --database big.db --output bench_big.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# ===== ДАННЫЕ =====
+def prepare_dataset(dataset, args, database):
+    """Набор данных flask generate-dataset: генерируется заново или берется готовый файл"""
+    if os.path.exists(database):
+        print(f'Используется существующая база {database}')
+    else:
+        print(f'Генерация данных: {args.users} пользователей, {args.challenges} задач ({database})')
+        stats = dataset.DatasetGenerator(
+            database, users=args.users, labs=args.labs, challenges=args.challenges,
+            solves_per_user=args.solves_per_user, seed=args.seed, password=args.password
+        ).run()
+        print(f"Загружено за {stats['total_seconds']} с: {stats['rows']}")
+
+    conn = sqlite3.connect(database)
+    try:
+        labs = [row[0] for row in conn.execute('SELECT id FROM labs WHERE is_active = 1')]
+        challenges = [row[0] for row in conn.execute('SELECT id FROM ctf_challenges WHERE is_active = 1')]
+        usernames = [row[0] for row in conn.execute(
+            "SELECT username FROM users WHERE is_active = 1 AND role = 'student' ORDER BY username LIMIT ?",
+            (args.concurrency,))]
+    finally:
+        conn.close()
+
+    return {
+        'labs': labs,
+        'challenges': challenges,
+        'flags': {item_id: dataset.dataset_flag(item_id) for item_id in challenges},
+        'usernames': usernames,
+        'password': args.password
+    }
+
+
+# ===== СЦЕНАРИИ =====
+def login_storm(client, state, rng):
+    return client.request('POST /api/auth/login', 'POST', '/api/auth/login',
+                          {'username': state['username'], 'password': state['data']['password']})
+
+
+def leaderboard_polling(client, state, rng):
+    roll = rng.random()
+    if roll < 0.6:
+        return client.request('GET /api/ctf/leaderboard', 'GET', '/api/ctf/leaderboard?limit=50')
+    if roll < 0.9:
+        return client.request('GET /api/ctf/leaderboard/me', 'GET', '/api/ctf/leaderboard/me', auth=True)
+    # Повторный опрос с ETag, как у браузера
+    return client.request('GET /api/ctf/leaderboard (If-None-Match)', 'GET', '/api/ctf/leaderboard?limit=50',
+                          conditional=True)
+
+
+def catalog_browsing(client, state, rng):
+    data = state['data']
+    roll = rng.random()
+    if roll < 0.4:
+        return client.request('GET /api/labs', 'GET', '/api/labs', auth=True)
+    if roll < 0.7:
+        return client.request('GET /api/labs/<lab_id>', 'GET', f"/api/labs/{rng.choice(data['labs'])}", auth=True)
+    if roll < 0.9:
+        return client.request('GET /api/ctf/challenges', 'GET', '/api/ctf/challenges', auth=True)
+    return client.request('GET /api/ctf/challenges/<challenge_id>', 'GET',
+                          f"/api/ctf/challenges/{rng.choice(data['challenges'])}", auth=True)
+
+
+def flag_submission_burst(client, state, rng):
+    data = state['data']
+    roll = rng.random()
+    if roll < 0.5:
+        lab_id = rng.choice(data['labs'])
+        return client.request('POST /api/labs/<lab_id>/submit', 'POST', f'/api/labs/{lab_id}/submit',
+                              {'flag': 'CYBERSIB{wrong}'}, auth=True)
+    challenge_id = rng.choice(data['challenges'])
+    flag = data['flags'][challenge_id] if roll > 0.9 else 'CYBERSIB{wrong}'
+    return client.request('POST /api/ctf/challenges/<challenge_id>/submit', 'POST',
+                          f'/api/ctf/challenges/{challenge_id}/submit', {'flag': flag}, auth=True)
+
+
+def dashboard_polling(client, state, rng):
+    roll = rng.random()
+    if roll < 0.35:
+        return client.request('GET /api/users/me', 'GET', '/api/users/me', auth=True)
+    if roll < 0.6:
+        return client.request('GET /api/stats/user-progress', 'GET', '/api/stats/user-progress', auth=True)
+    if roll < 0.8:
+        return client.request('GET /api/stats/overview', 'GET', '/api/stats/overview', auth=True)
+    return client.request('GET /api/ctf/stats', 'GET', '/api/ctf/stats', auth=True)
+
+
+SCENARIOS = {
+    'login_storm': login_storm,
+    'leaderboard_polling': leaderboard_polling,
+    'catalog_browsing': catalog_browsing,
+    'flag_submission_burst': flag_submission_burst,
+    'dashboard_polling': dashboard_polling,
+}
+
+
+# ===== КЛИЕНТ =====
+class BenchClient:
+    """HTTP-клиент одного потока нагрузки с записью задержек по меткам"""
+
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        self.token = None
+        self.etags = {}
+        self.samples = {}   # метка -> [задержки в секундах]
+        self.statuses = {}  # метка -> {код: число}
+        self.errors = 0
+
+    def request(self, label, method, path, body=None, auth=False, conditional=False):
+        headers = {'Content-Type': 'application/json'}
+        if auth:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if conditional and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        payload = json.dumps(body) if body is not None else None
+
+        started = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.errors += 1
+            status, data, response = 0, b'', None
+        elapsed = time.perf_counter() - started
+
+        self.samples.setdefault(label, []).append(elapsed)
+        statuses = self.statuses.setdefault(label, {})
+        statuses[status] = statuses.get(status, 0) + 1
+        if response is not None and response.getheader('ETag'):
+            self.etags[path] = response.getheader('ETag')
+        return status, data
+
+    def login(self, username, password):
+        self.conn.request('POST', '/api/auth/login',
+                          body=json.dumps({'username': username, 'password': password}),
+                          headers={'Content-Type': 'application/json'})
+        response = self.conn.getresponse()
+        data = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f'Не удалось войти как {username}: {data}')
+        self.token = data['access_token']
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль методом ближайшего ранга"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def scrape_sql_per_endpoint(port):
+    """Суммы и количества из cybersib_sql_statements_per_request (/api/system/metrics)"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('GET', '/api/system/metrics')
+    text = conn.getresponse().read().decode()
+    conn.close()
+    totals = {}
+    for kind, endpoint, value in re.findall(
+            r'^cybersib_sql_statements_per_request_(sum|count)\{endpoint="([^"]+)"\} (\S+)$', text, re.M):
+        totals.setdefault(endpoint, {})[kind] = float(value)
+    return totals
+
+
+def run_scenario(name, port, data, concurrency, duration, seed):
+    """Прогон одного сценария: concurrency потоков в течение duration секунд"""
+    scenario = SCENARIOS[name]
+    clients = []
+    for worker in range(concurrency):
+        client = BenchClient(port)
+        client.login(data['usernames'][worker % len(data['usernames'])], data['password'])
+        clients.append(client)
+
+    sql_before = scrape_sql_per_endpoint(port)
+    deadline = time.perf_counter() + duration
+
+    def worker_loop(worker, client):
+        rng = random.Random(seed * 1000 + worker)
+        state = {'username': data['usernames'][worker % len(data['usernames'])], 'data': data}
+        while time.perf_counter() < deadline:
+            scenario(client, state, rng)
+
+    threads = [threading.Thread(target=worker_loop, args=(worker, client))
+               for worker, client in enumerate(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    sql_after = scrape_sql_per_endpoint(port)
+
+    # Сводка по меткам всех потоков
+    samples, statuses, errors = {}, {}, 0
+    for client in clients:
+        errors += client.errors
+        for label, values in client.samples.items():
+            samples.setdefault(label, []).extend(values)
+        for label, codes in client.statuses.items():
+            merged = statuses.setdefault(label, {})
+            for status, count in codes.items():
+                merged[status] = merged.get(status, 0) + count
+
+    endpoints = {}
+    total_requests = 0
+    for label, values in sorted(samples.items()):
+        values.sort()
+        total_requests += len(values)
+        endpoints[label] = {
+            'requests': len(values),
+            'throughput_rps': round(len(values) / elapsed, 2),
+            'mean_ms': round(sum(values) / len(values) * 1000, 3),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+            'max_ms': round(values[-1] * 1000, 3),
+            'statuses': {str(status): count for status, count in sorted(statuses[label].items())}
+        }
+
+    sql_per_request = {}
+    for endpoint, after in sorted(sql_after.items()):
+        before = sql_before.get(endpoint, {})
+        count = after.get('count', 0) - before.get('count', 0)
+        if endpoint != 'metrics' and count > 0:
+            sql_per_request[endpoint] = round((after.get('sum', 0) - before.get('sum', 0)) / count, 3)
+
+    return {
+        'duration_s': round(elapsed, 3),
+        'concurrency': concurrency,
+        'requests': total_requests,
+        'throughput_rps': round(total_requests / elapsed, 2),
+        'errors': errors,
+        'endpoints': endpoints,
+        'sql_per_request': sql_per_request
+    }
+
+
+# ===== СРАВНЕНИЕ С БАЗОВОЙ ЛИНИЕЙ =====
+def compare_with_baseline(results, baseline, tolerance, sql_tolerance):
+    """Список регрессий относительно сохраненного прогона"""
+    regressions = []
+    for name, scenario in results['scenarios'].items():
+        base_scenario = baseline.get('scenarios', {}).get(name)
+        if not base_scenario:
+            continue
+
+        if scenario['throughput_rps'] < base_scenario['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: пропускная способность {scenario['throughput_rps']} rps "
+                               f"< {base_scenario['throughput_rps']} rps")
+
+        for label, stats in scenario['endpoints'].items():
+            base_stats = base_scenario['endpoints'].get(label)
+            if not base_stats:
+                continue
+            for metric in ('p95_ms', 'p99_ms'):
+                if stats[metric] > base_stats[metric] * (1 + tolerance):
+                    regressions.append(f"{name} / {label}: {metric} {stats[metric]} > {base_stats[metric]}")
+
+        # Потолок числа SQL-запросов на HTTP-запрос
+        for endpoint, queries in scenario['sql_per_request'].items():
+            base_queries = base_scenario.get('sql_per_request', {}).get(endpoint)
+            if base_queries is not None and queries > base_queries + sql_tolerance:
+                regressions.append(f"{name} / {endpoint}: SQL-запросов на запрос {queries} > {base_queries}")
+    return regressions
+
+
+def print_report(results):
+    for name, scenario in results['scenarios'].items():
+        print(f"\n== {name}: {scenario['requests']} запросов, {scenario['throughput_rps']} rps, "
+              f"ошибок {scenario['errors']}")
+        print(f"{'эндпоинт':<52}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}  коды")
+        for label, stats in scenario['endpoints'].items():
+            codes = ', '.join(f'{status}:{count}' for status, count in stats['statuses'].items())
+            print(f"{label:<52}{stats['throughput_rps']:>9}{stats['p50_ms']:>9}"
+                  f"{stats['p95_ms']:>9}{stats['p99_ms']:>9}  {codes}")
+        if scenario['sql_per_request']:
+            print('SQL на запрос: ' + ', '.join(f'{endpoint}={queries}'
+                                                for endpoint, queries in scenario['sql_per_request'].items()))
+
+
+# ===== ЗАПУСК =====
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк горячих путей CyberSib API')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='сценарии через запятую: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--duration', type=float, default=10, help='секунд на сценарий')
+    parser.add_argument('--concurrency', type=int, default=8, help='потоков нагрузки')
+    parser.add_argument('--users', type=int, default=5000, help='пользователей в базе бенчмарка')
+    parser.add_argument('--labs', type=int, default=100)
+    parser.add_argument('--challenges', type=int, default=300)
+    parser.add_argument('--solves-per-user', type=float, default=20)
+    parser.add_argument('--password', help='пароль пользователей набора данных')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database', help='готовая база flask generate-dataset или путь для новой '
+                                           '(по умолчанию - временный файл)')
+    parser.add_argument('--output', help='файл для результатов в JSON')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='допустимое ухудшение p95/p99 и rps (доля)')
+    parser.add_argument('--sql-tolerance', type=float, default=0.5,
+                        help='допустимый рост числа SQL-запросов на запрос')
+    parser.add_argument('--rate-limits', action='store_true',
+                        help='не отключать ограничение частоты отправки флагов')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'неизвестные сценарии: {", ".join(unknown)}')
+
+    workdir = tempfile.mkdtemp(prefix='cybersib-bench-')
+    database = args.database or os.path.join(workdir, 'bench.db')
+
+    import app as appmod
+    import dataset
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    app = appmod.app
+    app.config['RATE_LIMIT_ENABLED'] = args.rate_limits
+    # Сервер слушает только 127.0.0.1: метрики для подсчета SQL снимаются без токена
+    app.config['METRICS_PUBLIC'] = True
+    app.config['PROFILE_DIR'] = os.path.join(workdir, 'profiles')
+    app.config['LOG_DIR'] = os.path.join(workdir, 'logs')
+
+    args.password = args.password or dataset.DATASET_PASSWORD
+    app.config['DATABASE'] = database
+    data = prepare_dataset(dataset, args, database)
+    appmod.configure_logging()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    print(f'Сервер бенчмарка: http://127.0.0.1:{server.server_port}')
+
+    results = {
+        'meta': {
+            'started_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'database': database,
+            'users': args.users,
+            'challenges': args.challenges,
+            'seed': args.seed,
+            'duration_s': args.duration,
+            'concurrency': args.concurrency,
+            'rate_limits': args.rate_limits
+        },
+        'scenarios': {}
+    }
+    try:
+        for name in names:
+            print(f'Сценарий {name}...')
+            results['scenarios'][name] = run_scenario(
+                name, server.server_port, data, args.concurrency, args.duration, args.seed)
+    finally:
+        server.shutdown()
+
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f'\nРезультаты сохранены в {args.output}')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance, args.sql_tolerance)
+        if regressions:
+            print('\nРегрессии относительно базовой линии:')
+            for line in regressions:
+                print(f'  - {line}')
+            sys.exit(1)
+        print('\nРегрессий относительно базовой линии нет')
+
+
+if __name__ == '__main__':
+    main()
@@ -35,8 +35,8 @@ function initDashboard() {
     loadDashboardData();
     initBackgroundAnimation();
     
-    // Обновление данных каждые 30 секунд
-    setInterval(updateDashboardStats, 30000);
+    // Обновления в реальном времени (или опрос каждые 30 секунд)
+    initLiveUpdates(user);
     
     console.log('Личный кабинет инициализирован');
 }
@@ -887,6 +887,73 @@ function terminateOtherSessions() {
     showNotification('Другие сессии завершены', 'success');
 }
 
+function initLiveUpdates(user) {
+    // Поток событий доступен только с токеном API
+    if (!window.EventSource || !user.access_token || typeof API_BASE_URL === 'undefined') {
+        setInterval(updateDashboardStats, 30000);
+        return;
+    }
+    
+    let lastEventId = null;
+    
+    // Токен не передается в URL: для каждого подключения берется одноразовый билет.
+    // Билет нельзя использовать повторно, поэтому переподключаемся сами с новым билетом
+    function connect() {
+        fetch(`${API_BASE_URL}/stream/ticket`, {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${user.access_token}` }
+        })
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.json();
+        })
+        .then(data => {
+            let url = `${API_BASE_URL}/stream?ticket=${encodeURIComponent(data.ticket)}`;
+            if (lastEventId) {
+                url += `&last_event_id=${encodeURIComponent(lastEventId)}`;
+            }
+            
+            const stream = new EventSource(url);
+            
+            stream.addEventListener('stats', function(e) {
+                lastEventId = e.lastEventId || lastEventId;
+                mergeLiveStats(JSON.parse(e.data));
+                updateDashboardStats();
+            });
+            
+            stream.addEventListener('leaderboard', function(e) {
+                lastEventId = e.lastEventId || lastEventId;
+                updateDashboardStats();
+            });
+            
+            stream.addEventListener('reset', loadDashboardData);
+            
+            stream.onerror = function() {
+                stream.close();
+                setTimeout(connect, 3000);
+            };
+        })
+        .catch(() => setTimeout(connect, 30000));
+    }
+    
+    connect();
+}
+
+function mergeLiveStats(update) {
+    // Событие содержит только очки и ранг: остальные поля карточек сохраняем
+    const stats = Object.assign({}, dashboardData.stats || {});
+    
+    if (update.total_points !== undefined) stats.points = update.total_points;
+    ['completed_labs', 'lab_points', 'ctf_points', 'rank'].forEach(key => {
+        if (update[key] !== undefined) stats[key] = update[key];
+    });
+    
+    dashboardData.stats = stats;
+    if (stats.weekly_change) {
+        updateStatsUI(stats);
+    }
+}
+
 function updateDashboardStats() {
     // Обновление статистики в реальном времени
     console.log('Обновление статистики...');
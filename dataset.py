@@ -0,0 +1,314 @@
+"""
+Генератор большого детерминированного набора данных CyberSib
+
+Создает новую базу по schema.sql и заполняет ее пакетной загрузкой: пользователи
+по учебным группам, каталог лабораторий и CTF задач, решения и прогресс с
+реалистичным распределением во времени. Используется командой
+flask generate-dataset и нагрузочным тестом benchmark.py.
+"""
+
+import bisect
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime
+
+from app import (app, password_hasher, rebuild_daily_activity, rebuild_platform_counters,
+                 rebuild_user_scores)
+
+# ===== ПАРАМЕТРЫ =====
+DATASET_PASSWORD = 'dataset2025'
+DATASET_FACULTIES = (('ИБ', 6), ('КБ', 4), ('ПИ', 3), ('ИВТ', 3), ('БИ', 2), ('САУ', 1))
+DATASET_GROUP_SIZE = 25
+DATASET_SUBSCRIPTIONS = (('free', 80), ('pro', 15), ('premium', 5))
+DATASET_LAB_CATEGORIES = ('linux', 'networking', 'web', 'pwn', 'forensics', 'crypto', 'reverse', 'osint')
+DATASET_CTF_CATEGORIES = ('web', 'crypto', 'forensics', 'pwn', 'reverse', 'osint', 'misc')
+# Сложность -> (доля в каталоге, базовые очки, относительная популярность)
+DATASET_LAB_DIFFICULTY = {
+    'beginner': (40, 10, 8.0), 'intermediate': (35, 25, 4.0),
+    'advanced': (20, 50, 1.5), 'ctf': (5, 80, 1.0)
+}
+DATASET_CTF_DIFFICULTY = {
+    'easy': (35, 50, 10.0), 'medium': (35, 100, 4.0),
+    'hard': (20, 200, 1.5), 'insane': (10, 400, 0.5)
+}
+# Вес часа суток для времени решений: пары днем и вечерний пик
+DATASET_HOUR_WEIGHTS = (2, 1, 1, 1, 1, 1, 2, 3, 5, 7, 8, 8, 7, 8, 9, 9, 9, 9, 10, 12, 13, 12, 8, 4)
+
+# ===== ГЕНЕРАТОР =====
+def dataset_id(namespace, index):
+    """Детерминированный UUID: возрастает с index, поэтому вставка идет в конец индекса"""
+    value = f'{namespace:08x}{index:024x}'
+    return f'{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}'
+
+def dataset_flag(item_id):
+    """Флаг сгенерированной лаборатории или CTF задачи"""
+    return f'CSIB{{{item_id[:8]}{item_id[-8:]}}}'
+
+def dataset_username(index):
+    """Имя сгенерированного пользователя"""
+    return f'user{index:07d}'
+
+class DatasetGenerator:
+    """Детерминированная генерация большого набора данных с пакетной загрузкой в новую базу"""
+
+    def __init__(self, database, users=100000, labs=200, challenges=2000, solves_per_user=30,
+                 labs_per_user=8, days=365, seed=42, batch_size=50000, password=DATASET_PASSWORD,
+                 end_date=None, log=print):
+        self.database = database
+        self.users = users
+        self.labs = labs
+        self.challenges = challenges
+        self.solves_per_user = solves_per_user
+        self.labs_per_user = labs_per_user
+        self.days = days
+        self.seed = seed
+        self.batch_size = batch_size
+        self.password = password
+        self.log = log
+        self.rng = random.Random(seed)
+        # Одинаковые seed и end_date дают одинаковые данные
+        end_date = end_date or datetime.now().date()
+        self.now = datetime(end_date.year, end_date.month, end_date.day).timestamp()
+        self.start = self.now - days * 86400
+        self.counts = {}
+
+    def namespace(self, table):
+        return random.Random(f'{self.seed}:{table}').getrandbits(32)
+
+    def timestamp(self, ts):
+        return datetime.fromtimestamp(ts).isoformat(timespec='seconds')
+
+    def run(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.database + suffix):
+                raise FileExistsError(f'База {self.database} уже существует')
+
+        started = time.perf_counter()
+        conn = sqlite3.connect(self.database, isolation_level=None)
+        try:
+            with app.open_resource('schema.sql', mode='r') as f:
+                schema = f.read()
+            conn.executescript(schema)
+            self.defer_schema_objects(conn)
+
+            # Новый файл: журнал и fsync не нужны, при сбое базу проще сгенерировать заново
+            conn.execute('PRAGMA journal_mode=OFF')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('PRAGMA locking_mode=EXCLUSIVE')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-262144')
+            conn.execute('PRAGMA foreign_keys=OFF')
+
+            conn.execute('BEGIN')
+            labs = self.load_labs(conn)
+            challenges = self.load_challenges(conn)
+            self.load_users(conn, labs, challenges)
+            conn.execute('COMMIT')
+            load_time = time.perf_counter() - started
+
+            self.log('Построение индексов и триггеров...')
+            conn.executescript(schema)
+            self.log('Пересчет агрегатов...')
+            conn.execute('BEGIN')
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE ctf_challenges SET solves_count = (
+                    SELECT COUNT(*) FROM ctf_solves WHERE challenge_id = ctf_challenges.id
+                )
+            ''')
+            cursor.execute('UPDATE catalog_version SET version = version + 1 WHERE id = 1')
+            rebuild_user_scores(cursor)
+            rebuild_daily_activity(cursor)
+            rebuild_platform_counters(cursor)
+            conn.execute('COMMIT')
+            conn.execute('ANALYZE')
+
+            conn.execute('PRAGMA locking_mode=NORMAL')
+            conn.execute(f"PRAGMA journal_mode={app.config['DB_JOURNAL_MODE']}")
+        finally:
+            conn.close()
+
+        return {
+            'database': self.database,
+            'seed': self.seed,
+            'rows': self.counts,
+            'load_seconds': round(load_time, 2),
+            'total_seconds': round(time.perf_counter() - started, 2)
+        }
+
+    def defer_schema_objects(self, conn):
+        """Индексы и триггеры удаляются до загрузки и создаются заново из schema.sql после нее"""
+        objects = conn.execute('''
+            SELECT type, name FROM sqlite_master
+            WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+        ''').fetchall()
+        for kind, name in objects:
+            conn.execute(f'DROP {kind.upper()} {name}')
+
+    def insert(self, conn, table, columns, rows):
+        placeholders = ', '.join('?' * len(columns))
+        conn.executemany(f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders})', rows)
+        self.counts[table] = self.counts.get(table, 0) + len(rows)
+
+    def weighted_sample(self, weights, cum_weights, k):
+        """k различных индексов с вероятностью, пропорциональной весу"""
+        n = len(weights)
+        if k * 3 >= n:
+            # Большая выборка: повторные попадания в популярные элементы сделали бы
+            # отбор долгим, поэтому ключи Эфраимидиса-Спиракиса log(u)/w и k наибольших
+            keys = [-self.rng.expovariate(1.0) / weight for weight in weights]
+            return sorted(heapq.nlargest(k, range(n), key=keys.__getitem__))
+        total = cum_weights[-1]
+        chosen = set()
+        while len(chosen) < k:
+            chosen.add(bisect.bisect(cum_weights, self.rng.random() * total))
+        return sorted(chosen)
+
+    def activity_count(self, mean, limit):
+        """Число решений пользователя: распределение с тяжелым хвостом и заданным средним"""
+        factor = (self.rng.paretovariate(1.6) - 1) * 0.6
+        return min(limit, int(mean * factor + self.rng.random()))
+
+    def event_time(self, not_before):
+        """Время события после not_before с суточным профилем активности"""
+        ts = not_before + (self.now - not_before) * self.rng.random() ** 0.7
+        day = ts - (ts - self.now) % 86400
+        hour = bisect.bisect(self.hour_cum, self.rng.random() * self.hour_cum[-1])
+        ts = day + hour * 3600 + int(self.rng.random() * 3600)
+        return min(max(ts, not_before), self.now)
+
+    def catalog_item(self, difficulties):
+        names = list(difficulties)
+        difficulty = self.rng.choices(names, weights=[difficulties[name][0] for name in names])[0]
+        _, base_points, popularity = difficulties[difficulty]
+        points = int(base_points * self.rng.uniform(0.8, 1.5))
+        return difficulty, points, popularity * self.rng.lognormvariate(0, 0.5)
+
+    def load_labs(self, conn):
+        namespace = self.namespace('labs')
+        labs, rows = [], []
+        for index in range(self.labs):
+            lab_id = dataset_id(namespace, index)
+            difficulty, points, popularity = self.catalog_item(DATASET_LAB_DIFFICULTY)
+            category = self.rng.choice(DATASET_LAB_CATEGORIES)
+            time_estimate = 0 if difficulty == 'ctf' else self.rng.choice((30, 45, 60, 90, 120, 150, 180))
+            is_active = self.rng.random() < 0.9
+            created_at = self.start + self.days * 86400 * 0.8 * self.rng.random()
+            rows.append((lab_id, f'Лаборатория {index + 1}: {category}', f'Сгенерированная лаборатория ({category})',
+                         difficulty, category, points, time_estimate,
+                         hashlib.md5(dataset_flag(lab_id).encode()).hexdigest(), is_active,
+                         self.timestamp(created_at), self.timestamp(created_at)))
+            if is_active:
+                labs.append((lab_id, points, time_estimate, created_at, popularity))
+        self.insert(conn, 'labs', ('id', 'title', 'description', 'difficulty', 'category', 'points',
+                                   'time_estimate_minutes', 'flag_hash', 'is_active', 'created_at', 'updated_at'), rows)
+        return labs
+
+    def load_challenges(self, conn):
+        namespace = self.namespace('ctf_challenges')
+        challenges, rows = [], []
+        for index in range(self.challenges):
+            challenge_id = dataset_id(namespace, index)
+            difficulty, points, popularity = self.catalog_item(DATASET_CTF_DIFFICULTY)
+            category = self.rng.choice(DATASET_CTF_CATEGORIES)
+            created_at = self.start + self.days * 86400 * 0.8 * self.rng.random()
+            rows.append((challenge_id, f'Задача {index + 1}: {category}', f'Сгенерированная задача ({category})',
+                         category, points, difficulty, hashlib.md5(dataset_flag(challenge_id).encode()).hexdigest(),
+                         self.timestamp(created_at)))
+            challenges.append((challenge_id, points, created_at, popularity))
+        self.insert(conn, 'ctf_challenges', ('id', 'title', 'description', 'category', 'points', 'difficulty',
+                                             'flag_hash', 'created_at'), rows)
+        return challenges
+
+    def groups(self):
+        """Учебные группы по факультетам и годам набора (около DATASET_GROUP_SIZE студентов)"""
+        total_weight = sum(weight for _, weight in DATASET_FACULTIES)
+        groups, weights = [], []
+        for faculty, weight in DATASET_FACULTIES:
+            students = self.users * weight / total_weight / 5
+            for year in range(21, 26):
+                for number in range(1, max(1, round(students / DATASET_GROUP_SIZE)) + 1):
+                    groups.append(f'{faculty}-{year}{number:02d}')
+                    weights.append(weight)
+        return groups, list(itertools.accumulate(weights))
+
+    def load_users(self, conn, labs, challenges):
+        self.hour_cum = list(itertools.accumulate(DATASET_HOUR_WEIGHTS))
+        groups, group_cum = self.groups()
+        subscriptions = [name for name, _ in DATASET_SUBSCRIPTIONS]
+        subscription_cum = list(itertools.accumulate(weight for _, weight in DATASET_SUBSCRIPTIONS))
+        challenge_weights = [item[3] for item in challenges]
+        challenge_cum = list(itertools.accumulate(challenge_weights))
+        lab_weights = [item[4] for item in labs]
+        lab_cum = list(itertools.accumulate(lab_weights))
+
+        # Хеш один на всех: scrypt для каждого из миллиона пользователей занял бы часы
+        password_hash = password_hasher.hash(self.password)
+        users_ns, solves_ns, progress_ns = (self.namespace(table)
+                                            for table in ('users', 'ctf_solves', 'user_progress'))
+        user_rows, solve_rows, progress_rows = [], [], []
+        solve_index = progress_index = 0
+
+        def flush():
+            self.insert(conn, 'users', ('id', 'username', 'email', 'password_hash', 'user_group',
+                                        'subscription_level', 'role', 'avatar_url', 'created_at',
+                                        'last_login', 'is_active'), user_rows)
+            self.insert(conn, 'ctf_solves', ('id', 'user_id', 'challenge_id', 'solved_at', 'flag_submitted'),
+                        solve_rows)
+            self.insert(conn, 'user_progress', ('id', 'user_id', 'lab_id', 'status', 'started_at',
+                                                'completed_at', 'attempts', 'score'), progress_rows)
+            user_rows.clear()
+            solve_rows.clear()
+            progress_rows.clear()
+
+        for index in range(self.users):
+            user_id = dataset_id(users_ns, index)
+            username = dataset_username(index)
+            # Набор растет со временем: новых пользователей больше, чем старых
+            created_at = self.start + self.days * 86400 * self.rng.random() ** 0.6
+            role = 'admin' if index == 0 else ('teacher' if self.rng.random() < 0.01 else 'student')
+            group = 'Преподаватели' if role != 'student' else \
+                groups[bisect.bisect(group_cum, self.rng.random() * group_cum[-1])]
+            subscription = subscriptions[bisect.bisect(subscription_cum, self.rng.random() * subscription_cum[-1])]
+            last_login = self.event_time(created_at)
+
+            solved = self.weighted_sample(challenge_weights, challenge_cum, self.activity_count(self.solves_per_user, len(challenges)))
+            for position in solved:
+                challenge_id, _, challenge_created, _ = challenges[position]
+                solve_rows.append((dataset_id(solves_ns, solve_index), user_id, challenge_id,
+                                   self.timestamp(self.event_time(max(created_at, challenge_created))),
+                                   dataset_flag(challenge_id)))
+                solve_index += 1
+
+            started = self.weighted_sample(lab_weights, lab_cum, self.activity_count(self.labs_per_user, len(labs)))
+            for position in started:
+                lab_id, points, time_estimate, lab_created, _ = labs[position]
+                started_at = self.event_time(max(created_at, lab_created))
+                roll = self.rng.random()
+                if roll < 0.65:
+                    duration = max(10, time_estimate) * 60 * self.rng.lognormvariate(0, 0.6)
+                    progress_rows.append((dataset_id(progress_ns, progress_index), user_id, lab_id, 'completed',
+                                          self.timestamp(started_at),
+                                          self.timestamp(min(self.now, started_at + duration)),
+                                          1 + int(self.rng.expovariate(0.7)), points))
+                else:
+                    status = 'in_progress' if roll < 0.95 else 'not_started'
+                    progress_rows.append((dataset_id(progress_ns, progress_index), user_id, lab_id, status,
+                                          self.timestamp(started_at), None, int(self.rng.expovariate(0.5)), 0))
+                progress_index += 1
+
+            user_rows.append((user_id, username, f'{username}@dataset.cybersib.spt', password_hash, group,
+                              subscription, role, f'https://robohash.org/{username}.png?set=set4',
+                              self.timestamp(created_at), self.timestamp(last_login),
+                              self.rng.random() < 0.97))
+
+            if len(user_rows) + len(solve_rows) + len(progress_rows) >= self.batch_size:
+                flush()
+            if (index + 1) % 100000 == 0:
+                self.log(f'Пользователей: {index + 1}, решений: {solve_index}, прогресса: {progress_index}')
+        flush()
@@ -75,6 +75,50 @@ CREATE TABLE IF NOT EXISTS ctf_solves (
     UNIQUE(user_id, challenge_id)
 );
 
+-- Материализованные очки пользователей (обновляются вместе с решениями)
+CREATE TABLE IF NOT EXISTS user_scores (
+    user_id TEXT PRIMARY KEY,
+    completed_labs INTEGER NOT NULL DEFAULT 0,
+    lab_points INTEGER NOT NULL DEFAULT 0,
+    ctf_solved INTEGER NOT NULL DEFAULT 0,
+    ctf_points INTEGER NOT NULL DEFAULT 0,
+    last_solve_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+);
+
+-- Дневная активность пользователей (обновляется вместе с решениями)
+CREATE TABLE IF NOT EXISTS user_daily_activity (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL, -- YYYY-MM-DD
+    labs_completed INTEGER NOT NULL DEFAULT 0,
+    ctf_solved INTEGER NOT NULL DEFAULT 0,
+    points INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day),
+    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- Счетчики платформы (поддерживаются триггерами и фоновым обновлением)
+CREATE TABLE IF NOT EXISTS platform_counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Версия каталога лабораторий и CTF задач (увеличивается триггерами)
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0);
+
+-- Версии данных пользователей для ETag (увеличиваются триггерами, общие для всех процессов)
+CREATE TABLE IF NOT EXISTS user_data_versions (
+    user_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
 -- Команды
 CREATE TABLE IF NOT EXISTS teams (
     id TEXT PRIMARY KEY,
@@ -200,6 +244,9 @@ CREATE INDEX IF NOT EXISTS idx_ctf_solves_time ON ctf_solves(solved_at);
 CREATE INDEX IF NOT EXISTS idx_activity_user ON activity_logs(user_id);
 CREATE INDEX IF NOT EXISTS idx_activity_time ON activity_logs(created_at);
 
+-- Индексы для отозванных токенов
+CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions(expires_at);
+
 -- ===== ТРИГГЕРЫ =====
 
 -- Триггер для обновления updated_at в labs
@@ -221,6 +268,147 @@ BEGIN
     WHERE id = NEW.challenge_id;
 END;
 
+-- Триггеры версии каталога (solves_count и updated_at не меняют каталог)
+CREATE TRIGGER IF NOT EXISTS catalog_version_labs_insert
+AFTER INSERT ON labs
+BEGIN
+    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS catalog_version_labs_update
+AFTER UPDATE OF title, description, difficulty, category, points, time_estimate_minutes,
+    flag_hash, vm_config_path, content, is_active ON labs
+BEGIN
+    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS catalog_version_labs_delete
+AFTER DELETE ON labs
+BEGIN
+    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS catalog_version_ctf_insert
+AFTER INSERT ON ctf_challenges
+BEGIN
+    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS catalog_version_ctf_update
+AFTER UPDATE OF title, description, category, points, difficulty, flag_hash,
+    hints, files, is_active ON ctf_challenges
+BEGIN
+    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS catalog_version_ctf_delete
+AFTER DELETE ON ctf_challenges
+BEGIN
+    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+END;
+
+-- Триггеры счетчиков платформы
+CREATE TRIGGER IF NOT EXISTS platform_counters_users_insert
+AFTER INSERT ON users
+BEGIN
+    INSERT INTO platform_counters (name, value) VALUES ('users', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1, updated_at = CURRENT_TIMESTAMP;
+    INSERT INTO platform_counters (name, value) VALUES ('subscription:' || NEW.subscription_level, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1, updated_at = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER IF NOT EXISTS platform_counters_users_delete
+AFTER DELETE ON users
+BEGIN
+    UPDATE platform_counters SET value = value - 1, updated_at = CURRENT_TIMESTAMP
+    WHERE name IN ('users', 'subscription:' || OLD.subscription_level);
+END;
+
+CREATE TRIGGER IF NOT EXISTS platform_counters_subscription_update
+AFTER UPDATE OF subscription_level ON users
+WHEN OLD.subscription_level IS NOT NEW.subscription_level
+BEGIN
+    UPDATE platform_counters SET value = value - 1, updated_at = CURRENT_TIMESTAMP
+    WHERE name = 'subscription:' || OLD.subscription_level;
+    INSERT INTO platform_counters (name, value) VALUES ('subscription:' || NEW.subscription_level, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1, updated_at = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER IF NOT EXISTS platform_counters_progress_insert
+AFTER INSERT ON user_progress
+WHEN NEW.status = 'completed'
+BEGIN
+    INSERT INTO platform_counters (name, value) VALUES ('labs_completed', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1, updated_at = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER IF NOT EXISTS platform_counters_progress_update
+AFTER UPDATE OF status ON user_progress
+WHEN (OLD.status = 'completed') != (NEW.status = 'completed')
+BEGIN
+    INSERT INTO platform_counters (name, value)
+    VALUES ('labs_completed', CASE WHEN NEW.status = 'completed' THEN 1 ELSE -1 END)
+    ON CONFLICT(name) DO UPDATE SET value = value + excluded.value, updated_at = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER IF NOT EXISTS platform_counters_progress_delete
+AFTER DELETE ON user_progress
+WHEN OLD.status = 'completed'
+BEGIN
+    UPDATE platform_counters SET value = value - 1, updated_at = CURRENT_TIMESTAMP
+    WHERE name = 'labs_completed';
+END;
+
+CREATE TRIGGER IF NOT EXISTS platform_counters_solves_insert
+AFTER INSERT ON ctf_solves
+BEGIN
+    INSERT INTO platform_counters (name, value) VALUES ('ctf_solved', 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1, updated_at = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER IF NOT EXISTS platform_counters_solves_delete
+AFTER DELETE ON ctf_solves
+BEGIN
+    UPDATE platform_counters SET value = value - 1, updated_at = CURRENT_TIMESTAMP
+    WHERE name = 'ctf_solved';
+END;
+
+-- Триггеры версий данных пользователей
+CREATE TRIGGER IF NOT EXISTS user_data_versions_progress_insert
+AFTER INSERT ON user_progress
+BEGIN
+    INSERT INTO user_data_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_data_versions_progress_update
+AFTER UPDATE ON user_progress
+BEGIN
+    INSERT INTO user_data_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_data_versions_progress_delete
+AFTER DELETE ON user_progress
+BEGIN
+    INSERT INTO user_data_versions (user_id, version) VALUES (OLD.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_data_versions_solves_insert
+AFTER INSERT ON ctf_solves
+BEGIN
+    INSERT INTO user_data_versions (user_id, version) VALUES (NEW.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_data_versions_solves_delete
+AFTER DELETE ON ctf_solves
+BEGIN
+    INSERT INTO user_data_versions (user_id, version) VALUES (OLD.user_id, 1)
+    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+END;
+
 -- Триггер для логирования активности пользователей
 CREATE TRIGGER IF NOT EXISTS log_user_activity
 AFTER UPDATE OF last_login ON users
@@ -0,0 +1,117 @@
+"""
+Потолок числа SQL-запросов для списков лабораторий и CTF задач
+
+Число запросов не должно расти с размером каталога и прогрессом пользователя
+(регрессия N+1). Считается по заголовку X-SQL-Queries, который видят администраторы;
+в него входят и задания запроса, выполненные в потоке записи.
+"""
+
+import hashlib
+import os
+import sys
+import uuid
+
+import pytest
+
+# Хеширование паролей в потоке запроса, без фоновых задач и файлов журналов
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '0')
+os.environ.setdefault('BACKGROUND_TASKS_ENABLED', '0')
+os.environ.setdefault('LOG_ENABLED', '0')
+os.environ.setdefault('ACTIVITY_LOG_ENABLED', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as appmod  # noqa: E402
+
+LISTING_QUERY_CEILING = {
+    '/api/labs': 2,
+    '/api/ctf/challenges': 2,
+}
+# Версия данных пользователя для ETag (читается до обработчика)
+ETAG_QUERIES = 1
+# Построение снимка каталога: версия, лаборатории, задачи
+CATALOG_SNAPSHOT_QUERIES = 3
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = appmod.app
+    previous = app.config['DATABASE']
+    app.config['DATABASE'] = str(tmp_path / 'test.db')
+    app.config['TESTING'] = True
+    appmod.init_db()
+    try:
+        yield app.test_client()
+    finally:
+        app.config['DATABASE'] = previous
+
+
+def admin_headers(client):
+    response = client.post('/api/auth/login', json={'username': 'admin', 'password': 'admin2025'})
+    assert response.status_code == 200, response.get_json()
+    return {'Authorization': f"Bearer {response.get_json()['access_token']}"}, response.get_json()['user']['id']
+
+
+def sql_queries(client, path, headers):
+    response = client.get(path, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return int(response.headers['X-SQL-Queries'])
+
+
+def grow_catalog(user_id, count=50):
+    """Дополнительные лаборатории и задачи, каждая с прогрессом или решением пользователя"""
+    with appmod.app.app_context():
+        db = appmod.get_db()
+        cursor = db.cursor()
+        for i in range(count):
+            lab_id, challenge_id = str(uuid.uuid4()), str(uuid.uuid4())
+            cursor.execute('''
+                INSERT INTO labs (id, title, description, difficulty, category, points, time_estimate_minutes, flag_hash)
+                VALUES (?, ?, ?, 'beginner', 'linux', 10, 30, ?)
+            ''', (lab_id, f'Lab {i}', 'test', hashlib.md5(lab_id.encode()).hexdigest()))
+            cursor.execute('''
+                INSERT INTO ctf_challenges (id, title, description, category, points, difficulty, flag_hash)
+                VALUES (?, ?, ?, 'web', 50, 'easy', ?)
+            ''', (challenge_id, f'Challenge {i}', 'test', hashlib.md5(challenge_id.encode()).hexdigest()))
+            cursor.execute('''
+                INSERT INTO user_progress (id, user_id, lab_id, status, started_at, attempts, score)
+                VALUES (?, ?, ?, 'in_progress', CURRENT_TIMESTAMP, 1, 0)
+            ''', (str(uuid.uuid4()), user_id, lab_id))
+            cursor.execute('''
+                INSERT INTO ctf_solves (id, user_id, challenge_id, flag_submitted)
+                VALUES (?, ?, ?, 'CSIB{test}')
+            ''', (str(uuid.uuid4()), user_id, challenge_id))
+        db.commit()
+
+
+@pytest.mark.parametrize('path', sorted(LISTING_QUERY_CEILING))
+def test_listing_query_ceiling(client, path):
+    headers, _ = admin_headers(client)
+    ceiling = LISTING_QUERY_CEILING[path] + ETAG_QUERIES
+
+    # Первый запрос строит снимок каталога, последующие читают только прогресс пользователя
+    assert sql_queries(client, path, headers) <= ceiling + CATALOG_SNAPSHOT_QUERIES
+    assert sql_queries(client, path, headers) <= ceiling
+
+
+@pytest.mark.parametrize('path', sorted(LISTING_QUERY_CEILING))
+def test_listing_queries_do_not_grow_with_catalog(client, path):
+    headers, user_id = admin_headers(client)
+    sql_queries(client, path, headers)
+    before = sql_queries(client, path, headers)
+
+    grow_catalog(user_id)
+    # Не ждем CATALOG_VERSION_CHECK_SECONDS: снимок перестраивается на следующем запросе
+    appmod.catalog_cache.checked_at = 0.0
+    sql_queries(client, path, headers)
+    after = sql_queries(client, path, headers)
+
+    assert after <= before
+    assert after <= LISTING_QUERY_CEILING[path] + ETAG_QUERIES
+
+
+def test_writer_queries_are_counted(client):
+    headers, _ = admin_headers(client)
+    # INSERT выполняется в потоке записи, но засчитывается запросу, который его поставил
+    response = client.post('/api/feedback', headers=headers, json={'message': 'test', 'type': 'bug'})
+    assert response.status_code == 200, response.get_json()
+    assert int(response.headers['X-SQL-Queries']) >= 1